@@ -1,4 +1,4 @@
-import json
+from vector_codec import decode_vector_dict
 
 class Movie():
 
@@ -7,7 +7,7 @@ class Movie():
         self.title = title
         self.overview = overview
         self.release_date = release_date
-        self.vector = {int(k):v for k, v in json.loads(vector).items()}
+        self.vector = decode_vector_dict(vector) if vector is not None else None
         self.genres = genres
         self.genre_ids = set(genre_ids)
         self.keywords = keywords
@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+from itertools import combinations
+from typing import NamedTuple
+import numpy as np
+from scipy import sparse
+
+import vector_store as vs
+from logger import logger
+
+# random-projection LSH over the movie vectors, for approximate retrieval when the exact candidate set is too big to
+# score on every request
+# each of NUM_TABLES tables hashes a vector to NUM_BITS sign bits (which side of a random hyperplane it falls on);
+# vectors with a small angle between them tend to land in the same bucket. the index is built by the preprocess
+# pipeline into data/vector_store/vN/ann/ so it is always paired with the vectors it was built from
+ANN_DIR = 'ann'
+ANN_MANIFEST = 'ann.json'
+NUM_TABLES = 16
+# bits per table are picked from the catalog size so that an average bucket holds about BUCKET_SIZE movies - more bits
+# means smaller buckets (faster) but nearby vectors are split more often (lower recall)
+BUCKET_SIZE = 128
+MIN_BITS = 6
+MAX_BITS = 16
+SEED = 42
+HASH_BLOCK_ROWS = 65536 # rows hashed per projection, bounds the dense (rows x tables*bits) intermediate
+
+# serve-time knobs: more tables and a larger probe radius find more true neighbours but score more candidates
+# radius 0 only looks in the query's own bucket, radius 1 also probes every bucket one bit flip away, etc.
+DEFAULT_TABLES = NUM_TABLES
+DEFAULT_PROBE_RADIUS = 1
+
+
+
+class AnnIndex(NamedTuple):
+    version: int # vector store version the index was built from
+    planes: np.ndarray # (tables*bits, features) hyperplane normals
+    sorted_codes: np.ndarray # (tables, movies) bucket codes, ascending within each table
+    order: np.ndarray # (tables, movies) matrix row for each entry of sorted_codes
+    num_bits: int
+
+
+# loaded index, replaced as a whole when another store version is mapped
+_loaded = None
+
+
+def hash_vectors(matrix, planes: np.ndarray, num_bits: int, block_rows: int = HASH_BLOCK_ROWS) -> np.ndarray:
+    """
+    computes the bucket code of every row in every table, block_rows rows at a time
+    :param matrix: (rows x features) sparse or dense matrix
+    :param planes: (tables*bits x features) hyperplane normals
+    :param num_bits: bits per table
+    :param block_rows: rows projected at once
+    :return: (rows x tables) uint32 bucket codes
+    """
+    weights = (1 << np.arange(num_bits, dtype=np.uint32))
+    codes = np.empty((matrix.shape[0], planes.shape[0] // num_bits), dtype=np.uint32)
+    for start in range(0, matrix.shape[0], block_rows):
+        bits = np.asarray(matrix[start:start + block_rows] @ planes.T) > 0
+        bits = bits.reshape(bits.shape[0], -1, num_bits)
+        codes[start:start + block_rows] = (bits * weights).sum(axis=2, dtype=np.uint32)
+    return codes
+
+
+def get_num_bits(num_rows: int) -> int:
+    return int(np.clip(round(np.log2(max(num_rows, 1) / BUCKET_SIZE)), MIN_BITS, MAX_BITS))
+
+
+def build_ann_index(version: int, store_dir: str = vs.STORE_DIR, num_tables: int = NUM_TABLES,
+                    num_bits: int = None, seed: int = SEED) -> None:
+    """
+    builds the LSH tables for one version of the vector store and writes them next to it
+    :param version: vector store version to index
+    :param store_dir: root directory of the vector store
+    :param num_tables: number of hash tables
+    :param num_bits: bits per table (default: picked from the catalog size by get_num_bits())
+    :return: None
+    """
+    version_dir = vs.get_version_dir(version, store_dir)
+    with open(os.path.join(version_dir, vs.MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)
+    data, indices, indptr = (np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode='r')
+                             for name in ('data', 'indices', 'indptr'))
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(manifest["rows"], manifest["features"]))
+
+    num_bits = num_bits or get_num_bits(manifest["rows"])
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal((num_tables * num_bits, manifest["features"]), dtype=np.float32)
+    codes = hash_vectors(matrix, planes, num_bits).T # (tables x rows)
+    order = np.argsort(codes, axis=1, kind='stable')
+    sorted_codes = np.take_along_axis(codes, order, axis=1)
+
+    # written to a temp directory and renamed so a reader never sees a half-built index
+    ann_dir = os.path.join(version_dir, ANN_DIR)
+    tmp_dir = ann_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'planes.npy'), planes)
+    np.save(os.path.join(tmp_dir, 'sorted_codes.npy'), sorted_codes)
+    np.save(os.path.join(tmp_dir, 'order.npy'), order.astype(np.int32 if manifest["rows"] < 2**31 else np.int64))
+    with open(os.path.join(tmp_dir, ANN_MANIFEST), 'w') as f:
+        json.dump({"store_version": version, "tables": num_tables, "bits": num_bits, "seed": seed}, f, indent=2)
+    shutil.rmtree(ann_dir, ignore_errors=True)
+    os.rename(tmp_dir, ann_dir)
+    logger(f"ANN index for vector store v{version} written: {num_tables} tables x {num_bits} bits")
+
+
+def has_ann_index(version: int, store_dir: str = vs.STORE_DIR) -> bool:
+    return os.path.exists(os.path.join(vs.get_version_dir(version, store_dir), ANN_DIR, ANN_MANIFEST))
+
+
+def load_ann_index(version: int, store_dir: str = vs.STORE_DIR) -> bool:
+    """
+    memory-maps the LSH tables for a vector store version
+    :return: whether an index was found for that version
+    """
+    return get_index(version, store_dir, reload=True) is not None
+
+
+def get_index(version: int, store_dir: str = vs.STORE_DIR, reload: bool = False) -> AnnIndex | None:
+    """
+    the loaded index if it was built from this vector store version, otherwise maps that version's index and publishes
+    it as the loaded one. callers keep the returned index for the whole query, so a concurrent load of another version
+    can't mix tables from two indexes
+    :param reload: map the index even if this version is already loaded
+    :return: the index, None if that version has none
+    """
+    global _loaded
+
+    index = _loaded
+    if index is not None and index.version == version and not reload:
+        return index
+
+    ann_dir = os.path.join(vs.get_version_dir(version, store_dir), ANN_DIR)
+    try:
+        with open(os.path.join(ann_dir, ANN_MANIFEST), 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    index = AnnIndex(
+        version,
+        np.load(os.path.join(ann_dir, 'planes.npy'), mmap_mode='r'),
+        np.load(os.path.join(ann_dir, 'sorted_codes.npy'), mmap_mode='r'),
+        np.load(os.path.join(ann_dir, 'order.npy'), mmap_mode='r'),
+        manifest["bits"]
+    )
+    _loaded = index
+    logger(f"Mapped ANN index for vector store v{version}: {manifest['tables']} tables x {manifest['bits']} bits")
+    return index
+
+
+def get_version() -> int | None:
+    # vector store version of the loaded index, None if nothing is loaded
+    index = _loaded
+    return index.version if index is not None else None
+
+
+def get_probe_codes(code: int, num_bits: int, radius: int) -> list[int]:
+    # every bucket code within 'radius' bit flips of 'code'
+    probes = [code]
+    for r in range(1, radius + 1):
+        for flipped in combinations(range(num_bits), r):
+            probes.append(code ^ sum(1 << b for b in flipped))
+    return probes
+
+
+def query(composite: np.ndarray, tables: int = DEFAULT_TABLES, radius: int = DEFAULT_PROBE_RADIUS,
+          index: AnnIndex = None) -> np.ndarray:
+    """
+    finds the matrix rows that share a bucket with the composite vector in any of the first 'tables' tables
+    :param composite: dense normalized composite vector
+    :param tables: how many tables to probe (recall/latency knob)
+    :param radius: Hamming radius probed within each table (recall/latency knob)
+    :param index: index from get_index() (default: the loaded one)
+    :return: sorted array of candidate matrix rows
+    """
+    if index is None:
+        index = _loaded
+    tables = min(tables, index.sorted_codes.shape[0])
+    codes = hash_vectors(composite.reshape(1, -1), index.planes[:tables * index.num_bits], index.num_bits)[0]
+
+    found = []
+    for t in range(tables):
+        probes = np.array(get_probe_codes(int(codes[t]), index.num_bits, radius), dtype=np.uint32)
+        starts = np.searchsorted(index.sorted_codes[t], probes, side='left')
+        ends = np.searchsorted(index.sorted_codes[t], probes, side='right')
+        found.extend(index.order[t, s:e] for s, e in zip(starts, ends) if e > s)
+
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(found))
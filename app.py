@@ -1,11 +1,60 @@
-from flask import Flask, render_template, abort, request
+import os
+import sqlite3
+from flask import Flask, render_template, abort, request, jsonify
 
+from CustomExceptions import InvalidListLength
+
+import cache_helper as ch
 import database_helper as dbh
+import index_helper as ih
+import matrix_helper as mh
+import metrics_helper as metrics
+import title_index as ti
 import vector_helper as vh
 from logger import logger
+from preprocess import database_setup
 
 app = Flask(__name__)
 
+# databases written by older preprocess runs are brought up to the current schema before anything reads them
+# (request connections are read-only, so this uses a short-lived writable one)
+if os.path.exists(dbh.DB_FILE):
+    try:
+        conn = sqlite3.connect(dbh.DB_FILE)
+        database_setup.upgrade_schema(conn.cursor())
+        conn.commit()
+        conn.close()
+    except sqlite3.Error as e:
+        logger(f"Unable to upgrade the schema of {dbh.DB_FILE}:\n{e}", type='e')
+
+# load every movie vector and the candidate/title indexes into memory once at startup rather than querying on each request
+# (reloaded by vh.sync_loaded_data() when a preprocess run publishes new data)
+vh.sync_loaded_data() # records the version first, data published during the loads below triggers another reload
+if os.path.exists(dbh.DB_FILE):
+    if vh.SCORING_MODE == 'matrix':
+        mh.load_vector_matrix()
+        ih.load_index()
+    ti.load_title_index()
+
+@app.before_request
+def start_request_metrics():
+    metrics.begin_request()
+
+
+@app.before_request
+def refresh_loaded_data():
+    vh.sync_loaded_data()
+    vh.pin_loaded_data() # a reload published mid-request only affects later requests
+
+
+def get_scoring_mode() -> str | None:
+    # optional per-request override of vh.SCORING_MODE, from the query string or a form field named "mode"
+    mode = request.values.get("mode")
+    if mode and mode not in vh.SCORING_MODES:
+        abort(400)
+    return mode or None
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -25,9 +74,6 @@ def your_movies():
 
 @app.route("/parse_user_movies/", methods=["POST"])
 def parse_user_movies():
-    #--TODO: modify database to store a "normalized" movie title (remove spaces, punctuation, etc)
-    #--TODO: then normalize user queries and search the database for a partial/full match
-
     alerts = []
     # determines whether we can proceed with the recommendations or if we need clarification from the user
     user_movie_titles = request.form.getlist("movie_titles")
@@ -46,7 +92,7 @@ def parse_user_movies():
 
     for title in user_movie_titles:
         # each result row is a Row_factory, contains "id", "title", "release_date"
-        # runs exact and approximate SELECT queries to try and find matches with slightly decreasing precision
+        # runs exact, prefix and substring queries on the normalized title to find matches with decreasing precision
         results = dbh.get_potential_title_matches(title)
 
         if len(results) == 1: # only one match in the database, grab it and go
@@ -59,6 +105,19 @@ def parse_user_movies():
         else: # no matches found
             missing_matches.append(title)
 
+    # typo-tolerant fallback: every unmatched title is resolved against the trigram index in one pass, and any
+    # suggestions go to the confirmation page like other partial matches
+    if missing_matches:
+        suggestions = ti.match_titles(missing_matches)
+        suggested_rows = dbh.get_title_rows_by_ids(list({m for s in suggestions for m, _ in s}))
+        still_missing = []
+        for title, suggested in zip(missing_matches, suggestions):
+            if suggested:
+                partial_matches.append([title, [suggested_rows[m] for m, _ in suggested if m in suggested_rows]])
+            else:
+                still_missing.append(title)
+        missing_matches = still_missing
+
     # TODO: bring in Bootstrap CSS and display pretty alerts at the top of the page
     # TODO: or pass this to a custom error page that redirects to your_movies.html because the below block keeps
     # TODO:     /parse_user_movies in the URL bar, which would throw an error if the user hits refresh
@@ -73,7 +132,7 @@ def parse_user_movies():
 
     elif exact_matches: # fallback condition: everything matched exactly
         user_movie_ids = [int(movie["id"]) for movie in exact_matches]
-        return render_template("recommendations.html", user_movies = dbh.get_movies_by_ids(user_movie_ids), recs = vh.get_recommendations_by_ids(user_movie_ids))
+        return render_template("recommendations.html", user_movies = dbh.get_movies_by_ids(user_movie_ids, load_vectors=False, load_keywords=False), recs = vh.get_recommendations_by_ids(user_movie_ids, mode=get_scoring_mode()))
 
     else: abort(500)
 
@@ -91,7 +150,7 @@ def process_confirmation():
     for key in request.form:
         if key.startswith("partial_"):
             user_movie_ids.append(int(request.form[key]))
-    return render_template("recommendations.html", user_movies = dbh.get_movies_by_ids(user_movie_ids), recs = vh.get_recommendations_by_ids(user_movie_ids))
+    return render_template("recommendations.html", user_movies = dbh.get_movies_by_ids(user_movie_ids, load_vectors=False, load_keywords=False), recs = vh.get_recommendations_by_ids(user_movie_ids, mode=get_scoring_mode()))
 
 
 @app.route("/process_confirmation/", methods=["GET"])
@@ -99,6 +158,57 @@ def process_confirmations_get(): # invalid request
     abort(405)
 
 
+@app.route("/api/recommendations", methods=["POST"])
+def api_recommendations():
+    """
+    scores many profiles in one call\n
+    expects a JSON body of the form {"profiles": [[movie_id, ...], ...], "n": 5}
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error="Expected a JSON object body"), 400
+
+    profiles = payload.get("profiles")
+    n = payload.get("n", 5)
+    if (not isinstance(profiles, list)
+            or not all(isinstance(p, list) and p and all(vh.is_movie_id(i) for i in p) for p in profiles)):
+        return jsonify(error="'profiles' must be a list of non-empty lists of movie ids"), 400
+    if not isinstance(n, int) or isinstance(n, bool) or not 1 <= n <= vh.MAX_BATCH_N:
+        return jsonify(error=f"'n' must be an integer between 1 and {vh.MAX_BATCH_N}"), 400
+
+    try:
+        results = vh.get_batch_recommendations(profiles, n=n)
+    except InvalidListLength as e:
+        return jsonify(error=e.message), 400
+
+    return jsonify(results=results)
+
+
+@app.route("/api/cache_stats", methods=["GET"])
+def api_cache_stats():
+    # hit/miss/eviction counters of the recommendation cache
+    cache = ch.get_cache()
+    return jsonify(enabled=cache is not None, **(cache.stats() if cache is not None else {}))
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # stage latencies, candidate-set sizes and SQL query counts in Prometheus text format
+    if not metrics.METRICS_ENABLED:
+        abort(404)
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@app.teardown_request
+def finish_request_metrics(exception): # labelled by route pattern so ids in the URL don't create new series
+    metrics.end_request(request.url_rule.rule if request.url_rule is not None else "unmatched")
+
+
+@app.teardown_request
+def release_loaded_data(exception):
+    vh.unpin_loaded_data()
+
+
 @app.teardown_appcontext
-def teardown_db(exception): # closes db connection between page loads
+def teardown_db(exception): # returns the request's db connection to the pool
     dbh.close_db()
\ No newline at end of file
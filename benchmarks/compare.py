@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import generate_data as gd
+import run_benchmarks as rb
+
+# compares two run_benchmarks.py result files, or benchmarks two git revisions on the same data set and compares them:
+#   python benchmarks/compare.py bench_base.json bench_head.json
+#   python benchmarks/compare.py --revisions main HEAD --rows 100k
+# revisions are checked out into temporary git worktrees, the benchmark code itself always comes from this checkout
+
+DEFAULT_THRESHOLD = 0.10 # relative change in median reported as a regression / improvement
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        document = json.load(f)
+    if document.get("schema") != rb.RESULTS_SCHEMA:
+        exit(f"{path}: unsupported results schema {document.get('schema')}, expected {rb.RESULTS_SCHEMA}")
+    return document
+
+
+def compare(base: dict, head: dict, threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """
+    pairs up the benchmarks of two result documents by name
+    :param threshold: relative change in median beyond which a benchmark counts as a regression or improvement
+    :return: one dict per benchmark with both medians, the ratio head/base and a verdict
+    """
+    rows = []
+    for name in sorted(set(base["benchmarks"]) | set(head["benchmarks"])):
+        before = base["benchmarks"].get(name, {}).get("median")
+        after = head["benchmarks"].get(name, {}).get("median")
+        if before is None or after is None:
+            verdict, ratio = ("new" if before is None else "removed"), None
+        else:
+            ratio = after / before if before > 0 else float('inf')
+            verdict = "slower" if ratio > 1 + threshold else "faster" if ratio < 1 - threshold else "same"
+        rows.append({"benchmark": name, "base": before, "head": after, "ratio": ratio, "verdict": verdict})
+    return rows
+
+
+def print_comparison(base: dict, head: dict, rows: list[dict]) -> None:
+    def describe(document):
+        revision = document.get("revision") or {}
+        commit = (revision.get("commit") or "unknown")[:10] + ("+dirty" if revision.get("dirty") else "")
+        return f"{commit} ({document['dataset'].get('movies', '?')} movies)"
+
+    print(f"base: {describe(base)}\nhead: {describe(head)}\n")
+    print(f"{'benchmark':<40} {'base ms':>11} {'head ms':>11} {'change':>8}  verdict")
+    for row in rows:
+        base_ms = f"{row['base'] * 1000:.3f}" if row['base'] is not None else "-"
+        head_ms = f"{row['head'] * 1000:.3f}" if row['head'] is not None else "-"
+        change = f"{(row['ratio'] - 1) * 100:+.1f}%" if row['ratio'] is not None else "-"
+        print(f"{row['benchmark']:<40} {base_ms:>11} {head_ms:>11} {change:>8}  {row['verdict']}")
+    for label, document in (("base", base), ("head", head)):
+        # keyed by task when a whole task failed, by benchmark name when only that benchmark did
+        for name, error in document.get("errors", {}).items():
+            print(f"{label} {name} failed: {error}")
+
+
+def benchmark_revision(revision: str, data_file: str, args: argparse.Namespace, scratch: str) -> dict:
+    # checks 'revision' out into a worktree and runs the suite against it
+    worktree = os.path.join(scratch, f"tree_{revision.replace('/', '_')}")
+    subprocess.run(["git", "-C", rb.PROJECT_ROOT, "worktree", "add", "--detach", worktree, revision], check=True,
+                   capture_output=True)
+    output = os.path.join(scratch, f"results_{revision.replace('/', '_')}.json")
+    try:
+        print(f"Benchmarking {revision}")
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_benchmarks.py"),
+                        "--repo", worktree, "--data", data_file, "--iterations", str(args.iterations),
+                        "--seed", str(args.seed), "--output", output], check=True)
+    finally:
+        subprocess.run(["git", "-C", rb.PROJECT_ROOT, "worktree", "remove", "--force", worktree], capture_output=True)
+    return load_results(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results of two runs or two git revisions")
+    parser.add_argument("results", nargs='*', help="base and head result files from run_benchmarks.py")
+    parser.add_argument("--revisions", nargs=2, metavar=("BASE", "HEAD"), help="benchmark two git revisions instead")
+    parser.add_argument("--rows", type=gd.parse_rows, default=gd.SIZES['10k'], help=f"synthetic row count, or one of {list(gd.SIZES)}")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per lookup benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative change counted as slower/faster")
+    parser.add_argument("--output", default=None, help="also write the comparison as JSON")
+    args = parser.parse_args()
+
+    if args.revisions:
+        scratch = tempfile.mkdtemp(prefix="movie_recommender_compare_")
+        try:
+            # both revisions read the same file, generated once
+            data_file = os.path.join(scratch, "data.csv")
+            print(f"Generating {args.rows} synthetic rows")
+            gd.write_dataset(data_file, args.rows, args.seed)
+            base, head = (benchmark_revision(revision, data_file, args, scratch) for revision in args.revisions)
+            for document in (base, head):
+                document["dataset"]["rows"] = args.rows
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    elif len(args.results) == 2:
+        base, head = load_results(args.results[0]), load_results(args.results[1])
+    else:
+        parser.error("pass two result files, or --revisions BASE HEAD")
+
+    rows = compare(base, head, args.threshold)
+    print_comparison(base, head, rows)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"base": base, "head": head, "comparison": rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# writes a synthetic stand-in for the Kaggle TMDB CSV so preprocessing and the webapp can be benchmarked without the
+# real download:
+#   python benchmarks/generate_data.py --rows 100k --output data/data.csv
+# every column of the real file is present (preprocess/main.py only reads CSV_COLUMNS). keyword popularity follows a
+# Zipf distribution, genres use frequencies close to the real data, and - as in the real file, which keeps about 5% -
+# most rows are rejected by filter_movies() (roughly 8% pass)
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+CHUNK_ROWS = 100_000 # rows generated and written at a time, keeps 1M-row runs in bounded memory
+
+CSV_HEADER = ['id', 'title', 'vote_average', 'vote_count', 'status', 'release_date', 'revenue', 'runtime', 'adult',
+              'backdrop_path', 'budget', 'homepage', 'imdb_id', 'original_language', 'original_title', 'overview',
+              'popularity', 'poster_path', 'tagline', 'genres', 'production_companies', 'production_countries',
+              'spoken_languages', 'keywords']
+
+# share of movies tagged with each genre in the real data set, roughly
+GENRE_WEIGHTS = {
+    'Drama': 0.30, 'Documentary': 0.17, 'Comedy': 0.16, 'Animation': 0.07, 'Horror': 0.06, 'Romance': 0.06,
+    'Music': 0.05, 'Thriller': 0.05, 'Action': 0.05, 'Crime': 0.04, 'Family': 0.03, 'TV Movie': 0.03,
+    'Adventure': 0.025, 'Fantasy': 0.025, 'Science Fiction': 0.02, 'Mystery': 0.02, 'History': 0.015,
+    'War': 0.01, 'Western': 0.01,
+}
+KEYWORD_ZIPF_EXPONENT = 1.1 # rank r keyword is used in proportion to 1 / r^s
+KEYWORDS_PER_MOVIE = 8 # mean number of keywords on movies that have any
+LANGUAGES = ['en', 'fr', 'es', 'de', 'ja', 'it', 'ko', 'zh', 'pt', 'ru']
+LANGUAGE_WEIGHTS = [0.45, 0.09, 0.09, 0.07, 0.07, 0.06, 0.05, 0.05, 0.04, 0.03]
+
+WORDS = """
+love night dark man woman girl boy city house dead last first blood war king queen time world life death story
+return secret lost black white red blue golden silent wild little big great old new young brother sister father
+mother daughter son family home road river sea island mountain summer winter spring autumn star moon sun fire
+ice storm shadow ghost devil angel heart soul mind dream game murder killer hunter soldier doctor stranger friend
+enemy hero legend journey escape revenge promise truth lie kiss song dance music paris london tokyo rome texas
+prison school hotel train ship forest desert space planet alien machine monster dragon sword gun money power
+empire kingdom revolution street party wedding holiday christmas midnight morning evening tomorrow yesterday
+""".split()
+
+
+def get_keyword_vocabulary(size: int) -> np.ndarray:
+    # distinct two-word phrases, most popular first - real keywords are short phrases like "based on novel or book"
+    n = len(WORDS)
+    ranks = np.arange(size)
+    first, second = ranks % n, (ranks // n + ranks) % n
+    return np.array([f"{WORDS[a]} {WORDS[b]}" if a != b else WORDS[a] for a, b in zip(first, second)], dtype=object)
+
+
+def sample_lists(rng: np.random.Generator, vocabulary: np.ndarray, weights: np.ndarray, counts: np.ndarray) -> list[str]:
+    # one comma-separated list per row, 'counts[i]' distinct entries drawn by weight
+    picks = rng.choice(len(vocabulary), size=int(counts.sum()), p=weights)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    return [", ".join(vocabulary[np.unique(picks[bounds[i]:bounds[i + 1]])]) for i in range(len(counts))]
+
+
+def generate_chunk(rng: np.random.Generator, start_id: int, rows: int, keywords: np.ndarray, keyword_weights: np.ndarray) -> pd.DataFrame:
+    """
+    builds one block of synthetic movies
+    :param rng: numpy random generator, shared between chunks so the output only depends on the seed
+    :param start_id: id of the first movie in the block
+    :param rows: number of movies to generate
+    :param keywords: keyword vocabulary, most popular first
+    :param keyword_weights: probability of each keyword
+    :return: DataFrame with the columns of the real CSV
+    """
+    ids = np.arange(start_id, start_id + rows)
+
+    # titles repeat words heavily, so exact, prefix and substring searches all find several candidates
+    title_words = rng.choice(WORDS, size=(rows, 4))
+    title_lengths = rng.integers(1, 5, size=rows)
+    titles = [" ".join(words[:length]).title() for words, length in zip(title_words, title_lengths)]
+    sequels = rng.random(rows) < 0.05
+    titles = [f"{t} {rng.integers(2, 5)}" if sequel else t for t, sequel in zip(titles, sequels)]
+
+    # vote counts are heavy-tailed: most movies have a handful, a few have tens of thousands
+    vote_count = np.floor(rng.pareto(0.9, size=rows) * 8).astype(np.int64)
+    runtime = np.clip(rng.normal(98, 28, size=rows), 0, 400).round()
+    runtime[rng.random(rows) < 0.1] = 0 # missing runtimes are stored as 0 in the real data
+    years = np.clip(rng.normal(2000, 22, size=rows).astype(int), 1890, 2025)
+    release_date = [f"{y}-{m:02d}-{d:02d}" for y, m, d in zip(years, rng.integers(1, 13, size=rows), rng.integers(1, 29, size=rows))]
+    release_date = np.where(rng.random(rows) < 0.05, "", release_date)
+
+    overview_lengths = np.where(rng.random(rows) < 0.15, 0, rng.integers(3, 60, size=rows))
+    overview_words = rng.choice(WORDS, size=(rows, 60))
+    overviews = [" ".join(words[:length]).capitalize() + "." if length else "" for words, length in zip(overview_words, overview_lengths)]
+
+    genre_names = np.array(list(GENRE_WEIGHTS), dtype=object)
+    genre_weights = np.array(list(GENRE_WEIGHTS.values()))
+    genre_counts = np.where(rng.random(rows) < 0.1, 0, rng.integers(1, 4, size=rows))
+    genres = sample_lists(rng, genre_names, genre_weights / genre_weights.sum(), genre_counts)
+
+    keyword_counts = np.where(rng.random(rows) < 0.3, 0, 1 + rng.poisson(KEYWORDS_PER_MOVIE - 1, size=rows))
+    movie_keywords = sample_lists(rng, keywords, keyword_weights, keyword_counts)
+
+    languages = rng.choice(LANGUAGES, size=rows, p=LANGUAGE_WEIGHTS)
+    return pd.DataFrame({
+        'id': ids,
+        'title': titles,
+        'vote_average': np.where(vote_count > 0, rng.uniform(1, 10, size=rows).round(3), 0.0),
+        'vote_count': vote_count,
+        'status': rng.choice(['Released', 'Post Production', 'In Production', 'Planned'], size=rows, p=[0.94, 0.03, 0.02, 0.01]),
+        'release_date': release_date,
+        'revenue': np.where(rng.random(rows) < 0.1, rng.integers(1, 10**9, size=rows), 0),
+        'runtime': runtime.astype(np.int64),
+        'adult': rng.random(rows) < 0.03,
+        'backdrop_path': [f"/{i:x}b.jpg" for i in ids],
+        'budget': np.where(rng.random(rows) < 0.1, rng.integers(1, 3 * 10**8, size=rows), 0),
+        'homepage': "",
+        'imdb_id': [f"tt{i:07d}" for i in ids],
+        'original_language': languages,
+        'original_title': titles,
+        'overview': overviews,
+        'popularity': (rng.pareto(1.5, size=rows) * 2).round(3),
+        'poster_path': [f"/{i:x}p.jpg" for i in ids],
+        'tagline': "",
+        'genres': genres,
+        'production_companies': "",
+        'production_countries': "",
+        'spoken_languages': "",
+        'keywords': movie_keywords,
+    }, columns=CSV_HEADER)
+
+
+def write_dataset(output_file: str, rows: int, seed: int = 0) -> None:
+    """
+    writes 'rows' synthetic movies to a CSV file in the layout of the Kaggle data set
+    :param output_file: path of the CSV file, parent directories are created
+    :param rows: number of movies
+    :param seed: random seed, the same seed and row count always produce the same file
+    """
+    rng = np.random.default_rng(seed)
+    # the real data has roughly one distinct keyword per 15 movies
+    vocabulary_size = max(500, rows // 15)
+    keywords = get_keyword_vocabulary(vocabulary_size)
+    keyword_weights = 1.0 / np.arange(1, vocabulary_size + 1) ** KEYWORD_ZIPF_EXPONENT
+    keyword_weights /= keyword_weights.sum()
+
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk = generate_chunk(rng, start + 1, min(CHUNK_ROWS, rows - start), keywords, keyword_weights)
+        chunk.to_csv(output_file, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def parse_rows(value: str) -> int:
+    # "10k", "100k", "1m" or a plain row count
+    return SIZES[value.lower()] if value.lower() in SIZES else int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic movie CSV for benchmarking")
+    parser.add_argument("--rows", type=parse_rows, default=SIZES['10k'], help=f"row count, or one of {list(SIZES)}")
+    parser.add_argument("--output", default='data/data.csv', help="CSV file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_dataset(args.output, args.rows, args.seed)
+    print(f"Wrote {args.rows} rows to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
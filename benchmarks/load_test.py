@@ -0,0 +1,326 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, urlencode, urlsplit
+
+# replays a mix of title submissions (/parse_user_movies/) and confirmed-id submissions (/process_confirmation/) against
+# the webapp from several concurrent clients, and reports throughput, latency percentiles and error rate per route:
+#   python benchmarks/load_test.py --concurrency 16 --duration 60 --save-baseline load_baseline.json
+#   python benchmarks/load_test.py --concurrency 16 --duration 60 --baseline load_baseline.json
+# by default the app is started with 'flask run' from the project root, so it serves the local movie_recommender.db -
+# use --data-dir to serve a database elsewhere (e.g. a run_benchmarks.py --keep directory) or --url for a server that
+# is already running. with --rate, requests are sent on a fixed schedule and latency is measured from the time each
+# one was due, so a server that falls behind shows it in the percentiles instead of silently slowing the clients down
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_FILE = 'movie_recommender.db'
+ROUTES = ('/parse_user_movies/', '/process_confirmation/')
+PERCENTILES = (50, 95, 99)
+REQUEST_TIMEOUT = 30 # seconds before a request counts as failed
+STARTUP_TIMEOUT = 120 # seconds to wait for the started app to answer (it loads its indexes on startup)
+# a run fails against a baseline when a route's p95/p99 latency grows, or its throughput drops, by more than the
+# tolerance, or when its error rate rises by more than ERROR_RATE_TOLERANCE
+DEFAULT_LATENCY_TOLERANCE = 0.20
+ERROR_RATE_TOLERANCE = 0.01
+
+
+def load_request_data(db_file: str, seed: int) -> tuple[list[str], list[int]]:
+    """
+    reads the titles and ids that requests are drawn from
+    :param db_file: database the app serves
+    :param seed: shuffles the lists reproducibly
+    :return: (movie titles, ids of movies that can be scored)
+    """
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_file))}?mode=ro", uri=True)
+    titles = [r[0] for r in conn.execute("SELECT title FROM movies ORDER BY id")]
+    movie_ids = [r[0] for r in conn.execute("SELECT movie_id FROM movies_keywords GROUP BY movie_id HAVING COUNT(*) > 1 ORDER BY movie_id")]
+    conn.close()
+    if not titles or not movie_ids:
+        exit(f"No movies in {db_file} - run preprocess/main.py first")
+
+    rng = random.Random(seed)
+    rng.shuffle(titles)
+    rng.shuffle(movie_ids)
+    return titles, movie_ids
+
+
+def make_typo(title: str, rng: random.Random) -> str:
+    # swaps two neighbouring characters, so the title goes through the typo-tolerant fallback
+    if len(title) < 2:
+        return title
+    i = rng.randrange(len(title) - 1)
+    return title[:i] + title[i + 1] + title[i] + title[i + 2:]
+
+
+def build_request(rng: random.Random, titles: list[str], movie_ids: list[int], args: argparse.Namespace) -> tuple[str, str]:
+    """
+    draws one request of the mix
+    :return: (route, url-encoded form body)
+    """
+    if rng.random() < args.confirmation_share:
+        ids = rng.sample(movie_ids, min(len(movie_ids), rng.randint(1, args.max_movies)))
+        return '/process_confirmation/', urlencode({"confirmed_ids": ids}, doseq=True)
+
+    picked = rng.sample(titles, min(len(titles), rng.randint(1, args.max_movies)))
+    picked = [make_typo(t, rng) if rng.random() < args.typo_share else t for t in picked]
+    return '/parse_user_movies/', urlencode({"movie_titles": picked}, doseq=True)
+
+
+def percentile(ordered: list[float], p: float) -> float:
+    # nearest-rank percentile of an already sorted list
+    if not ordered:
+        return float('nan')
+    return ordered[max(0, min(len(ordered), math.ceil(p / 100 * len(ordered))) - 1)]
+
+
+class LoadRunner:
+    """sends the request mix from 'concurrency' threads, each with its own keep-alive connection"""
+
+    def __init__(self, url: str, titles: list[str], movie_ids: list[int], args: argparse.Namespace):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.titles = titles
+        self.movie_ids = movie_ids
+        self.args = args
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.results = [] # (route, due time, end time, ok)
+        self.start = None
+
+    def claim(self) -> int | None:
+        # next request number, None once the run is over
+        with self.lock:
+            index = self.next_index
+            if self.args.requests and index >= self.args.requests:
+                return None
+            self.next_index += 1
+        return index
+
+    def due_time(self, index: int) -> float:
+        # with a rate, request i is due at a fixed offset from the start; otherwise as soon as a client is free
+        return self.start + index / self.args.rate if self.args.rate else time.perf_counter()
+
+    def worker(self, worker_id: int) -> None:
+        rng = random.Random(f"{self.args.seed}-{worker_id}")
+        connection = None
+        deadline = self.start + self.args.warmup + self.args.duration
+        while True:
+            index = self.claim()
+            if index is None:
+                break
+            due = self.due_time(index)
+            if due >= deadline:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            route, body = build_request(rng, self.titles, self.movie_ids, self.args)
+            ok = False
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+                connection.request("POST", route, body, {"Content-Type": "application/x-www-form-urlencoded"})
+                response = connection.getresponse()
+                response.read()
+                ok = 200 <= response.status < 400
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException):
+                if connection is not None:
+                    connection.close()
+                connection = None
+            end = time.perf_counter()
+
+            with self.lock:
+                self.results.append((route, due, end, ok))
+
+        if connection is not None:
+            connection.close()
+
+    def run(self) -> list[tuple]:
+        self.start = time.perf_counter()
+        threads = [threading.Thread(target=self.worker, args=(i,), daemon=True) for i in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # requests due during the warm-up aren't reported
+        return [r for r in self.results if r[1] >= self.start + self.args.warmup]
+
+
+def summarize(results: list[tuple]) -> dict:
+    """
+    :param results: (route, due time, end time, ok) per measured request
+    :return: {"routes": {route: stats}, "total": stats}, latencies in milliseconds
+    """
+    def stats(rows):
+        if not rows:
+            return {"requests": 0}
+        latencies = sorted((end - due) * 1000 for _, due, end, _ in rows)
+        errors = sum(1 for *_, ok in rows if not ok)
+        elapsed = max(end for _, _, end, _ in rows) - min(due for _, due, _, _ in rows)
+        summary = {
+            "requests": len(rows),
+            "errors": errors,
+            "error_rate": errors / len(rows),
+            "throughput": len(rows) / elapsed if elapsed > 0 else float('nan'),
+            "mean_ms": sum(latencies) / len(latencies),
+        }
+        summary.update({f"p{p}_ms": percentile(latencies, p) for p in PERCENTILES})
+        return summary
+
+    routes = {route: stats([r for r in results if r[0] == route]) for route in ROUTES}
+    return {"routes": {route: s for route, s in routes.items() if s["requests"]}, "total": stats(results)}
+
+
+def print_report(report: dict) -> None:
+    header = f"{'route':<24} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}"
+    print(header)
+    for route, s in [*report["routes"].items(), ("total", report["total"])]:
+        if not s["requests"]:
+            continue
+        print(f"{route:<24} {s['requests']:>8} {s['throughput']:>8.1f} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} "
+              f"{s['p99_ms']:>9.2f} {s['error_rate'] * 100:>7.2f}%")
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    compares every route (and the total) of a run with a saved baseline
+    :param tolerance: allowed relative growth in p95/p99 latency, or drop in throughput
+    :return: one message per regression, empty if the run is within the baseline
+    """
+    regressions = []
+    current_routes = {**report["routes"], "total": report["total"]}
+    for route, before in {**baseline["routes"], "total": baseline["total"]}.items():
+        after = current_routes.get(route)
+        if not before.get("requests"):
+            continue
+        if not after or not after.get("requests"):
+            regressions.append(f"{route}: no requests in this run")
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if after[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{route}: {key} {after[key]:.2f} > baseline {before[key]:.2f} (+{tolerance:.0%} allowed)")
+        # throughput only says something about the server when the clients weren't held to a fixed rate
+        if not baseline["settings"].get("rate") and after["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{route}: throughput {after['throughput']:.1f}/s < baseline {before['throughput']:.1f}/s "
+                               f"(-{tolerance:.0%} allowed)")
+        if after["error_rate"] > before["error_rate"] + ERROR_RATE_TOLERANCE:
+            regressions.append(f"{route}: error rate {after['error_rate']:.2%} > baseline {before['error_rate']:.2%}")
+    return regressions
+
+
+def start_server(data_dir: str, port: int, log_file) -> subprocess.Popen:
+    # 'flask run' in the data directory, so DB_FILE and the vector store resolve there
+    command = [sys.executable, "-m", "flask", "--app", os.path.join(PROJECT_ROOT, "app.py"), "run",
+               "--host", "127.0.0.1", "--port", str(port), "--no-reload", "--no-debugger", "--with-threads"]
+    return subprocess.Popen(command, cwd=data_dir, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def wait_for_server(url: str, server: subprocess.Popen | None, timeout: float = STARTUP_TIMEOUT) -> None:
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"the app exited during startup with status {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=5)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.25)
+    raise RuntimeError(f"no answer from {url} after {timeout} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the webapp with concurrent title and confirmation submissions")
+    parser.add_argument("--url", default=None, help="server to test, e.g. http://127.0.0.1:5000 (default: start one)")
+    parser.add_argument("--data-dir", default=PROJECT_ROOT, help=f"directory holding {DB_FILE} and data/ (default: project root)")
+    parser.add_argument("--port", type=int, default=5055, help="port for the started app")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second across all clients, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured, after the warm-up")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of requests sent first and not reported")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 for no limit)")
+    parser.add_argument("--confirmation-share", type=float, default=0.5, help="share of requests sent to /process_confirmation/")
+    parser.add_argument("--typo-share", type=float, default=0.1, help="share of submitted titles with a typo")
+    parser.add_argument("--max-movies", type=int, default=3, help="most movies per submission")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    parser.add_argument("--save-baseline", default=None, metavar="FILE", help="save this run as the baseline")
+    parser.add_argument("--baseline", default=None, metavar="FILE", help="fail if this run regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_LATENCY_TOLERANCE,
+                        help="allowed relative p95/p99 growth or throughput drop against the baseline")
+    args = parser.parse_args()
+
+    titles, movie_ids = load_request_data(os.path.join(args.data_dir, DB_FILE), args.seed)
+
+    server = None
+    url = args.url or f"http://127.0.0.1:{args.port}"
+    server_log = tempfile.TemporaryFile() if args.url is None else None
+    try:
+        if args.url is None:
+            print(f"Starting the app from {args.data_dir} on port {args.port}")
+            server = start_server(args.data_dir, args.port, server_log)
+        wait_for_server(url, server)
+
+        print(f"Running for {args.warmup:g}s warm-up + {args.duration:g}s with {args.concurrency} clients"
+              + (f" at {args.rate:g} requests/s" if args.rate else ""))
+        results = LoadRunner(url, titles, movie_ids, args).run()
+
+    except RuntimeError as e:
+        if server_log is not None:
+            server_log.seek(0)
+            print(server_log.read().decode(errors='replace')[-2000:])
+        exit(f"Error: {e}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = summarize(results)
+    report.update({
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "settings": {key: getattr(args, key) for key in ("concurrency", "rate", "duration", "warmup", "requests",
+                                                          "confirmation_share", "typo_share", "max_movies", "seed")},
+    })
+    print_report(report)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+    if args.save_baseline:
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != report["settings"]:
+            print("Warning: the baseline was recorded with different settings, comparisons may not be meaningful")
+        regressions = find_regressions(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print("Within the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import generate_data as gd
+
+# times the preprocessing pipeline and the webapp's hot paths against a synthetic data set (generate_data.py), and
+# writes the results as JSON so two runs - e.g. two git revisions, see compare.py - can be compared:
+#   python benchmarks/run_benchmarks.py --rows 100k --output bench_head.json
+#   python benchmarks/run_benchmarks.py --repo ../movie_recommender_base --rows 100k --output bench_base.json
+# everything runs in a scratch working directory, since the pipeline and webapp read and write paths relative to the
+# current directory (data/, movie_recommender.db, static/images). each group of benchmarks runs in its own
+# interpreter, so every run starts from cold module state (older revisions also have a preprocess/logger.py that
+# would shadow the webapp's logger)
+
+RESULTS_SCHEMA = 1
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_FILE = 'movie_recommender.db'
+TASKS = ('preprocess', 'queries', 'vectors')
+INCREMENTAL_SHARE = 0.01 # share of the vectors cleared for the incremental import_vector_data benchmark
+
+
+def summarize(samples: list[float]) -> dict:
+    # timing statistics for one benchmark, in seconds
+    ordered = sorted(samples)
+    return {
+        "unit": "seconds",
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def time_calls(func, args_list: list, warmup: int = 1) -> dict:
+    # one sample per argument tuple, after 'warmup' untimed calls so one-off loading isn't counted
+    for args in args_list[:warmup]:
+        func(*args)
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def try_time_calls(func, args_list: list, warmup: int = 1) -> dict:
+    # time_calls(), but an exception only fails this benchmark: {"error": ...} takes the place of its summary, so the
+    # rest of the task still reports (an older revision may not handle every input)
+    try:
+        return time_calls(func, args_list, warmup)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def get_revision(repo: str) -> dict:
+    # commit of the benchmarked tree, and whether it had uncommitted changes
+    try:
+        commit = subprocess.run(["git", "-C", repo, "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "-C", repo, "status", "--porcelain", "--untracked-files=no"],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def reset_work_dir(work_dir: str) -> None:
+    # removes everything a previous pipeline run wrote, keeping the input CSV
+    for name in os.listdir(work_dir):
+        path = os.path.join(work_dir, name)
+        if name == 'data':
+            for data_name in os.listdir(path):
+                if data_name != 'data.csv':
+                    data_path = os.path.join(path, data_name)
+                    shutil.rmtree(data_path) if os.path.isdir(data_path) else os.remove(data_path)
+        else:
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    # the visualizations and the preprocess log (preprocess/log.txt) write into these
+    os.makedirs(os.path.join(work_dir, 'static', 'images'), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, 'preprocess'), exist_ok=True)
+
+
+# ---- tasks, each run in a child interpreter with the working directory set to the scratch directory ----
+
+def task_preprocess(repo: str, args: argparse.Namespace) -> dict:
+    """
+    times preprocess/main.main() end to end on an empty database, then again with nothing left to do
+    :return: {benchmark name: summary}
+    """
+    sys.path[:0] = [os.path.join(repo, 'preprocess'), repo] # same lookup order as running preprocess/main.py
+    start = time.perf_counter()
+    import main
+    results = {"preprocess_import": summarize([time.perf_counter() - start])}
+
+    for name in ("preprocess_main", "preprocess_main_rerun"):
+        sys.argv = ["main.py", *args.preprocess_args]
+        start = time.perf_counter()
+        main.main()
+        results[name] = summarize([time.perf_counter() - start])
+
+    return results
+
+
+def task_queries(repo: str, args: argparse.Namespace) -> dict:
+    """
+    times the webapp's lookups inside an app context, the way a request runs them
+    :return: {benchmark name: summary, or {"error": ...} for a benchmark that failed}
+    """
+    sys.path.insert(0, repo)
+    start = time.perf_counter()
+    import app as webapp # loads the in-memory indexes, like a worker starting up
+    results = {"webapp_startup": summarize([time.perf_counter() - start])}
+
+    import database_helper as dbh
+    import vector_helper as vh
+    try:
+        import cache_helper as ch
+        ch.CACHE_ENABLED = False # every call should do the full work
+    except ImportError:
+        pass
+
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(DB_FILE)
+    titles = [r[0] for r in conn.execute("SELECT title FROM movies ORDER BY id")]
+    # profile movies pass the candidate rules themselves (a genre, more than one keyword): older revisions assume every
+    # entered movie is among the candidates and fail on one that isn't
+    profile_ids = [r[0] for r in conn.execute("""
+        SELECT movie_id FROM movies_keywords GROUP BY movie_id HAVING COUNT(*) > 1
+        INTERSECT SELECT movie_id FROM movies_genres
+        ORDER BY movie_id
+    """)]
+    profiles = [rng.sample(profile_ids, rng.randint(1, 4)) for _ in range(args.iterations)]
+    profile_terms = []
+    for profile in profiles:
+        placeholder = ','.join('?' * len(profile))
+        genre_ids = [r[0] for r in conn.execute(f"SELECT DISTINCT genre_id FROM movies_genres WHERE movie_id IN ({placeholder})", profile)]
+        keyword_ids = [r[0] for r in conn.execute(f"SELECT DISTINCT keyword_id FROM movies_keywords WHERE movie_id IN ({placeholder})", profile)]
+        profile_terms.append((genre_ids, keyword_ids))
+    conn.close()
+
+    # exact titles, prefixes and near-misses with two letters swapped
+    sampled = [rng.choice(titles) for _ in range(args.iterations)]
+    prefixes = [t[:max(3, len(t) * 2 // 3)] for t in sampled]
+    typos = []
+    for t in sampled:
+        i = rng.randrange(len(t) - 1) if len(t) > 1 else 0
+        typos.append(t[:i] + t[i + 1:i + 2] + t[i:i + 1] + t[i + 2:])
+
+    modes = getattr(vh, 'SCORING_MODES', ()) # revisions before scoring modes only have the default path
+    with webapp.app.app_context():
+        results["title_lookup_exact"] = try_time_calls(dbh.get_potential_title_matches, [(t,) for t in sampled])
+        results["title_lookup_prefix"] = try_time_calls(dbh.get_potential_title_matches, [(t,) for t in prefixes])
+        results["title_lookup_typo"] = try_time_calls(dbh.get_potential_title_matches, [(t,) for t in typos])
+        results["get_potential_matches"] = try_time_calls(dbh.get_potential_matches, profile_terms)
+        # the default path is timed under the same name in every revision, so any two can be compared
+        results["get_recommendations_by_ids"] = try_time_calls(vh.get_recommendations_by_ids, [(p,) for p in profiles])
+        for mode in modes:
+            call = lambda p, m=mode: vh.get_recommendations_by_ids(p, mode=m)
+            results[f"get_recommendations_by_ids[{mode}]"] = try_time_calls(call, [(p,) for p in profiles])
+
+    return results
+
+
+def task_vectors(repo: str, args: argparse.Namespace) -> dict:
+    """
+    times preprocess/vector_preprocess.import_vector_data() on a copy of the database: once computing every vector from
+    scratch, once after clearing a small share of them
+    :return: {benchmark name: summary}
+    """
+    sys.path[:0] = [os.path.join(repo, 'preprocess'), repo]
+    import vector_preprocess as vp
+    # newer revisions import sklearn lazily, the first time a vectorizer is fit; import it up front so the timings
+    # compare vectorizing rather than when the import happens
+    import sklearn.feature_extraction.text
+
+    shutil.copyfile(DB_FILE, "bench_vectors.db")
+    conn = sqlite3.connect("bench_vectors.db")
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    tables = {r[0] for r in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    # without stored vectors or TF-IDF state every revision takes its first-run path
+    cursor.execute("UPDATE movies SET vector = NULL")
+    for table in ("tfidf_state", "tfidf_features"):
+        if table in tables:
+            cursor.execute(f"DELETE FROM {table}")
+    conn.commit()
+    start = time.perf_counter()
+    vp.import_vector_data(cursor)
+    conn.commit()
+    results = {"import_vector_data_full": summarize([time.perf_counter() - start])}
+
+    movie_ids = [r[0] for r in cursor.execute("SELECT id FROM movies WHERE vector IS NOT NULL ORDER BY id")]
+    cleared = random.Random(args.seed).sample(movie_ids, max(1, int(len(movie_ids) * INCREMENTAL_SHARE)))
+    cursor.executemany("UPDATE movies SET vector = NULL WHERE id = ?", [(m,) for m in cleared])
+    conn.commit()
+    start = time.perf_counter()
+    vp.import_vector_data(cursor)
+    conn.commit()
+    results["import_vector_data_incremental"] = summarize([time.perf_counter() - start])
+
+    conn.close()
+    os.remove("bench_vectors.db")
+    return results
+
+
+def run_task(task: str, repo: str, work_dir: str, args: argparse.Namespace) -> dict:
+    # runs one task in a child interpreter, returns its results or the error it hit
+    output_file = os.path.join(work_dir, f"bench_{task}.json")
+    command = [sys.executable, os.path.abspath(__file__), "--task", task, "--repo", repo, "--task-output", output_file,
+               "--iterations", str(args.iterations), "--seed", str(args.seed), "--preprocess-args", *args.preprocess_args]
+    completed = subprocess.run(command, cwd=work_dir, capture_output=True, text=True)
+    if completed.returncode != 0 or not os.path.exists(output_file):
+        error = (completed.stderr or completed.stdout).strip().splitlines()
+        return {"error": error[-1] if error else f"exit status {completed.returncode}"}
+
+    with open(output_file) as f:
+        results = json.load(f)
+    os.remove(output_file)
+    return results
+
+
+def run_suite(args: argparse.Namespace) -> dict:
+    """
+    generates (or copies) the data set into a scratch directory and runs every task against 'args.repo'
+    :return: results document, see RESULTS_SCHEMA
+    """
+    repo = os.path.abspath(args.repo)
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="movie_recommender_bench_")
+    os.makedirs(os.path.join(work_dir, 'data'), exist_ok=True)
+    reset_work_dir(work_dir)
+
+    data_file = os.path.join(work_dir, 'data', 'data.csv')
+    if args.data:
+        shutil.copyfile(args.data, data_file)
+    elif not os.path.exists(data_file):
+        print(f"Generating {args.rows} synthetic rows")
+        gd.write_dataset(data_file, args.rows, args.seed)
+
+    document = {
+        "schema": RESULTS_SCHEMA,
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "revision": get_revision(repo),
+        "repo": repo,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": {"rows": args.rows if not args.data else None, "source": args.data or "synthetic", "seed": args.seed},
+        "iterations": args.iterations,
+        "benchmarks": {},
+        "errors": {},
+    }
+
+    try:
+        for task in TASKS:
+            print(f"Running {task} benchmarks")
+            results = run_task(task, repo, work_dir, args)
+            if "error" in results:
+                document["errors"][task] = results["error"]
+                print(f"  {task} failed: {results['error']}")
+                if task == 'preprocess':
+                    break # nothing else has a database to run against
+                continue
+            for name, summary in results.items():
+                if "error" in summary:
+                    document["errors"][name] = summary["error"]
+                    print(f"  {name:<40} failed: {summary['error']}")
+                    continue
+                document["benchmarks"][name] = summary
+                print(f"  {name:<40} median {summary['median'] * 1000:>10.3f} ms  p95 {summary['p95'] * 1000:>10.3f} ms")
+
+        if os.path.exists(os.path.join(work_dir, DB_FILE)):
+            conn = sqlite3.connect(os.path.join(work_dir, DB_FILE))
+            document["dataset"]["movies"] = conn.execute("SELECT COUNT(*) FROM movies").fetchone()[0]
+            conn.close()
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return document
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing and the webapp's hot paths on synthetic data")
+    parser.add_argument("--rows", type=gd.parse_rows, default=gd.SIZES['10k'], help=f"synthetic row count, or one of {list(gd.SIZES)}")
+    parser.add_argument("--data", default=None, help="use this CSV instead of generating one")
+    parser.add_argument("--repo", default=PROJECT_ROOT, help="project tree to benchmark (default: this checkout)")
+    parser.add_argument("--work-dir", default=None, help="scratch directory to run in, kept afterwards (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary scratch directory")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per lookup benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON results file (default: print to stdout)")
+    parser.add_argument("--preprocess-args", nargs=argparse.REMAINDER, default=[],
+                        help="arguments passed on to preprocess/main.py, must come last")
+    parser.add_argument("--task", choices=TASKS, help=argparse.SUPPRESS)
+    parser.add_argument("--task-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.task:
+        tasks = {'preprocess': task_preprocess, 'queries': task_queries, 'vectors': task_vectors}
+        results = tasks[args.task](os.path.abspath(args.repo), args)
+        with open(args.task_output, 'w') as f:
+            json.dump(results, f)
+        return
+
+    document = run_suite(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(document, indent=2))
+
+
+if __name__ == '__main__':
+    main()
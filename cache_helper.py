@@ -0,0 +1,169 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import database_helper as dbh
+import vector_store as vs
+
+# recommendation results cache, keyed on the canonical (sorted, de-duplicated) movie id tuple plus n and scoring mode
+# entries expire after CACHE_TTL_SECONDS and are dropped whenever the vector data version changes, i.e. after a
+# preprocess run writes a new vector store (or, without a store, replaces the database file)
+# 'memory' keeps a per-process LRU; 'sqlite' shares entries between worker processes through SHARED_CACHE_FILE
+CACHE_ENABLED = True
+CACHE_BACKEND = 'memory'
+CACHE_MAX_ENTRIES = 2048
+CACHE_TTL_SECONDS = 60 * 60
+SHARED_CACHE_FILE = 'data/recommendation_cache.db'
+VERSION_CHECK_SECONDS = 5 # how often the data version is re-read from disk
+
+_cache = None
+_data_version = None
+_version_checked_at = 0.0
+
+
+def get_data_version() -> str:
+    """
+    identifies the vector data currently on disk, re-read at most every VERSION_CHECK_SECONDS
+    :return: 'store:<version>' for the vector store, or 'db:<mtime>' when there is no store
+    """
+    global _data_version, _version_checked_at
+
+    now = time.monotonic()
+    if _data_version is None or now - _version_checked_at >= VERSION_CHECK_SECONDS:
+        store_version = vs.get_current_version()
+        if store_version is not None:
+            _data_version = f"store:{store_version}"
+        else:
+            _data_version = f"db:{os.stat(dbh.DB_FILE).st_mtime_ns}" if os.path.exists(dbh.DB_FILE) else "db:none"
+        _version_checked_at = now
+
+    return _data_version
+
+
+def make_key(movie_ids: list[int], n: int, mode: str) -> str:
+    # order and duplicates in the submitted ids don't change the result, so they don't change the key either
+    return f"{mode}|{n}|{','.join(str(m) for m in sorted(set(movie_ids)))}"
+
+
+class MemoryCache:
+    """per-process LRU cache with a TTL, cleared when the data version changes"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (created, value)
+        self.version = None
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _check_version(self, version: str) -> None:
+        if version != self.version:
+            if self.entries:
+                self.counters["invalidations"] += len(self.entries)
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key: str, version: str):
+        with self.lock:
+            self._check_version(version)
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.counters["expirations"] += 1
+                entry = None
+
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key: str, version: str, value) -> None:
+        with self.lock:
+            self._check_version(version)
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"backend": "memory", "entries": len(self.entries), **self.counters}
+
+
+class SqliteCache:
+    """cache shared by every worker through a local sqlite file, values are pickled"""
+
+    def __init__(self, cache_file: str = SHARED_CACHE_FILE, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(cache_file, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode = WAL") # readers in other workers don't block on writers
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS recommendation_cache (
+                key TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                value BLOB NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_recommendation_cache_last_used ON recommendation_cache (last_used)")
+
+    def get(self, key: str, version: str):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT version, created, value FROM recommendation_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and (row[0] != version or now - row[1] > self.ttl):
+                self.conn.execute("DELETE FROM recommendation_cache WHERE key = ?", (key,))
+                self.counters["invalidations" if row[0] != version else "expirations"] += 1
+                row = None
+
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+
+            self.conn.execute("UPDATE recommendation_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.counters["hits"] += 1
+            return pickle.loads(row[2])
+
+    def put(self, key: str, version: str, value) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO recommendation_cache (key, version, created, last_used, value) VALUES (?, ?, ?, ?, ?)",
+                              (key, version, now, now, pickle.dumps(value)))
+            # stale versions go first, then least recently used entries beyond the size limit
+            invalidated = self.conn.execute("DELETE FROM recommendation_cache WHERE version != ?", (version,)).rowcount
+            evicted = self.conn.execute("""
+                DELETE FROM recommendation_cache WHERE key IN (
+                    SELECT key FROM recommendation_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,)).rowcount
+            self.counters["invalidations"] += invalidated
+            self.counters["evictions"] += evicted
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM recommendation_cache").fetchone()[0]
+            return {"backend": "sqlite", "entries": entries, **self.counters}
+
+
+def get_cache() -> MemoryCache | SqliteCache | None:
+    # the configured cache, created on first use - None when caching is disabled
+    global _cache
+
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = SqliteCache() if CACHE_BACKEND == 'sqlite' else MemoryCache()
+    return _cache
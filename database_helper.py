@@ -1,57 +1,158 @@
-import json
+import os
+import queue
 import sqlite3
+import time
+from urllib.parse import quote
 from flask import g
 
 from CustomExceptions import MovieNotFound
+import metrics_helper as metrics
 from Movie import Movie
+from title_helper import normalize_title
+from vector_codec import decode_vector_dict
 
 DB_FILE = 'movie_recommender.db'
 
+# the webapp only reads, so requests borrow a long-lived read-only connection from a pool instead of opening a new one
+# on every page load - connection setup and a cold page cache are paid once per connection rather than per request
+POOL_SIZE = 8 # idle connections kept, extra concurrent requests open (and then close) their own
+CACHED_STATEMENTS = 256 # prepared statements kept per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_KIB = 64 * 1024
+HEALTH_CHECK_SECONDS = 30 # connections idle for longer are pinged before being handed out
+
+# (connection, identity of the database file it was opened on, time it was returned to the pool)
+_pool = queue.LifoQueue(maxsize=POOL_SIZE) # LIFO so the busiest connections, with the warmest caches, are reused
+
+
+def get_file_identity(db_file: str = DB_FILE) -> tuple[int, int] | None:
+    # a new preprocess run that replaces the database file changes its inode, an in-place update doesn't
+    try:
+        stat = os.stat(db_file)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def open_db(db_file: str = DB_FILE) -> sqlite3.Connection:
+    """
+    opens a read-only connection tuned for the webapp's lookups
+    :param db_file: path to the database file
+    :return: sqlite3 connection with Row results
+    """
+    uri = f"file:{quote(os.path.abspath(db_file))}?mode=ro"
+    db = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    db.row_factory = sqlite3.Row # dict-like access
+    db.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    db.execute(f"PRAGMA cache_size = -{DB_CACHE_KIB}")
+    db.execute("PRAGMA query_only = ON")
+    db.execute("PRAGMA temp_store = MEMORY")
+    metrics.trace_queries(db)
+    return db
+
+
+def is_healthy(db: sqlite3.Connection, identity: tuple[int, int], idle_since: float) -> bool:
+    # stale if the file was replaced since the connection was opened, or if a long-idle connection no longer answers
+    if get_file_identity() != identity:
+        return False
+    if time.monotonic() - idle_since >= HEALTH_CHECK_SECONDS:
+        try:
+            db.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+    return True
+
+
 def get_db():
-    # stores a db connection in the Flask global context, autocloses between page loads
+    # borrows a pooled connection for the current request, returned to the pool by close_db() at teardown
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DB_FILE)
-        db.row_factory = sqlite3.Row # dict-like access
+        while True:
+            try:
+                db, identity, idle_since = _pool.get_nowait()
+            except queue.Empty:
+                db, identity = open_db(), get_file_identity()
+                break
+            if is_healthy(db, identity, idle_since):
+                break
+            db.close()
+
+        g._database = db
+        g._database_identity = identity
 
     return db
 
 
 def close_db():
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        if db.in_transaction:
+            db.rollback()
+        try:
+            _pool.put_nowait((db, g.pop('_database_identity', None), time.monotonic()))
+        except queue.Full:
+            db.close()
+
 
+# used to convert the stored dbh vector (packed BLOB, or JSON on unmigrated databases) into a dictionary
+def load_sparse_dict(vector):
+    return decode_vector_dict(vector)
 
-# used to convert the jsonified dbh vector into a dictionary
-def load_sparse_dict(json_dict):
-    tmp = json.loads(json_dict)
-    return {int(k): v for k, v in tmp.items()}
+
+def has_title_fts() -> bool:
+    # whether the FTS5 trigram title index was created by preprocessing (requires SQLite 3.34+)
+    db = get_db()
+    return db.execute("SELECT 1 FROM sqlite_master WHERE name = 'movies_title_fts'").fetchone() is not None
 
 
+@metrics.timed("title_lookup")
 def get_potential_title_matches(movie_title: str) -> list[sqlite3.Row]:
     """
     takes in a single user-entered movie title and queries the database, with decreasing levels of precision, for a match\n
-    first looks for an exact match, then uses user-supplied wildcards (if present), finally uses LIKE ?query?
+    first looks for an exact match on the normalized title, then uses user-supplied wildcards (if present), then a prefix
+    match on the normalized title, finally a substring match through the FTS5 trigram index\n
+    every step except user wildcards is answered from an index rather than a table scan
     :param movie_title: string (with or without wildcards) to be queried
     :return: list of sqlite3.Rows
     """
     db = get_db()
-    exact_query = f"SELECT id, title, release_date FROM movies WHERE LOWER(title) = LOWER(?) LIMIT 5"
-    wildcard_query = f"SELECT id, title, release_date FROM movies WHERE title LIKE ? LIMIT 5"
+    normalized = normalize_title(movie_title)
+    exact_query = "SELECT id, title, release_date FROM movies WHERE title_normalized = ? LIMIT 5"
+    wildcard_query = "SELECT id, title, release_date FROM movies WHERE title LIKE ? LIMIT 5"
+    # range scan on the B-tree index, U+10FFFF sorts after every character a normalized title can contain
+    prefix_query = "SELECT id, title, release_date FROM movies WHERE title_normalized >= ? AND title_normalized < ? LIMIT 5"
+    fts_query = """
+        SELECT m.id, m.title, m.release_date FROM movies_title_fts AS f
+        INNER JOIN movies AS m ON m.id = f.rowid
+        WHERE movies_title_fts MATCH ? LIMIT 5
+    """
+    substring_query = "SELECT id, title, release_date FROM movies WHERE title_normalized LIKE ? LIMIT 5"
+
+    has_wildcards = "%" in movie_title or "_" in movie_title
+    if not normalized:
+        # nothing but punctuation or symbols: an exact lookup would match every title that also normalized to ''
+        if not movie_title.strip():
+            return []
+        return db.execute(wildcard_query, [movie_title if has_wildcards else f"%{movie_title.strip()}%"]).fetchall()
 
     # always check for an exact match first just in case
-    results = db.execute(exact_query, [movie_title]).fetchall()
+    results = db.execute(exact_query, [normalized]).fetchall()
     if results: return results
 
     # if the user entered their own wildcards, query using those
-    if "%" in movie_title or "_" in movie_title:
+    if has_wildcards:
         results = db.execute(wildcard_query, [movie_title]).fetchall()
         if results: return results
 
-    # fallback to our "default" wildcard query
-    results = db.execute(wildcard_query, [f"%{movie_title}%"]).fetchall()
-    return results
+    results = db.execute(prefix_query, [normalized, normalized + '\U0010ffff']).fetchall()
+    if results: return results
+
+    # trigram index needs at least three characters, shorter queries (and databases without FTS5) scan instead
+    if len(normalized) >= 3 and has_title_fts():
+        phrase = '"' + normalized.replace('"', '""') + '"'
+        return db.execute(fts_query, [phrase]).fetchall()
+
+    return db.execute(substring_query, [f"%{normalized}%"]).fetchall()
 
 
 # returns a Movie object from dbh for a corresponding movie id
@@ -68,9 +169,92 @@ def get_movie_by_id(movie_id: int) -> Movie:
     return Movie(**result, genres=genres, genre_ids=genre_ids, keywords=keywords, keyword_ids=keyword_ids)
 
 
-# repeatedly calls get_movie_by_id() on a list of ids
-def get_movies_by_ids(movie_ids: list[int]) -> list[Movie]:
-    return [get_movie_by_id(id) for id in movie_ids]
+@metrics.timed("hydration")
+def get_movies_by_ids(movie_ids: list[int], load_vectors: bool = True, load_keywords: bool = True) -> list[Movie]:
+    """
+    bulk version of get_movie_by_id(): hydrates every movie in the list with at most three queries (movies, genres,
+    keywords) no matter how many ids are passed in
+    :param movie_ids: list of movie ids, results are returned in the same order
+    :param load_vectors: whether to read and decode the stored vectors (default True), Movie.vector is None otherwise
+    :param load_keywords: whether to load keywords (default True), they are left empty otherwise
+    :return: list of Movie objects
+    """
+    if not movie_ids:
+        return []
+
+    db = get_db()
+    unique_ids = list(dict.fromkeys(movie_ids))
+    placeholder = ','.join(['?'] * len(unique_ids))
+
+    columns = "id, title, overview, release_date" + (", vector" if load_vectors else "")
+    query = f"SELECT {columns} FROM movies WHERE id IN ({placeholder})"
+    movie_rows = {r["id"]: r for r in db.execute(query, unique_ids).fetchall()}
+    for movie_id in movie_ids:
+        if movie_id not in movie_rows:
+            raise MovieNotFound(movie_id)
+
+    # build {movie_id: ([names], [ids])} for genres and (optionally) keywords
+    genres = {movie_id: ([], []) for movie_id in unique_ids}
+    query = f"""SELECT mg.movie_id, mg.genre_id, g.genre FROM movies_genres AS mg INNER JOIN genres AS g ON mg.genre_id = g.id
+                WHERE mg.movie_id IN ({placeholder}) ORDER BY mg.movie_id, mg.genre_id"""
+    for r in db.execute(query, unique_ids):
+        genres[r["movie_id"]][0].append(r["genre"])
+        genres[r["movie_id"]][1].append(r["genre_id"])
+
+    keywords = {movie_id: ([], []) for movie_id in unique_ids}
+    if load_keywords:
+        query = f"""SELECT mk.movie_id, mk.keyword_id, k.keyword FROM movies_keywords AS mk INNER JOIN keywords AS k ON mk.keyword_id = k.id
+                    WHERE mk.movie_id IN ({placeholder}) ORDER BY mk.movie_id, mk.keyword_id"""
+        for r in db.execute(query, unique_ids):
+            keywords[r["movie_id"]][0].append(r["keyword"])
+            keywords[r["movie_id"]][1].append(r["keyword_id"])
+
+    movies = []
+    for movie_id in movie_ids:
+        row = dict(movie_rows[movie_id])
+        row.setdefault("vector", None)
+        movies.append(Movie(**row, genres=genres[movie_id][0], genre_ids=genres[movie_id][1],
+                            keywords=keywords[movie_id][0], keyword_ids=keywords[movie_id][1]))
+
+    return movies
+
+
+# grabs the titles for a list of ids in one query, returned as {id: title}
+# 'db' lets callers outside a Flask request pass their own open_db() connection
+def get_titles_by_ids(movie_ids: list[int], db: sqlite3.Connection = None) -> dict[int, str]:
+    db = db or get_db()
+    placeholder = ','.join(['?'] * len(movie_ids))
+    query = f"SELECT id, title FROM movies WHERE id IN ({placeholder})"
+    return {r["id"]: r["title"] for r in db.execute(query, movie_ids).fetchall()}
+
+
+# grabs (id, title, release_date) rows for a list of ids in one query, returned as {id: row}
+def get_title_rows_by_ids(movie_ids: list[int]) -> dict[int, sqlite3.Row]:
+    db = get_db()
+    placeholder = ','.join(['?'] * len(movie_ids))
+    query = f"SELECT id, title, release_date FROM movies WHERE id IN ({placeholder})"
+    return {r["id"]: r for r in db.execute(query, movie_ids).fetchall()}
+
+
+def get_neighbors_by_ids(movie_ids: list[int], limit: int) -> dict[int, list[tuple[int, float]]] | None:
+    """
+    reads the precomputed neighbour lists (see preprocess/neighbor_preprocess.py) for a list of movies in one query
+    :param movie_ids: list of movie ids
+    :param limit: maximum neighbours per movie
+    :return: {movie_id: [(neighbour id, score), ...]} best first - movies without neighbours map to an empty list.
+        None if the database has no movie_neighbors table
+    """
+    db = get_db()
+    placeholder = ','.join(['?'] * len(movie_ids))
+    query = f"""SELECT movie_id, neighbor_id, score FROM movie_neighbors
+                WHERE movie_id IN ({placeholder}) AND rank < ? ORDER BY movie_id, rank"""
+    neighbors = {movie_id: [] for movie_id in movie_ids}
+    try:
+        for r in db.execute(query, [*movie_ids, limit]):
+            neighbors[r["movie_id"]].append((r["neighbor_id"], r["score"]))
+    except sqlite3.OperationalError: # no such table, the schema migration adds it
+        return None
+    return neighbors
 
 
 # grabs a list of genre names for a given id from join table
@@ -101,15 +285,16 @@ def get_keywords_by_id(movie_id: int) -> tuple[list, list]:
     return keywords, keyword_ids
 
 
-def get_potential_matches(genre_ids: list[int], keyword_ids: list[int]) -> dict[int, dict[int, float]]:
+@metrics.timed("candidates")
+def get_potential_match_ids(genre_ids: list[int], keyword_ids: list[int]) -> list[int]:
     """
     takes in a list of genre and keyword ids and queries the database for a set of unique movie_ids that share at least one
-    keyword and one genre from the parameters, then returns a dictionary of movie_id (key) and sparse dict vectorization (value)\n
+    keyword and one genre from the parameters\n
     even though our cosine similarity only runs on keyword vectorization, we include genre constraints in an attempt to subtly
     reinforce thematic appeal
     :param genre_ids: list of ids from genres db table
     :param keyword_ids: list of ids from keywords db table
-    :return: a list of dictionaries in the format movie_id: dict(vectorization)
+    :return: sorted list of movie ids
     """
     db = get_db()
 
@@ -124,22 +309,33 @@ def get_potential_matches(genre_ids: list[int], keyword_ids: list[int]) -> dict[
     placeholder = ','.join(['?'] * len(keyword_ids))
     query = f"""
         SELECT DISTINCT mk.movie_id FROM movies_keywords AS mk
-        WHERE mk.keyword_id IN ({placeholder}) 
-        AND mk.movie_id IN (
-            SELECT movie_id FROM movies_keywords 
-            GROUP BY movie_id HAVING COUNT(*) > 1
-        )
+        INNER JOIN movies AS m ON m.id = mk.movie_id
+        WHERE mk.keyword_id IN ({placeholder})
+        AND m.keyword_count > 1
     """
     result = db.execute(query, keyword_ids).fetchall()
     keyword_set = {r['movie_id'] for r in result}
 
     # take the intersection of the set so that we only test movies that match both lists
-    results_set = list(genre_set.intersection(keyword_set))
+    return sorted(genre_set.intersection(keyword_set))
+
+
+def get_potential_matches(genre_ids: list[int], keyword_ids: list[int]) -> dict[int, dict[int, float]]:
+    """
+    finds candidate movies with get_potential_match_ids(), then returns a dictionary of movie_id (key) and sparse dict
+    vectorization (value)
+    :param genre_ids: list of ids from genres db table
+    :param keyword_ids: list of ids from keywords db table
+    :return: a list of dictionaries in the format movie_id: dict(vectorization)
+    """
+    db = get_db()
+    results_set = get_potential_match_ids(genre_ids, keyword_ids)
 
     # get and return the vectors
-    placeholder = ','.join(['?'] * len(results_set))
-    query = f"SELECT id, vector FROM movies WHERE id IN ({placeholder})"
-    result = db.execute(query, results_set).fetchall()
-    ids_vectors = {r['id']:load_sparse_dict(r['vector']) for r in result}
+    with metrics.timer("vector_decode"):
+        placeholder = ','.join(['?'] * len(results_set))
+        query = f"SELECT id, vector FROM movies WHERE id IN ({placeholder})"
+        result = db.execute(query, results_set).fetchall()
+        ids_vectors = {r['id']:load_sparse_dict(r['vector']) for r in result}
 
     return ids_vectors
@@ -0,0 +1,77 @@
+import argparse
+import random
+import time
+import numpy as np
+
+import ann_index as ann
+import index_helper as ih
+import matrix_helper as mh
+import vector_helper as vh
+
+# measures how well the approximate ('ann') scoring path reproduces the exact ('matrix') path
+# run from the project root after preprocess/main.py has built the vector store and ANN index:
+#   python evaluate_ann.py --profiles 500 --n 5 --tables 4 8 --radius 0 1 2
+
+
+def sample_profiles(num_profiles: int, max_size: int, seed: int) -> list[list[int]]:
+    # random user profiles of 1..max_size movies, drawn from movies that can appear in recommendations
+    rng = random.Random(seed)
+    movie_ids = mh.get_ids_by_rows(np.arange(mh.get_vector_matrix().shape[0])).tolist()
+    return [rng.sample(movie_ids, rng.randint(1, max_size)) for _ in range(num_profiles)]
+
+
+def evaluate(profiles: list[list[int]], n: int, tables: int, radius: int) -> dict:
+    """
+    runs every profile through both paths and compares the top n
+    :return: dict with recall@n and mean latency (ms) of both paths
+    """
+    recalls = []
+    exact_ms = []
+    ann_ms = []
+    for profile in profiles:
+        genre_ids, keyword_ids = ih.get_profile_terms(profile)
+
+        start = time.perf_counter()
+        exact = vh.score_by_matrix(profile, genre_ids, keyword_ids, n)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        approximate = vh.score_by_ann(profile, genre_ids, keyword_ids, n, tables=tables, radius=radius)
+        ann_ms.append((time.perf_counter() - start) * 1000)
+
+        if exact:
+            exact_ids = {movie_id for movie_id, _ in exact}
+            recalls.append(len(exact_ids & {movie_id for movie_id, _ in approximate}) / len(exact_ids))
+
+    return {
+        "tables": tables,
+        "radius": radius,
+        f"recall@{n}": float(np.mean(recalls)) if recalls else float('nan'),
+        "exact_ms": float(np.mean(exact_ms)),
+        "ann_ms": float(np.mean(ann_ms)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall@n of ANN scoring against exact scoring")
+    parser.add_argument("--profiles", type=int, default=200, help="number of random profiles to score")
+    parser.add_argument("--max-size", type=int, default=3, help="maximum movies per profile")
+    parser.add_argument("--n", type=int, default=5, help="recommendations per profile")
+    parser.add_argument("--tables", type=int, nargs='+', default=[ann.DEFAULT_TABLES], help="LSH tables to probe")
+    parser.add_argument("--radius", type=int, nargs='+', default=[ann.DEFAULT_PROBE_RADIUS], help="Hamming probe radius")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if mh.get_store_version() is None or not ann.load_ann_index(mh.get_store_version()):
+        exit("No vector store / ANN index found - run preprocess/main.py first")
+
+    profiles = sample_profiles(args.profiles, args.max_size, args.seed)
+    print(f"{'tables':>6} {'radius':>6} {'recall@' + str(args.n):>10} {'exact ms':>9} {'ann ms':>9}")
+    for tables in args.tables:
+        for radius in args.radius:
+            result = evaluate(profiles, args.n, tables, radius)
+            print(f"{tables:>6} {radius:>6} {result[f'recall@{args.n}']:>10.3f} {result['exact_ms']:>9.2f} {result['ann_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+from typing import NamedTuple
+import numpy as np
+
+import database_helper as dbh
+import metrics_helper as metrics
+from logger import logger
+
+
+
+class InvertedIndex(NamedTuple):
+    # postings are stored CSR-style: the movie ids for key k are keyword_flat[keyword_offsets[k]:keyword_offsets[k+1]],
+    # sorted ascending
+    keyword_offsets: np.ndarray
+    keyword_flat: np.ndarray
+    genre_offsets: np.ndarray
+    genre_flat: np.ndarray
+    # forward indexes (movie id -> keyword/genre ids), same layout, used to look up a whole batch of profiles at once
+    movie_keyword_offsets: np.ndarray
+    movie_keyword_flat: np.ndarray
+    movie_genre_offsets: np.ndarray
+    movie_genre_flat: np.ndarray
+    # sorted ids of movies with more than one keyword - see get_potential_match_ids() for why these are excluded
+    multi_keyword_ids: np.ndarray
+
+
+# inverted indexes over the join tables, loaded once per process. a reload builds a new InvertedIndex and publishes it
+# with one assignment, so a reader never mixes postings from two loads
+_loaded = None
+# the InvertedIndex the current request is pinned to (see pin())
+_pinned = threading.local()
+
+
+def build_postings(keys: np.ndarray, movie_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    turns (key, movie_id) pairs into an offsets array and a flat array of movie ids grouped by key
+    :param keys: keyword or genre id per pair
+    :param movie_ids: movie id per pair
+    :return: (offsets, flat) where the posting list for key k is flat[offsets[k]:offsets[k+1]]
+    """
+    order = np.lexsort((movie_ids, keys))
+    keys = keys[order]
+    flat = movie_ids[order]
+
+    num_keys = int(keys.max()) + 1 if len(keys) else 0
+    offsets = np.zeros(num_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=num_keys), out=offsets[1:])
+    return offsets, flat
+
+
+def union_postings(offsets: np.ndarray, flat: np.ndarray, keys: list[int]) -> np.ndarray:
+    """
+    merges the posting lists for the supplied keys, ignoring keys that aren't in the index
+    :return: sorted array of unique movie ids
+    """
+    lists = [flat[offsets[k]:offsets[k + 1]] for k in keys if 0 <= k < len(offsets) - 1]
+    if not lists:
+        return np.empty(0, dtype=np.int64)
+    if len(lists) == 1:
+        return lists[0]
+    # sort + adjacent-duplicate mask, np.unique's hash-based path is several times slower on these sizes
+    merged = np.concatenate(lists)
+    if not merged.size: # every list was empty
+        return merged
+    merged.sort()
+    return merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+
+
+def load_index(db_file: str = dbh.DB_FILE) -> None:
+    """
+    reads the movies_genres and movies_keywords join tables into memory and builds the posting lists
+    :param db_file: location of the sqlite database
+    :return: None
+    """
+    global _loaded
+
+    conn = sqlite3.connect(db_file)
+    try:
+        keyword_pairs = np.array(conn.execute("SELECT keyword_id, movie_id FROM movies_keywords").fetchall(), dtype=np.int64).reshape(-1, 2)
+        genre_pairs = np.array(conn.execute("SELECT genre_id, movie_id FROM movies_genres").fetchall(), dtype=np.int64).reshape(-1, 2)
+    finally:
+        conn.close()
+
+    # per-movie keyword count, precomputed so we don't need the GROUP BY ... HAVING subquery
+    movie_ids, keyword_counts = np.unique(keyword_pairs[:, 1], return_counts=True)
+
+    _loaded = InvertedIndex(
+        *build_postings(keyword_pairs[:, 0], keyword_pairs[:, 1]),
+        *build_postings(genre_pairs[:, 0], genre_pairs[:, 1]),
+        *build_postings(keyword_pairs[:, 1], keyword_pairs[:, 0]),
+        *build_postings(genre_pairs[:, 1], genre_pairs[:, 0]),
+        movie_ids[keyword_counts > 1]
+    )
+
+    logger(f"Loaded inverted index from '{db_file}': {len(keyword_pairs)} (movie,keyword) pairs, {len(genre_pairs)} (movie,genre) pairs")
+
+
+def is_loaded() -> bool:
+    return _loaded is not None
+
+
+def pin() -> None:
+    # pins the calling thread (a request) to the current load until unpin(), a reload meanwhile only affects later requests
+    _pinned.loaded = _loaded
+
+
+def unpin() -> None:
+    _pinned.loaded = None
+
+
+def get_loaded() -> InvertedIndex:
+    # the load this request is pinned to, otherwise the latest one - lazily loaded if app startup didn't already do it
+    loaded = getattr(_pinned, 'loaded', None)
+    if loaded is None:
+        if _loaded is None:
+            load_index()
+        loaded = _loaded
+    return loaded
+
+
+@metrics.timed("candidates")
+def get_potential_match_ids(genre_ids: list[int], keyword_ids: list[int]) -> list[int]:
+    """
+    in-memory equivalent of dbh.get_potential_match_ids(): movies that share at least one genre AND at least one
+    keyword with the parameters, AND that have more than one keyword logged in the database
+    :param genre_ids: list of ids from genres db table
+    :param keyword_ids: list of ids from keywords db table
+    :return: sorted list of movie ids
+    """
+    index = get_loaded()
+    genre_set = union_postings(index.genre_offsets, index.genre_flat, genre_ids)
+    keyword_set = union_postings(index.keyword_offsets, index.keyword_flat, keyword_ids)
+    keyword_set = np.intersect1d(keyword_set, index.multi_keyword_ids, assume_unique=True)
+
+    return np.intersect1d(genre_set, keyword_set, assume_unique=True).tolist()
+
+
+def shares_any_term(offsets: np.ndarray, flat: np.ndarray, movie_ids: np.ndarray, term_ids: list[int]) -> np.ndarray:
+    # per movie, whether its forward posting list holds any of term_ids - movies missing from the index hold none
+    in_index = (movie_ids >= 0) & (movie_ids < len(offsets) - 1)
+    starts = offsets[movie_ids[in_index]]
+    counts = offsets[movie_ids[in_index] + 1] - starts
+    # every (movie, term) entry of the given movies, gathered with one fancy index
+    positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    hits = np.isin(flat[positions], term_ids)
+    result = np.zeros(len(movie_ids), dtype=bool)
+    result[in_index] = np.bincount(np.repeat(np.arange(len(starts)), counts), weights=hits, minlength=len(starts)) > 0
+    return result
+
+
+@metrics.timed("candidates")
+def filter_potential_matches(movie_ids, genre_ids: list[int], keyword_ids: list[int]) -> np.ndarray:
+    """
+    applies the get_potential_match_ids() rules to a given set of movies through the forward indexes, so the work
+    depends on how many movies are checked rather than on how many movies share the profile's genres and keywords
+    :param movie_ids: movie ids to check
+    :param genre_ids: list of ids from genres db table
+    :param keyword_ids: list of ids from keywords db table
+    :return: the movie ids that pass, in input order
+    """
+    index = get_loaded()
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    keep = shares_any_term(index.movie_genre_offsets, index.movie_genre_flat, movie_ids, genre_ids)
+    keep &= shares_any_term(index.movie_keyword_offsets, index.movie_keyword_flat, movie_ids, keyword_ids)
+    # more than one keyword, read off the forward index instead of searching multi_keyword_ids
+    offsets = index.movie_keyword_offsets
+    in_index = (movie_ids >= 0) & (movie_ids < len(offsets) - 1)
+    clipped = np.where(in_index, movie_ids, 0)
+    keep &= in_index & (offsets[clipped + 1] - offsets[clipped] > 1)
+    return movie_ids[keep]
+
+
+def get_profile_terms(movie_ids: list[int]) -> tuple[list[int], list[int]]:
+    """
+    looks up every genre and keyword id attached to a list of movies without touching the database
+    :param movie_ids: list of movie ids
+    :return: (genre ids, keyword ids), each sorted and de-duplicated
+    """
+    index = get_loaded()
+    genre_ids = union_postings(index.movie_genre_offsets, index.movie_genre_flat, movie_ids)
+    keyword_ids = union_postings(index.movie_keyword_offsets, index.movie_keyword_flat, movie_ids)
+    return genre_ids.tolist(), keyword_ids.tolist()
@@ -1,22 +1,163 @@
+import atexit
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 
-LOG_FILE = 'log.txt'
+# relative to the working directory, preprocess/main.py switches it with set_log_file(). the environment variable
+# carries the switch to worker processes started with spawn (Windows), which import this module fresh
+LOG_FILE_ENV = 'MOVIE_RECOMMENDER_LOG_FILE'
+LOG_FILE = os.environ.get(LOG_FILE_ENV, 'log.txt')
 
-def logger(message: str, type=None) -> None:
+# calls only put a record on a queue, a background thread formats and appends them to LOG_FILE in batches
+# worker processes write each record as it's logged instead: they can end through os._exit() or Pool.terminate(),
+# which skip the atexit flush, so records left on their queue would be lost
+LOG_LEVEL = 'info' # lowest level written: 'debug', 'info', 'alert' or 'error'
+LOG_FORMAT = 'text' # 'text' keeps the original line format, 'json' writes one JSON object per line
+LOG_BATCH_SIZE = 500 # records written per file write at most
+LOG_FLUSH_SECONDS = 0.5 # how long the writer waits to fill a batch before writing what it has
+LOG_MAX_BYTES = 10 * 1024 * 1024 # log.txt is rotated to log.txt.1 (and older backups shifted) past this size
+LOG_BACKUP_COUNT = 3
+
+# 'type' values accepted by logger(), None is a plain message
+LEVELS = {'d': 10, None: 20, 'a': 30, 'e': 40}
+LEVEL_NAMES = {'debug': 10, 'info': 20, 'alert': 30, 'error': 40}
+TEXT_PREFIXES = {10: "[DEBUG]", 20: "", 30: "[ALERT]", 40: "*[ERROR]*"}
+
+_queue = queue.SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+_synchronous = False # set in worker processes, see start_writer()
+_STOP = object()
+
+
+def is_enabled(type=None) -> bool:
+    # lets callers skip building expensive messages that would be dropped anyway
+    return LEVELS.get(type, 20) >= LEVEL_NAMES[LOG_LEVEL]
+
+
+def logger(message, type=None) -> None:
     """
-    writes to log.txt\n
-    'type' defaults to message, set to 'a' for alert or 'e' for error
+    queues a message for LOG_FILE, returns without touching the file (worker processes write it right away)\n
+    'type' defaults to message, set to 'a' for alert, 'e' for error or 'd' for debug\n
+    'message' can also be a callable returning the string, it is only called if the level is enabled
     """
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    level = LEVELS.get(type, 20)
+    if level < LEVEL_NAMES[LOG_LEVEL]:
+        return
+
+    record = (time.time(), level, message)
+    if _writer is None and not _synchronous:
+        start_writer()
+    if _synchronous:
+        write_batch([record], rotate_file=False)
+    else:
+        _queue.put(record)
+
+
+def format_record(record: tuple) -> str:
+    created, level, message = record
+    if callable(message):
+        message = message()
+    if LOG_FORMAT == 'json':
+        name = next(n for n, l in LEVEL_NAMES.items() if l == level)
+        return json.dumps({"time": datetime.fromtimestamp(created).isoformat(timespec='milliseconds'),
+                           "level": name, "pid": os.getpid(), "message": str(message)}) + "\n"
+    now = datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S")
+    return f"{TEXT_PREFIXES[level]}[{now}]: {message}\n"
+
+
+def rotate() -> None:
+    # log.txt -> log.txt.1 -> log.txt.2 ..., the oldest backup is dropped
+    for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+        if os.path.exists(f"{LOG_FILE}.{i}"):
+            os.replace(f"{LOG_FILE}.{i}", f"{LOG_FILE}.{i + 1}")
+    os.replace(LOG_FILE, f"{LOG_FILE}.1")
+
+
+def write_batch(records: list[tuple], rotate_file: bool = True) -> None:
+    # a message that fails to format is replaced by an error line, the rest of the batch is still written
+    # worker processes don't rotate, two processes rotating at once would shift the backups twice
+    formatted = []
+    for record in records:
+        try:
+            formatted.append(format_record(record))
+        except Exception as e:
+            formatted.append(format_record((record[0], LEVELS['e'], f"Logging error: message could not be formatted: {e!r}")))
 
     try:
+        lines = ''.join(formatted)
+        if rotate_file and LOG_BACKUP_COUNT and os.path.exists(LOG_FILE) and os.path.getsize(LOG_FILE) + len(lines) > LOG_MAX_BYTES:
+            rotate()
         with open(LOG_FILE, 'a', encoding='utf-8') as f:
-            if type == 'a':
-                f.write(f"[ALERT][{now}]: {message}\n")
-            elif type == 'e':
-                f.write(f"*[ERROR]*[{now}]: {message}\n")
-            else:
-                f.write(f"[{now}]: {message}\n")
+            f.write(lines)
 
     except Exception as e:
-        print(f"Logging error: {e}")
\ No newline at end of file
+        print(f"Logging error: {e}")
+
+
+def run_writer() -> None:
+    # blocks for the first record of a batch, then collects more until the batch is full or LOG_FLUSH_SECONDS pass
+    stopping = False
+    while not stopping:
+        record = _queue.get()
+        if record is _STOP:
+            break
+        batch = [record]
+        deadline = time.monotonic() + LOG_FLUSH_SECONDS
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                record = _queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if record is _STOP:
+                stopping = True
+                break
+            batch.append(record)
+        write_batch(batch)
+
+
+def start_writer() -> None:
+    global _writer, _synchronous
+    with _writer_lock:
+        if _writer is None and not _synchronous:
+            if multiprocessing.parent_process() is not None: # a spawned worker, forked ones are set in reset_after_fork()
+                _synchronous = True
+                return
+            _writer = threading.Thread(target=run_writer, name="log-writer", daemon=True)
+            _writer.start()
+
+
+def flush() -> None:
+    # writes everything queued so far and stops the writer, the next logger() call starts a new one
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _queue.put(_STOP)
+            _writer.join()
+            _writer = None
+
+
+def set_log_file(path: str) -> None:
+    # records already queued are written to the previous file first
+    global LOG_FILE
+    flush()
+    LOG_FILE = path
+    os.environ[LOG_FILE_ENV] = path
+
+
+def reset_after_fork() -> None:
+    # a forked child (e.g. a multiprocessing worker) has the queue but not the writer thread, it writes synchronously
+    global _queue, _writer, _writer_lock, _synchronous
+    _queue = queue.SimpleQueue()
+    _writer = None
+    _writer_lock = threading.Lock()
+    _synchronous = True
+
+
+atexit.register(flush)
+if hasattr(os, 'register_at_fork'): # Unix only - Windows starts workers with spawn, which re-imports this module
+    os.register_at_fork(after_in_child=reset_after_fork)
@@ -0,0 +1,231 @@
+import sqlite3
+import threading
+from typing import NamedTuple
+import numpy as np
+from scipy import sparse
+
+import database_helper as dbh
+import metrics_helper as metrics
+import vector_store as vs
+from logger import logger
+from vector_codec import decode_vector_batch
+
+
+
+class VectorMatrix(NamedTuple):
+    # one load of the stored vectors: row i of matrix is the vector for movie id row_ids[i], row_ids is ascending so
+    # ids map to rows by binary search
+    matrix: sparse.csr_matrix
+    row_ids: np.ndarray
+    store_version: int | None # version of the memory-mapped vector store, None when read from the database
+
+
+# every stored movie vector lives in one CSR matrix, loaded once per process. a reload builds a new VectorMatrix and
+# publishes it with one assignment, so a reader never pairs one load's matrix with another load's row ids
+_loaded = None
+# the VectorMatrix the current request is pinned to (see pin()), so every lookup in a request reads the same load
+_pinned = threading.local()
+# profiles per sparse matrix-matrix product in score_profiles(). a profile's scores against the catalog are mostly
+# non-zero, so this bounds the product to about this many catalog-sized rows however many profiles are scored
+SCORE_BLOCK_PROFILES = 64
+
+
+def load_vector_matrix(db_file: str = dbh.DB_FILE, store_dir: str = vs.STORE_DIR) -> sparse.csr_matrix:
+    """
+    memory-maps the on-disk vector store written by the preprocess pipeline if there is one, otherwise reads every
+    movie vector from the database and stacks them into a single scipy CSR matrix
+    :param db_file: location of the sqlite database
+    :param store_dir: location of the vector store
+    :return: CSR matrix with one row per movie that has a stored vector
+    """
+    global _loaded
+
+    if vs.get_current_version(store_dir) is not None:
+        store_version, matrix, row_ids = vs.open_store(store_dir)
+        _loaded = VectorMatrix(matrix, row_ids, store_version)
+        logger(f"Mapped vector store v{store_version} from '{store_dir}': {matrix.shape[0]} movies, {matrix.nnz} non-zeros")
+        return matrix
+
+    conn = sqlite3.connect(db_file)
+    try:
+        result = conn.execute("SELECT id, vector FROM movies WHERE vector IS NOT NULL ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+    row_ids = [movie_id for movie_id, _ in result]
+    indptr, indices, data = decode_vector_batch([vector for _, vector in result])
+
+    num_features = int(indices.max()) + 1 if len(indices) else 0
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(row_ids), num_features))
+    matrix.sort_indices()
+
+    _loaded = VectorMatrix(matrix, np.array(row_ids, dtype=np.int64), None)
+    logger(f"Loaded vector matrix from '{db_file}': {matrix.shape[0]} movies, {matrix.shape[1]} features, {matrix.nnz} non-zeros")
+
+    return matrix
+
+
+def is_loaded() -> bool:
+    return _loaded is not None
+
+
+def pin() -> None:
+    # pins the calling thread (a request) to the current load until unpin(), a reload meanwhile only affects later requests
+    _pinned.loaded = _loaded
+
+
+def unpin() -> None:
+    _pinned.loaded = None
+
+
+def get_loaded() -> VectorMatrix:
+    # the load this request is pinned to, otherwise the latest one - lazily loaded if app startup didn't already do it
+    loaded = getattr(_pinned, 'loaded', None)
+    if loaded is None:
+        if _loaded is None:
+            load_vector_matrix()
+        loaded = _loaded
+    return loaded
+
+
+def get_vector_matrix() -> sparse.csr_matrix:
+    return get_loaded().matrix
+
+
+def get_candidate_rows(candidate_ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    translates movie ids into matrix row numbers, silently dropping ids that have no stored vector
+    :param candidate_ids: list of movie ids
+    :return: (movie ids with a stored vector, their matrix rows)
+    """
+    row_ids = get_loaded().row_ids
+    candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+    rows = np.searchsorted(row_ids, candidate_ids)
+    rows[rows == len(row_ids)] = 0
+    found = row_ids[rows] == candidate_ids if len(row_ids) else np.zeros(len(rows), dtype=bool)
+    return candidate_ids[found], rows[found]
+
+
+def get_ids_by_rows(rows: np.ndarray) -> np.ndarray:
+    # inverse of get_rows_by_ids()
+    return get_loaded().row_ids[rows]
+
+
+def get_store_version() -> int | None:
+    # vector store version backing the matrix, None if it was read from the database
+    return get_loaded().store_version
+
+
+def get_rows_by_ids(movie_ids: list[int]) -> np.ndarray:
+    # same as get_candidate_rows(), when the caller only needs the rows
+    return get_candidate_rows(movie_ids)[1]
+
+
+def get_composite_by_ids(movie_ids: list[int]) -> np.ndarray:
+    """
+    sums the vectors for the supplied movies and normalizes the result, same as vh.get_composite_by_vectors()
+    :param movie_ids: list of movie ids
+    :return: dense normalized composite vector (all zeros if none of the movies have a vector)
+    """
+    matrix = get_vector_matrix()
+    rows = get_rows_by_ids(movie_ids)
+    composite = np.asarray(matrix[rows].astype(np.float64).sum(axis=0)).ravel()
+
+    norm = np.sqrt(np.dot(composite, composite))
+    if norm == 0:
+        return composite
+
+    return composite / norm
+
+
+def top_n(ids: np.ndarray, scores: np.ndarray, n: int) -> list[tuple[int, float]]:
+    """
+    picks the n highest scores without sorting the whole array\n
+    ties are broken by position in 'ids', matching a stable sort over the candidates
+    :param ids: movie ids, aligned with 'scores'
+    :param scores: similarity score per movie id
+    :param n: number of results to return
+    :return: list of (movie id, score) tuples, best first
+    """
+    if n <= 0 or len(scores) == 0:
+        return []
+
+    if n < len(scores):
+        # keep everything tied with the n-th best score so the final ordering doesn't depend on argpartition
+        threshold = scores[np.argpartition(scores, -n)[-n]]
+        keep = np.flatnonzero(scores >= threshold)
+    else:
+        keep = np.arange(len(scores))
+
+    order = keep[np.lexsort((keep, -scores[keep]))][:n]
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def score_candidates(composite: np.ndarray, candidate_ids: list[int], n: int = 5) -> list[tuple[int, float]]:
+    """
+    scores every candidate against the composite vector with one sparse matrix-vector product, then returns the top n\n
+    vectors are normalized by the vectorizer, so the dot product is the cosine similarity
+    :param composite: dense normalized composite vector from get_composite_by_ids()
+    :param candidate_ids: ids of the movies to be scored, in the order used to break ties
+    :param n: number of results to return (default 5)
+    :return: list of (movie id, similarity score) tuples, best first
+    """
+    matrix = get_vector_matrix()
+    with metrics.timer("vector_decode"): # gathering the candidates' CSR rows stands in for decoding their vectors
+        candidate_ids, rows = get_candidate_rows(candidate_ids)
+        candidate_matrix = matrix[rows]
+
+    with metrics.timer("scoring"):
+        scores = candidate_matrix @ composite
+    with metrics.timer("top_k"):
+        return top_n(candidate_ids, scores, n)
+
+
+def get_composites_by_profiles(profiles: list[list[int]]) -> sparse.csr_matrix:
+    """
+    builds every profile's composite vector at once: a 0/1 selection matrix (profiles x movies) multiplied by the
+    vector matrix sums each profile's vectors, then each row is normalized
+    :param profiles: list of movie id lists, one per user profile
+    :return: CSR matrix with one normalized composite vector per profile
+    """
+    matrix = get_vector_matrix()
+    profile_rows = [get_rows_by_ids(profile) for profile in profiles]
+    selection = sparse.csr_matrix(
+        (np.ones(sum(len(r) for r in profile_rows)),
+         np.concatenate(profile_rows),
+         np.concatenate([[0], np.cumsum([len(r) for r in profile_rows])])),
+        shape=(len(profiles), matrix.shape[0])
+    )
+    composites = (selection @ matrix).tocsr()
+
+    norms = np.sqrt(np.asarray(composites.multiply(composites).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0 # all-zero composites stay all zero
+    return sparse.diags(1.0 / norms) @ composites
+
+
+def score_profiles(profiles: list[list[int]], candidate_lists: list[list[int]], n: int = 5) -> list[list[tuple[int, float]]]:
+    """
+    scores many profiles against the catalog with sparse matrix-matrix products, SCORE_BLOCK_PROFILES profiles at a
+    time, then picks each profile's top n from its own candidate list
+    :param profiles: list of movie id lists, one per user profile
+    :param candidate_lists: ids of the movies to be scored for each profile, in the order used to break ties
+    :param n: number of results to return per profile (default 5)
+    :return: one list of (movie id, similarity score) tuples per profile, best first
+    """
+    matrix = get_vector_matrix()
+    composites = get_composites_by_profiles(profiles)
+
+    results = []
+    row_scores = np.zeros(matrix.shape[0]) # scratch buffer reused between profiles
+    for block_start in range(0, len(profiles), SCORE_BLOCK_PROFILES):
+        scores = (composites[block_start:block_start + SCORE_BLOCK_PROFILES] @ matrix.T).tocsr()
+        for i, candidate_ids in enumerate(candidate_lists[block_start:block_start + SCORE_BLOCK_PROFILES]):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            row_scores[scores.indices[start:end]] = scores.data[start:end]
+
+            candidate_ids, rows = get_candidate_rows(candidate_ids)
+            results.append(top_n(candidate_ids, row_scores[rows], n))
+
+            row_scores[scores.indices[start:end]] = 0.0
+
+    return results
@@ -0,0 +1,152 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# in-process latency histograms and counters for the recommendation and title-resolution paths, served in Prometheus
+# text format at /metrics
+# with METRICS_ENABLED off every hook returns immediately (one global check), and SQL tracing isn't installed on new
+# connections
+METRICS_ENABLED = True
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """cumulative-bucket histogram, one series per label value"""
+
+    def __init__(self, name: str, help: str, label: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series = {} # label value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, label_value: str, value: float) -> None:
+        with _lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(self.series.items()):
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """monotonic counter, one series per label value"""
+
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.series = {}
+
+    def inc(self, label_value: str, value: float = 1) -> None:
+        with _lock:
+            self.series[label_value] = self.series.get(label_value, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f'{self.name}{{{self.label}="{label_value}"}} {value}' for label_value, value in sorted(self.series.items()))
+        return lines
+
+
+_lock = threading.Lock()
+_request = threading.local() # per-request SQL query count and start time
+
+STAGE_SECONDS = Histogram("recommender_stage_seconds", "Time spent in each recommendation / title-resolution stage",
+                          "stage", SECONDS_BUCKETS)
+REQUEST_SECONDS = Histogram("recommender_request_seconds", "Request latency per route", "route", SECONDS_BUCKETS)
+CANDIDATES = Histogram("recommender_candidates", "Candidate movies scored per recommendation", "mode", SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram("recommender_request_sql_queries", "SQL statements executed per request", "route", QUERY_BUCKETS)
+QUERIES_TOTAL = Counter("recommender_sql_queries_total", "SQL statements executed on request connections", "route")
+CANDIDATES_TOTAL = Counter("recommender_candidates_total", "Candidate movies scored", "mode")
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, CANDIDATES, CANDIDATES_TOTAL, REQUEST_QUERIES, QUERIES_TOTAL]
+
+
+@contextmanager
+def _timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(stage, time.perf_counter() - start)
+
+
+_NOOP = nullcontext() # stateless, so one instance is shared by every disabled timer
+
+
+def timer(stage: str):
+    # context manager timing one stage: with metrics.timer("scoring"): ...
+    return _timer(stage) if METRICS_ENABLED else _NOOP
+
+
+def timed(stage: str):
+    # decorator version of timer() for functions that are a stage on their own
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return func(*args, **kwargs)
+            with _timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_candidates(mode: str, count: int) -> None:
+    if METRICS_ENABLED:
+        CANDIDATES.observe(mode, count)
+        CANDIDATES_TOTAL.inc(mode, count)
+
+
+def trace_queries(db) -> None:
+    # counts every statement a connection runs towards the current request, installed when the connection is opened
+    if METRICS_ENABLED:
+        db.set_trace_callback(count_query)
+
+
+def count_query(statement: str) -> None:
+    _request.queries = getattr(_request, 'queries', 0) + 1
+
+
+def begin_request() -> None:
+    if METRICS_ENABLED:
+        _request.queries = 0
+        _request.start = time.perf_counter()
+
+
+def end_request(route: str) -> None:
+    start = getattr(_request, 'start', None)
+    if not METRICS_ENABLED or start is None:
+        return
+    queries = getattr(_request, 'queries', 0)
+    REQUEST_SECONDS.observe(route, time.perf_counter() - start)
+    REQUEST_QUERIES.observe(route, queries)
+    QUERIES_TOTAL.inc(route, queries)
+    _request.start = None
+
+
+def render() -> str:
+    # every metric in Prometheus text exposition format (version 0.0.4)
+    lines = []
+    with _lock: # a consistent snapshot, and no series added mid-iteration
+        for metric in METRICS:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
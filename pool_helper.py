@@ -0,0 +1,21 @@
+from collections import deque
+from multiprocessing import Pool
+
+
+def imap_bounded(pool: Pool, func, iterable, max_pending: int):
+    """
+    like pool.imap(), results come back in input order, but at most max_pending inputs are read ahead of the consumer
+    (pool.imap() queues the whole iterable up front, e.g. every chunk of a CSV)
+    :param pool: multiprocessing pool
+    :param func: function of one argument, run in the pool
+    :param iterable: inputs to func
+    :param max_pending: inputs submitted to the pool but not yet consumed
+    :return: generator of results
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
@@ -57,11 +57,3 @@ def render_movie_runtime_boxplot(df: pd.DataFrame) -> None:
 
     plt.savefig(filepath)
     logger(f"Runtime boxplot saved to '{filepath}'")
-
-
-if __name__ == "__main__":
-    # TODO: take this out of main.py so that it can be run independently of the processing
-    # TODO:     this will require filtering the data frame - maybe move everything but main() from main.py to a
-    # TODO:       tools.py file so they can be imported and called here?
-    INPUT_FILE = "data/data.csv"
-    df = pd.read_csv(INPUT_FILE)
\ No newline at end of file
@@ -0,0 +1,312 @@
+import pandas as pd
+from multiprocessing import Pool
+
+from logger import logger
+import database_setup as db
+import vector_preprocess as vp
+from title_helper import normalize_title
+from pool_helper import imap_bounded
+
+# CSV ingest: reads the Kaggle movie CSV with pandas, filters it and loads movies, genres and keywords into the database.
+# kept apart from main.py so that commands which don't touch the CSV never import pandas
+
+# only the columns the pipeline uses are read, with explicit types so pandas doesn't have to infer them
+CSV_COLUMNS = ['id', 'title', 'vote_count', 'status', 'release_date', 'runtime', 'adult', 'overview', 'genres', 'keywords']
+CSV_DTYPES = {
+    'id': 'int64',
+    'title': 'object',
+    'vote_count': 'float64',
+    'status': 'category',
+    'release_date': 'object',
+    'runtime': 'float64',
+    'adult': 'object',
+    'overview': 'object',
+    'genres': 'object',
+    'keywords': 'object',
+}
+CSV_CHUNK_SIZE = 50000 # rows per chunk when streaming the CSV, 0 reads the whole file at once
+VISUALIZATION_COLUMNS = ['genres', 'keywords', 'release_date', 'runtime'] # kept from each chunk for the charts
+# with --workers, each worker holds up to this many chunks in flight ahead of the writer
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+def load_and_filter_csv(input_file: str) -> pd.DataFrame:
+    """
+    reads in a CSV movie corpus from disk and filters unwanted entries. expected to contain the following columns:
+    release_date, runtime, vote_count, overview, adult, status, runtime
+    :param input_file: string file location of a CSV file
+    :return: DataFrame of movie data
+    """
+    df = pd.read_csv(input_file, usecols=CSV_COLUMNS, dtype=CSV_DTYPES)
+    logger(f"Loaded CSV file '{input_file}' with {len(df)} records")
+
+    filtered = filter_movies(df)
+    logger(f"Filtered down to {len(filtered)} movies")
+    return filtered
+
+
+def iter_filtered_csv(input_file: str, chunksize: int = CSV_CHUNK_SIZE, pool: Pool = None, workers: int = 1):
+    """
+    streaming version of load_and_filter_csv(): reads chunksize rows at a time and yields each chunk once filtered, so
+    memory use is bounded by the chunk size rather than the size of the CSV\n
+    with a process pool, chunks are filtered by the workers and still yielded in file order
+    :param input_file: string file location of a CSV file
+    :param chunksize: number of CSV rows per chunk
+    :param pool: optional multiprocessing pool to filter chunks in
+    :param workers: number of processes in the pool
+    :return: generator of filtered DataFrames
+    """
+    rows_read = 0
+    rows_kept = 0
+    with pd.read_csv(input_file, usecols=CSV_COLUMNS, dtype=CSV_DTYPES, chunksize=chunksize) as reader:
+        if pool is None:
+            results = ((len(chunk), filter_movies(chunk)) for chunk in reader)
+        else:
+            results = imap_bounded(pool, filter_chunk, reader, CHUNKS_IN_FLIGHT_PER_WORKER * workers)
+
+        for num_rows, filtered in results:
+            rows_read += num_rows
+            rows_kept += len(filtered)
+            logger(f"Read {rows_read} records from '{input_file}', {rows_kept} kept after filtering")
+            yield filtered
+
+
+def filter_chunk(chunk: pd.DataFrame) -> tuple[int, pd.DataFrame]:
+    # worker side of iter_filtered_csv(): raw row count (for progress) and the filtered chunk
+    return len(chunk), filter_movies(chunk)
+
+
+def filter_movies(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    drops unwanted entries from raw CSV movie data and standardizes the remaining rows for processing
+    :param df: DataFrame of raw CSV movie data
+    :return: filtered DataFrame of movie data
+    """
+    # standardize data for filtering
+    df['release_date'] = pd.to_datetime(df['release_date'], errors='coerce')
+    df['runtime'] = pd.to_numeric(df['runtime'], errors='coerce')
+    df['vote_count'] = pd.to_numeric(df['vote_count'], errors='coerce')
+    df['overview'] = df['overview'].fillna('')
+
+    filters = (
+            (df['adult'].isin([False, 'False'])) & # no adult films
+            (df['status'] == 'Released') & # only movies available for viewing
+            (df['overview'].str.split().str.len() >= 5) &
+            (df['keywords'].str.split().str.len() >= 1) &
+            # (df['overview'].str.contains(r'[A-Za-z]', regex=True)) & # overview isn't numeric (is hopefully coherent)
+            # (df['original_language'] == 'en') &
+            (df['runtime'].between(60, 180)) &
+            (df['release_date'].dt.year >= 1920) &
+            (df['vote_count'] >= 40)
+    )
+
+    filtered = df[filters].copy()
+
+    # standardize data for processing
+    filtered["genres"] = filtered["genres"].apply(
+        lambda x: [g.strip().capitalize() for g in x.split(',')] if pd.notnull(x) else []
+    )
+    filtered["keywords"] = filtered["keywords"].apply(
+        lambda x: [k.strip().lower() for k in x.split(',')] if pd.notnull(x) else []
+    )
+    filtered["title_normalized"] = filtered["title"].map(normalize_title)
+
+    return filtered
+
+
+def get_existing_movie_ids(cursor) -> set[int]:
+    # ids of every movie already in the database
+    return {row[0] for row in cursor.execute("SELECT id FROM movies")}
+
+
+def process_movies_from_df(df: pd.DataFrame, cursor, rebuild_search: bool = True, existing_ids: set[int] = None) -> int:
+    """
+    populates database table 'movies' based on a DataFrame of movie data. movies already in the database only get a
+    missing vote count filled in, new movies are upserted - when an id repeats, its last row wins
+    :param df: pandas DataFrame of movie data, expected to contain columns 'id', 'title', 'title_normalized', 'release_data', 'overview' and 'vote_count'
+    :param cursor: sql connection
+    :param rebuild_search: whether to rebuild the title search index when movies were added (default True)
+    :param existing_ids: ids of the movies in the database before this ingest (default: read from the database). chunked
+        ingest reads them once and passes them to every chunk, so movies added by an earlier chunk are upserted like a
+        repeated id in a single DataFrame
+    :return: number of movie rows added or upserted
+    """
+    if existing_ids is None:
+        existing_ids = get_existing_movie_ids(cursor)
+    logger(f"{len(existing_ids)} movies were in the database before this ingest. Processing filtered CSV for new entries.")
+
+    movie_ids = df["id"].astype("int64")
+    vote_counts = df["vote_count"].astype(object).where(df["vote_count"].notnull(), None)
+    is_existing = movie_ids.isin(existing_ids).to_numpy()
+
+    # rows added before vote counts were stored
+    existing_vote_counts = list(zip(
+        [None if v is None else int(v) for v in vote_counts[is_existing]],
+        movie_ids[is_existing].tolist()
+    ))
+
+    new_movies = df[~is_existing]
+    release_dates = new_movies["release_date"].dt.strftime('%Y-%m-%d')
+    cleaned_movies = list(zip(
+        movie_ids[~is_existing].tolist(),
+        new_movies["title"].tolist(),
+        new_movies["title_normalized"].tolist(),
+        new_movies["overview"].tolist(),
+        release_dates.astype(object).where(release_dates.notnull(), None).tolist(),
+        [None if v is None else int(v) for v in vote_counts[~is_existing]]
+    ))
+
+    cursor.executemany("""
+        INSERT INTO movies (id, title, title_normalized, overview, release_date, vote_count)
+        VALUES (?,?,?,?,?,?)
+        ON CONFLICT (id) DO UPDATE SET
+            title = excluded.title,
+            title_normalized = excluded.title_normalized,
+            overview = excluded.overview,
+            release_date = excluded.release_date,
+            vote_count = excluded.vote_count
+    """, cleaned_movies)
+
+    cursor.executemany("UPDATE movies SET vote_count = ? WHERE id = ? AND vote_count IS NULL", existing_vote_counts)
+
+    if cleaned_movies and rebuild_search:
+        db.rebuild_title_search(cursor)
+
+    logger(f"{len(cleaned_movies)} movies added to database. Pending commit.")
+    return len(cleaned_movies)
+
+
+def get_term_pairs(df: pd.DataFrame, cursor, column: str, table: str, name: str) -> list[tuple[int, int]]:
+    """
+    maps every term in a list column of the DataFrame (genres or keywords) to its database id, inserting any terms the
+    table doesn't have yet in one bulk statement
+    :param df: pandas DataFrame of movie data, expected to contain columns 'id' and 'column'
+    :param cursor: SQL connection
+    :param column: DataFrame column holding a list of terms per movie
+    :param table: lookup table, 'genres' or 'keywords'
+    :param name: text column of the lookup table, 'genre' or 'keyword'
+    :return: list of (movie id, term id) pairs, in DataFrame row order and term order within each row
+    """
+    # one row per (movie, term); movies without any terms drop out
+    exploded = df[["id", column]].explode(column).dropna(subset=[column])
+    codes, unique_terms = pd.factorize(exploded[column])
+
+    term_map = pd.DataFrame(cursor.execute(f"SELECT id, {name} FROM {table}").fetchall(), columns=["term_id", name])
+    logger(f"Processing {table} from filtered CSV. {len(term_map)} {table} exist in database.")
+
+    # new terms are inserted in order of first appearance in the CSV
+    new_terms = unique_terms[~unique_terms.isin(term_map[name])]
+    if len(new_terms):
+        logger(f"{len(new_terms)} new {table} found")
+        cursor.executemany(f"INSERT OR IGNORE INTO {table} ({name}) VALUES (?)", [[t] for t in new_terms])
+        term_map = pd.DataFrame(cursor.execute(f"SELECT id, {name} FROM {table}").fetchall(), columns=["term_id", name])
+
+    unique_ids = pd.DataFrame({name: unique_terms}).merge(term_map, on=name, how="left")["term_id"].to_numpy()
+    return list(zip(exploded["id"].astype("int64").tolist(), unique_ids[codes].astype("int64").tolist()))
+
+
+def process_genres_from_df(df: pd.DataFrame, cursor) -> None:
+    """
+    populates database tables 'genres' and 'movies_genres' based on a DataFrame of movie data
+    :param df: pandas DataFrame of movie data, expected to contain columns 'genres' and 'id'
+    :param cursor: SQL connection
+    :return: None
+    """
+    movie_genre_pairs = get_term_pairs(df, cursor, "genres", "genres", "genre")
+
+    cursor.executemany("INSERT OR IGNORE INTO movies_genres (movie_id, genre_id) VALUES (?, ?)", movie_genre_pairs)
+    logger(f"New (movie,genre) pairs added to database: {len(movie_genre_pairs)}. Pending commit.")
+
+
+def clean_keywords(keyword_str: str) -> list:
+    """
+    helper function that removes keywords like 'based on a book', 'based on a novel', etc
+    :param keyword_str: string of comma-separated keywords
+    :return: list of keywords sans those beginning with 'based on'
+    """
+    if not isinstance(keyword_str, str):
+        return []
+
+    keywords = [kw for kw in keyword_str.split(',') if not kw.lower().startswith("based on")]
+
+    return keywords
+
+
+def process_keywords_from_df(df: pd.DataFrame, cursor) -> None:
+    """
+    populates database tables 'keywords' and 'movies_keywords' based on a DataFrame of movie data
+    :param df: pandas DataFrame of movie data, expected to contain columns 'keywords' and 'id'
+    :param cursor: SQL connection
+    :return: None
+    """
+    movie_keyword_pairs = get_term_pairs(df, cursor, "keywords", "keywords", "keyword")
+
+    cursor.executemany("INSERT OR IGNORE INTO movies_keywords (movie_id, keyword_id) VALUES (?, ?)", movie_keyword_pairs)
+    db.refresh_keyword_counts(cursor, df["id"].astype("int64").tolist())
+    logger(f"New (movie,keyword) pairs added to database: {len(movie_keyword_pairs)}. Pending commit.")
+
+
+def process_csv_in_chunks(input_file: str, conn, chunksize: int = CSV_CHUNK_SIZE, pool: Pool = None,
+                          workers: int = 1, vectorize: bool = True) -> tuple[pd.DataFrame, list[int]]:
+    """
+    streams the CSV through movie, genre, keyword and vector ingest one chunk at a time, committing after each chunk
+
+    vectors are only computed per chunk when the database already holds TF-IDF state - a new vectorizer has to be fit
+    on the whole corpus, so in that case vectorization is left to the import_vector_data() call after ingest. per-chunk
+    vectorization skips re-weighting existing vectors, which also happens once after ingest
+    :param input_file: string file location of a CSV file
+    :param conn: SQL connection
+    :param chunksize: number of CSV rows per chunk
+    :param pool: optional multiprocessing pool for filtering and packing vectors, this process remains the only writer
+    :param workers: number of processes in the pool
+    :param vectorize: whether to vectorize chunks along the way (default True) - without it, new movies are left
+        without a vector for the next import_vector_data() call
+    :return: (the columns of every filtered movie needed for visualizations, ids of movies vectorized along the way)
+    """
+    cursor = conn.cursor()
+    vectorize_chunks = vectorize and vp.has_tfidf_state(cursor)
+    visualization_frames = []
+    vectorized_ids = []
+    # read once rather than per chunk, and not updated along the way: a movie added by an earlier chunk is upserted
+    # again when its id repeats, so the last row wins as it does when the whole file is ingested at once
+    existing_ids = get_existing_movie_ids(cursor)
+    added_ids = set()
+
+    for i, chunk in enumerate(iter_filtered_csv(input_file, chunksize, pool, workers)):
+        if chunk.empty:
+            continue
+
+        process_movies_from_df(chunk, cursor, rebuild_search=False, existing_ids=existing_ids)
+        chunk_ids = chunk["id"].astype("int64")
+        added_ids.update(chunk_ids[~chunk_ids.isin(existing_ids)].tolist())
+        process_genres_from_df(chunk, cursor)
+        process_keywords_from_df(chunk, cursor)
+        if vectorize_chunks:
+            vectorized_ids.extend(vp.import_vector_data(cursor, pool=pool, reweight=False, workers=workers))
+        conn.commit()
+        logger(f"Chunk {i + 1} committed, {len(added_ids)} movies added so far")
+
+        visualization_frames.append(chunk[VISUALIZATION_COLUMNS])
+
+    # rebuilt once rather than after every chunk, or to catch up with movies a previous run committed without rebuilding
+    if added_ids or db.is_title_search_stale(cursor):
+        db.rebuild_title_search(cursor)
+        conn.commit()
+
+    visualization_df = pd.concat(visualization_frames) if visualization_frames else pd.DataFrame(columns=VISUALIZATION_COLUMNS)
+    return visualization_df, vectorized_ids
+
+
+def load_visualization_data(input_file: str, chunksize: int = CSV_CHUNK_SIZE, pool: Pool = None, workers: int = 1) -> pd.DataFrame:
+    """
+    filters the CSV the same way ingest does, keeping only the columns the charts need - runtimes aren't stored in the
+    database, so visualizations are drawn from the CSV
+    :param input_file: string file location of a CSV file
+    :param chunksize: number of CSV rows per chunk, 0 reads the whole file at once
+    :param pool: optional multiprocessing pool to filter chunks in
+    :param workers: number of processes in the pool
+    :return: DataFrame of VISUALIZATION_COLUMNS for every filtered movie
+    """
+    if chunksize <= 0:
+        return load_and_filter_csv(input_file)[VISUALIZATION_COLUMNS]
+    frames = [chunk[VISUALIZATION_COLUMNS] for chunk in iter_filtered_csv(input_file, chunksize, pool, workers)]
+    return pd.concat(frames) if frames else pd.DataFrame(columns=VISUALIZATION_COLUMNS)
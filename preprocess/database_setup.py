@@ -1,11 +1,45 @@
+import json
+
+from logger import logger
+from title_helper import normalize_title
+
+TITLE_BACKFILL_BATCH_SIZE = 10000
+
+# secondary indexes, dropped for the duration of a fast load and rebuilt once at the end (one sorted build is much
+# cheaper than updating the B-tree on every insert)
+SECONDARY_INDEXES = {
+    "idx_movies_title_normalized": "CREATE INDEX IF NOT EXISTS idx_movies_title_normalized ON movies (title_normalized)",
+    # the primary keys lead with movie_id, these answer "which movies have keyword/genre X" from the index alone
+    "idx_movies_keywords_keyword": "CREATE INDEX IF NOT EXISTS idx_movies_keywords_keyword ON movies_keywords (keyword_id, movie_id)",
+    "idx_movies_genres_genre": "CREATE INDEX IF NOT EXISTS idx_movies_genres_genre ON movies_genres (genre_id, movie_id)",
+}
+FAST_LOAD_CACHE_KIB = 256 * 1024 # page cache while fast loading
+
+# precomputed top-k most similar movies per movie, maintained by neighbor_preprocess.py
+MOVIE_NEIGHBORS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS movie_neighbors (
+        movie_id INTEGER,
+        neighbor_id INTEGER,
+        rank INTEGER,
+        score REAL,
+        PRIMARY KEY (movie_id, rank),
+        FOREIGN KEY (movie_id) REFERENCES movies(id) ON DELETE CASCADE,
+        FOREIGN KEY (neighbor_id) REFERENCES movies(id) ON DELETE CASCADE
+    );
+"""
+
+
 def initialize_tables(cursor):
     movies_table_query = """
         CREATE TABLE IF NOT EXISTS movies (
             id INTEGER PRIMARY KEY NOT NULL,
             title TEXT NOT NULL,
+            title_normalized TEXT,
             overview TEXT,
             release_date DATE,
-            vector TEXT
+            vote_count INTEGER,
+            keyword_count INTEGER NOT NULL DEFAULT 0,
+            vector BLOB
         );
     """
 
@@ -43,8 +77,231 @@ def initialize_tables(cursor):
         );
     """
 
+    # TF-IDF vocabulary and document frequencies behind movies.vector, maintained by vector_preprocess.py
+    # feature_index is the vector dimension, so existing indices never change - new keywords are appended
+    tfidf_features_table_query = """
+        CREATE TABLE IF NOT EXISTS tfidf_features (
+            feature_index INTEGER PRIMARY KEY NOT NULL,
+            token TEXT UNIQUE NOT NULL,
+            document_frequency INTEGER NOT NULL
+        );
+    """
+
+    tfidf_state_table_query = """
+        CREATE TABLE IF NOT EXISTS tfidf_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            num_documents INTEGER NOT NULL
+        );
+    """
+
     cursor.execute(movies_table_query)
     cursor.execute(genres_table_query)
     cursor.execute(movies_genres_table_query)
     cursor.execute(keywords_table_query)
-    cursor.execute(movies_keywords_table_query)
\ No newline at end of file
+    cursor.execute(movies_keywords_table_query)
+    cursor.execute(MOVIE_NEIGHBORS_TABLE_QUERY)
+    cursor.execute(tfidf_features_table_query)
+    cursor.execute(tfidf_state_table_query)
+    upgrade_schema(cursor)
+    create_secondary_indexes(cursor) # in case an interrupted fast load left them dropped
+
+
+def create_secondary_indexes(cursor) -> None:
+    for query in SECONDARY_INDEXES.values():
+        cursor.execute(query)
+
+
+def get_schema_version(cursor) -> int:
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = cursor.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def upgrade_schema(cursor) -> int:
+    """
+    applies every migration in MIGRATIONS newer than the database's schema_version, in order, then refreshes the query
+    planner statistics. migrations are idempotent, so a run interrupted between a migration and its version bump simply
+    repeats it
+    :param cursor: SQL connection with write access
+    :return: the schema version after upgrading
+    """
+    version = get_schema_version(cursor)
+    pending = MIGRATIONS[version:]
+    for i, migration in enumerate(pending, start=version + 1):
+        migration(cursor)
+        cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (i,))
+        logger(f"Schema migrated to version {i} ({migration.__name__})", type='a')
+
+    if pending:
+        analyze(cursor)
+    return len(MIGRATIONS)
+
+
+def analyze(cursor) -> None:
+    # planner statistics, so lookups pick the covering indexes over the primary keys
+    cursor.execute("ANALYZE")
+    logger("Query planner statistics refreshed (ANALYZE)")
+
+
+def has_column(cursor, table: str, column: str) -> bool:
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})").fetchall())
+
+
+def migrate_vote_count(cursor) -> None:
+    # vote counts weight fuzzy title suggestions, older databases get the column and main.py fills it from the CSV
+    if not has_column(cursor, "movies", "vote_count"):
+        cursor.execute("ALTER TABLE movies ADD COLUMN vote_count INTEGER")
+        logger("Added column movies.vote_count", type='a')
+
+
+def migrate_join_indexes(cursor) -> None:
+    # covering (term, movie) indexes for the keyword_id IN (...) / genre_id IN (...) candidate lookups
+    cursor.execute(SECONDARY_INDEXES["idx_movies_keywords_keyword"])
+    cursor.execute(SECONDARY_INDEXES["idx_movies_genres_genre"])
+
+
+def migrate_keyword_count(cursor) -> None:
+    # materialized number of keywords per movie, replaces GROUP BY movie_id HAVING COUNT(*) > 1 subqueries
+    if not has_column(cursor, "movies", "keyword_count"):
+        cursor.execute("ALTER TABLE movies ADD COLUMN keyword_count INTEGER NOT NULL DEFAULT 0")
+        logger("Added column movies.keyword_count", type='a')
+    refresh_keyword_counts(cursor)
+
+
+def refresh_keyword_counts(cursor, movie_ids: list[int] = None) -> None:
+    # recounts movies.keyword_count for the given movies (default: every movie)
+    query = "UPDATE movies SET keyword_count = (SELECT COUNT(*) FROM movies_keywords WHERE movie_id = movies.id)"
+    if movie_ids is None:
+        cursor.execute(query)
+    else:
+        cursor.execute(query + " WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(list(movie_ids)),))
+
+
+def migrate_title_search(cursor) -> None:
+    """
+    adds the normalized-title column, its B-tree index (exact and prefix lookups) and the FTS5 trigram index (substring
+    lookups) to databases created before title search was indexed, then backfills any missing normalized titles
+    :param cursor: SQL connection
+    :return: None
+    """
+    if not has_column(cursor, "movies", "title_normalized"):
+        cursor.execute("ALTER TABLE movies ADD COLUMN title_normalized TEXT")
+        logger("Added column movies.title_normalized", type='a')
+
+    cursor.execute(SECONDARY_INDEXES["idx_movies_title_normalized"])
+
+    try:
+        # external-content table: the text lives in movies, FTS only stores the trigram index
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS movies_title_fts USING fts5(
+                title_normalized, content='movies', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    except Exception as e:
+        # FTS5 trigram needs SQLite 3.34+, the webapp falls back to LIKE without it
+        logger(f"Unable to create FTS5 trigram title index, substring title search will scan the table:\n{e}", type='a')
+
+    backfilled = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT id, title FROM movies WHERE title_normalized IS NULL LIMIT ?", (TITLE_BACKFILL_BATCH_SIZE,)
+        ).fetchall()
+        if not rows:
+            break
+        cursor.executemany("UPDATE movies SET title_normalized = ? WHERE id = ?",
+                           [[normalize_title(row[1]), row[0]] for row in rows])
+        backfilled += len(rows)
+
+    if backfilled:
+        logger(f"Backfilled {backfilled} normalized titles", type='a')
+        rebuild_title_search(cursor)
+
+
+def migrate_unicode_titles(cursor) -> None:
+    # normalize_title() used to drop every non-Latin letter, so titles like 'Сталкер' were stored as ''. recomputes every
+    # normalized title with the current function and rewrites the ones that changed
+    updated = 0
+    last_id = -1
+    while True:
+        rows = cursor.execute("SELECT id, title, title_normalized FROM movies WHERE id > ? ORDER BY id LIMIT ?",
+                              (last_id, TITLE_BACKFILL_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        changes = [[normalized, movie_id] for movie_id, title, stored in rows if (normalized := normalize_title(title)) != stored]
+        cursor.executemany("UPDATE movies SET title_normalized = ? WHERE id = ?", changes)
+        updated += len(changes)
+        last_id = rows[-1][0]
+
+    if updated:
+        logger(f"Re-normalized {updated} titles", type='a')
+        rebuild_title_search(cursor)
+
+
+def migrate_neighbor_table(cursor) -> None:
+    # the webapp reads movie_neighbors in 'matrix' mode, databases created before it existed get an empty table and
+    # fall back to full scoring until preprocess fills it
+    cursor.execute(MOVIE_NEIGHBORS_TABLE_QUERY)
+
+
+def is_title_search_stale(cursor) -> bool:
+    # the FTS5 index keeps one docsize row per indexed movie, so a count that differs from movies means a rebuild was
+    # missed - e.g. the process died between committing new movies and rebuilding
+    if cursor.execute("SELECT name FROM sqlite_master WHERE name = 'movies_title_fts_docsize'").fetchone() is None:
+        return False
+    indexed = cursor.execute("SELECT COUNT(*) FROM movies_title_fts_docsize").fetchone()[0]
+    return indexed != cursor.execute("SELECT COUNT(*) FROM movies").fetchone()[0]
+
+
+def rebuild_title_search(cursor) -> None:
+    # the FTS5 index isn't maintained by triggers, rebuild it after movies are added or changed
+    if cursor.execute("SELECT name FROM sqlite_master WHERE name = 'movies_title_fts'").fetchone() is None:
+        return
+
+    cursor.execute("INSERT INTO movies_title_fts (movies_title_fts) VALUES ('rebuild')")
+    logger("Rebuilt FTS5 title index (movies_title_fts)")
+
+
+# ordered schema migrations, a database at schema_version N has had the first N applied
+# append new steps at the end, never reorder or remove them
+MIGRATIONS = [
+    migrate_vote_count,
+    migrate_title_search,
+    migrate_join_indexes,
+    migrate_keyword_count,
+    migrate_unicode_titles,
+    migrate_neighbor_table,
+]
+
+
+def begin_fast_load(cursor) -> str:
+    """
+    switches the connection to bulk-ingest settings: WAL journal, no fsync, a large page cache, and no secondary
+    indexes. a crash mid-load can lose the load (re-run it), so end_fast_load() must be called once the data is in
+    :param cursor: SQL connection, outside of a transaction
+    :return: the journal mode to restore afterwards
+    """
+    journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = OFF")
+    cursor.execute(f"PRAGMA cache_size = -{FAST_LOAD_CACHE_KIB}")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    for name in SECONDARY_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    logger(f"Fast load: journal_mode=WAL, synchronous=OFF, {len(SECONDARY_INDEXES)} secondary indexes dropped", type='a')
+    return journal_mode
+
+
+def end_fast_load(cursor, journal_mode: str) -> None:
+    """
+    rebuilds the secondary indexes and restores safe durability settings after begin_fast_load()
+    :param cursor: SQL connection, outside of a transaction
+    :param journal_mode: the journal mode returned by begin_fast_load()
+    :return: None
+    """
+    create_secondary_indexes(cursor)
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+    cursor.execute("PRAGMA synchronous = FULL")
+    cursor.execute("PRAGMA cache_size = -2000") # SQLite's default
+    cursor.execute("PRAGMA temp_store = DEFAULT")
+    logger(f"Fast load finished: secondary indexes rebuilt, journal_mode={journal_mode}, synchronous=FULL", type='a')
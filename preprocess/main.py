@@ -1,185 +1,69 @@
+import time
+STARTED = time.perf_counter() # import budget is measured from here, before anything heavy is loaded
+
+import argparse
+import importlib
+import os
+import sys
 import sqlite3
-import pandas as pd
+from multiprocessing import Pool
+
+# modules shared with the webapp (ann_index, logger, svd_index, title_helper, vector_codec, vector_store) live in the
+# project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import logger as log
 from logger import logger
 import database_setup as db
-import vector_preprocess as vp
-import create_visualizations as cv
-
-RAW_FILE = 'data/data.csv'
-DB_FILE = 'movie_recommender.db'
-
-def load_and_filter_csv(input_file: str) -> pd.DataFrame:
-    """
-    reads in a CSV movie corpus from disk and filters unwanted entries. expected to contain the following columns:
-    release_date, runtime, vote_count, overview, adult, status, runtime
-    :param input_file: string file location of a CSV file
-    :return: DataFrame of movie data
-    """
-    df = pd.read_csv(input_file)
-    logger(f"Loaded CSV file '{input_file}' with {len(df)} records")
-
-    # standardize data for filtering
-    df['release_date'] = pd.to_datetime(df['release_date'], errors='coerce')
-    df['runtime'] = pd.to_numeric(df['runtime'], errors='coerce')
-    df['vote_count'] = pd.to_numeric(df['vote_count'], errors='coerce')
-    df['overview'] = df['overview'].fillna('')
-
-    filters = (
-            (df['adult'] == False) & # no adult films
-            (df['status'] == 'Released') & # only movies available for viewing
-            (df['overview'].str.split().str.len() >= 5) &
-            (df['keywords'].str.split().str.len() >= 1) &
-            # (df['overview'].str.contains(r'[A-Za-z]', regex=True)) & # overview isn't numeric (is hopefully coherent)
-            # (df['original_language'] == 'en') &
-            (df['runtime'].between(60, 180)) &
-            (df['release_date'].dt.year >= 1920) &
-            (df['vote_count'] >= 40)
-    )
-
-    filtered = df[filters].copy()
-
-    # standardize data for processing
-    filtered["genres"] = filtered["genres"].apply(
-        lambda x: [g.strip().capitalize() for g in x.split(',')] if pd.notnull(x) else []
-    )
-    filtered["keywords"] = filtered["keywords"].apply(
-        lambda x: [k.strip().lower() for k in x.split(',')] if pd.notnull(x) else []
-    )
-
-    logger(f"Filtered down to {len(filtered)} movies")
-    return filtered
-
-
-def process_movies_from_df(df: pd.DataFrame, cursor) -> None:
-    """
-    populates database table 'movies' based on a DataFrame of movie data
-    :param df: pandas DataFrame of movie data, expected to contain columns 'id', 'title', 'release_data', and 'overview'
-    :param cursor: sql connection
-    :return: None
-    """
-    cleaned_movies = []
-
-    existing_ids = {row["id"] for row in cursor.execute("SELECT id FROM movies").fetchall()}
-    logger(f"{len(existing_ids)} movies exist in the database. Processing filtered CSV for new entries.")
 
-    for _, row in df.iterrows():
-        movie_id = int(row["id"])
-        if movie_id in existing_ids:
-            continue
+# preprocess runs keep their own log, apart from the webapp's
+LOG_FILE = 'preprocess/log.txt'
+log.set_log_file(LOG_FILE)
 
-        cleaned_movies.append([
-            movie_id,
-            row["title"],
-            row["overview"],
-            row["release_date"].date().isoformat() if pd.notnull(row["release_date"]) else None
-        ])
+# the pipeline is split into commands, each importing only what it needs:
+#   ingest     CSV -> movies, genres and keywords tables (pandas)
+#   vectorize  TF-IDF vectors, neighbour lists, vector store, ANN index and SVD embeddings (numpy / scipy, no pandas)
+#   visualize  charts in static/images, drawn from the filtered CSV (pandas, matplotlib, seaborn)
+#   all        the three in order, the default - 'python preprocess/main.py' behaves as it always has
+# a cron job that only refreshes vectors runs 'python preprocess/main.py vectorize', which starts without ever loading
+# pandas, sklearn or matplotlib
 
-    cursor.executemany("""
-        INSERT INTO movies (id, title, overview, release_date)
-        VALUES (?,?,?,?)
-        ON CONFLICT (id) DO UPDATE SET
-            title = excluded.title,
-            overview = excluded.overview,
-            release_date = excluded.release_date
-    """, cleaned_movies)
-
-    logger(f"{len(cleaned_movies)} movies added to database. Pending commit.")
-
-
-def process_genres_from_df(df: pd.DataFrame, cursor) -> None:
-    """
-    populates database tables 'genres' and 'movies_genres' based on a DataFrame of movie data
-    :param df: pandas DataFrame of movie data, expected to contain columns 'genres' and 'id'
-    :param cursor: SQL connection
-    :return: None
-    """
-    genre_map = {row["genre"]: row["id"] for row in cursor.execute("SELECT id, genre FROM genres").fetchall()}
-    logger(f"Processing genres from filtered CSV. {len(genre_map)} genres exist in database.")
-    movie_genre_pairs = []
-
-    for _, row in df.iterrows():
-        movie_id = int(row["id"])
-        # raw_genres = row.get("genres", "")
-        # # TODO: modify this to account for new data preprocessing
-        # genres = [g.strip() for g in raw_genres.split(",") if g.strip()]
-
-        genres = row.get("genres", [])
-
-        new_genres = set(g for g in genres if g not in genre_map)
-        if new_genres:
-            logger(f"{len(new_genres)} new genres found: {new_genres}")
-            cursor.executemany("INSERT OR IGNORE INTO genres (genre) VALUES (?)", [[g] for g in new_genres])
-            rows = cursor.execute(
-                f"SELECT id, genre FROM genres WHERE genre IN ({','.join(['?'] * len(new_genres))})",
-                list(new_genres)
-            ).fetchall()
-            for row in rows:
-                genre_map[row["genre"]] = row["id"]
-
-        for g in genres:
-            genre_id = genre_map.get(g)
-            if genre_id:
-                movie_genre_pairs.append([movie_id, genre_id])
-
-    cursor.executemany("INSERT OR IGNORE INTO movies_genres (movie_id, genre_id) VALUES (?, ?)", movie_genre_pairs)
-    logger(f"New (movie,genre) pairs added to database: {len(movie_genre_pairs)}. Pending commit.")
-
-
-def clean_keywords(keyword_str: str) -> list:
-    """
-    helper function that removes keywords like 'based on a book', 'based on a novel', etc
-    :param keyword_str: string of comma-separated keywords
-    :return: list of keywords sans those beginning with 'based on'
-    """
-    if not isinstance(keyword_str, str):
-        return []
-
-    keywords = [kw for kw in keyword_str.split(',') if not kw.lower().startswith("based on")]
+RAW_FILE = 'data/data.csv'
+DB_FILE = 'movie_recommender.db'
+CSV_CHUNK_SIZE = 50000 # rows per chunk when streaming the CSV, 0 reads the whole file at once (see csv_preprocess.py)
 
-    return keywords
+COMMANDS = ('ingest', 'vectorize', 'visualize', 'all')
+# seconds from interpreter start-up until a command's imports are done, None for no budget. checked on every run,
+# logged as an alert when exceeded (and fatal with --enforce-import-budget)
+IMPORT_BUDGET_SECONDS = {'ingest': 1.0, 'vectorize': 0.5, 'visualize': None, 'all': None}
+HEAVY_MODULES = ('pandas', 'sklearn', 'matplotlib', 'seaborn') # reported when a budget is exceeded
 
 
-def process_keywords_from_df(df: pd.DataFrame, cursor) -> None:
+def check_import_budget(command: str, budget: float | None, enforce: bool = False) -> float:
     """
-    populates database tables 'keywords' and 'movies_keywords' based on a DataFrame of movie data
-    :param df: pandas DataFrame of movie data, expected to contain columns 'keywords' and 'id'
-    :param cursor: SQL connection
-    :return: None
+    compares the time spent importing so far against the command's budget
+    :param command: the command being run
+    :param budget: seconds allowed, None or 0 for no budget
+    :param enforce: exit with an error instead of logging an alert when the budget is exceeded
+    :return: seconds spent importing
     """
-    keyword_map = {row["keyword"]: row["id"] for row in cursor.execute("SELECT id, keyword FROM keywords").fetchall()}
-    logger(f"Processing keywords from filtered CSV. {len(keyword_map)} keywords exist in database.")
-    movie_keyword_pairs = []
-
-    for _, row in df.iterrows():
-        movie_id = int(row["id"])
-        # raw_keywords = row.get("keywords", "")
-        # # TODO: modify this to account for new data preprocessing
-        # keywords = [k.strip() for k in clean_keywords(raw_keywords)]
-
-        keywords = row.get("keywords", [])
-
-        new_keywords = set(k for k in keywords if k not in keyword_map)
-        if new_keywords:
-            logger(f"{len(new_keywords)} new keywords found: {new_keywords}")
-            cursor.executemany("INSERT OR IGNORE INTO keywords (keyword) VALUES (?)", [[k] for k in new_keywords])
-            rows = cursor.execute(
-                f"SELECT id, keyword FROM keywords WHERE keyword IN ({','.join(['?'] * len(new_keywords))})",
-                list(new_keywords)
-            ).fetchall()
-            for row in rows:
-                keyword_map[row["keyword"]] = row["id"]
-
-        for k in keywords:
-            keyword_id = keyword_map.get(k)
-            if keyword_id:
-                movie_keyword_pairs.append([movie_id, keyword_id])
-
-    cursor.executemany("INSERT OR IGNORE INTO movies_keywords (movie_id, keyword_id) VALUES (?, ?)", movie_keyword_pairs)
-    logger(f"New (movie,keyword) pairs added to database: {len(movie_keyword_pairs)}. Pending commit.")
-
-
-def main():
+    elapsed = time.perf_counter() - STARTED
+    if not budget or elapsed <= budget:
+        logger(f"'{command}' imports done after {elapsed:.3f}s")
+        return elapsed
+
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    message = (f"'{command}' imports took {elapsed:.3f}s, over the {budget:.3f}s budget - heavy modules loaded: "
+               f"{', '.join(loaded) or 'none'}")
+    if enforce:
+        logger(message, type='e')
+        exit(f"Error: {message}")
+    logger(message, type='a')
+    return elapsed
+
+
+def connect() -> sqlite3.Connection:
+    # opens the database and makes sure every table exists
     try:
         conn = sqlite3.connect(DB_FILE)
         conn.row_factory = sqlite3.Row
@@ -194,26 +78,142 @@ def main():
     db.initialize_tables(cursor)
     conn.commit()
     logger(f"Loaded database file {DB_FILE}")
+    return conn
+
 
+def ingest(conn: sqlite3.Connection, args: argparse.Namespace, pool: Pool = None, vectorize: bool = False):
+    """
+    loads RAW_FILE into the movies, genres and keywords tables
+    :param conn: SQL connection
+    :param args: parsed command line
+    :param pool: optional multiprocessing pool for filtering chunks (and packing vectors)
+    :param vectorize: whether to vectorize chunks as they are ingested - only when update_vectors() follows in the
+        same run, it picks up the ids returned here
+    :return: (DataFrame of the columns needed for visualizations, ids of movies vectorized along the way)
+    """
+    import csv_preprocess as csvp
+
+    cursor = conn.cursor()
+    new_vector_ids = []
+    if args.chunksize > 0:
+        try:
+            filtered_df, new_vector_ids = csvp.process_csv_in_chunks(RAW_FILE, conn, args.chunksize, pool, args.workers,
+                                                                     vectorize=vectorize)
+            logger(f"All data from {RAW_FILE} has been processed and committed to the database")
+        except Exception as e:
+            conn.rollback()
+            logger(f"Error in 'main.py' while streaming movie data:\n{e}\nAborting - chunks already committed are kept, "
+                   f"re-running resumes from them", type='e')
+            exit(f"Error: {e}")
+    else:
+        try:
+            filtered_df = csvp.load_and_filter_csv(RAW_FILE)
+            csvp.process_movies_from_df(filtered_df, cursor)
+            csvp.process_genres_from_df(filtered_df, cursor)
+            csvp.process_keywords_from_df(filtered_df, cursor)
+            conn.commit()
+            logger(f"All data from {RAW_FILE} has been processed and committed to the database")
+        except Exception as e:
+            logger(f"Error in 'main.py' while processing movie data:\n{e}\nAborting - no changes committed to the database", type='e')
+            exit(f"Error: {e}")
+
+    return filtered_df, new_vector_ids
+
+
+def update_vectors(conn: sqlite3.Connection, args: argparse.Namespace, pool: Pool = None,
+                   new_vector_ids: list[int] = None) -> list[int]:
+    """
+    brings the stored vectors in step with the movie tables and refreshes the neighbour lists of the ones that changed
+    :param conn: SQL connection
+    :param args: parsed command line
+    :param pool: optional multiprocessing pool for packing vectors, closed once vectors are written
+    :param new_vector_ids: ids of movies already vectorized during ingest
+    :return: ids of every movie whose vector was written in this run
+    """
+    import vector_preprocess as vp
+    import neighbor_preprocess as npp
+
+    cursor = conn.cursor()
+    new_vector_ids = list(new_vector_ids or [])
     try:
-        filtered_df = load_and_filter_csv(RAW_FILE)
-        process_movies_from_df(filtered_df, cursor)
-        process_genres_from_df(filtered_df, cursor)
-        process_keywords_from_df(filtered_df, cursor)
-        conn.commit()
-        logger(f"All data from {RAW_FILE} has been processed and committed to the database")
+        # databases created before vectors were packed as binary get converted in place, then compacted
+        if vp.migrate_json_vectors(cursor):
+            conn.commit()
+            cursor.execute("VACUUM")
+            logger(f"Vacuumed {DB_FILE} after converting JSON vectors")
     except Exception as e:
-        logger(f"Error in 'main.py' while processing movie data:\n{e}\nAborting - no changes committed to the database", type='e')
+        logger(f"Error in main.py while processing vp.migrate_json_vectors():\n{e}\nAborting - no changes committed to the database", type='e')
         exit(f"Error: {e}")
 
     try:
-        vp.import_vector_data(cursor)
+        new_vector_ids += vp.import_vector_data(cursor, ids=args.refresh_ids, pool=pool, workers=args.workers)
         conn.commit()
         logger("All vectors loaded into table (movies) by vp.import_vector_data()")
     except Exception as e:
         logger(f"Error in main.py while processing vp.import_vector_data():\n{e}\nAborting - no changed committed to the database", type='e')
         exit(f"Error: {e}")
 
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    try:
+        npp.update_neighbors(cursor, new_vector_ids)
+        db.analyze(cursor)
+        conn.commit()
+        logger("Neighbour table (movie_neighbors) updated by npp.update_neighbors()")
+    except Exception as e:
+        logger(f"Error in main.py while processing npp.update_neighbors():\n{e}\nAborting - no changes committed to the database", type='e')
+        exit(f"Error: {e}")
+
+    return new_vector_ids
+
+
+def export_vectors(conn: sqlite3.Connection, new_vector_ids: list[int]) -> None:
+    # the webapp memory-maps this copy of the vectors, so it needs rewriting whenever the vectors change
+    import vector_preprocess as vp
+    import vector_store as vs
+    import ann_index as ann
+    import svd_index as svd
+
+    try:
+        if new_vector_ids or vs.get_current_version() is None:
+            vp.export_vector_store(conn.cursor())
+        # the ANN index and SVD embeddings live alongside the store version they were built from
+        if not ann.has_ann_index(vs.get_current_version()):
+            ann.build_ann_index(vs.get_current_version())
+        if not svd.has_svd_index(vs.get_current_version()):
+            svd.build_svd_index(vs.get_current_version())
+    except Exception as e:
+        logger(f"Error in main.py while writing the vector store / ANN index / SVD embeddings:\n{e}\nThe database is unaffected", type='e')
+        exit(f"Error: {e}")
+
+
+def end_fast_load(conn: sqlite3.Connection, journal_mode: str | None) -> None:
+    if journal_mode is None:
+        return
+    try:
+        db.end_fast_load(conn.cursor(), journal_mode)
+    except Exception as e:
+        logger(f"Error in main.py while restoring settings after the fast load:\n{e}\nThe loaded data is committed, "
+               f"re-run without --fast-load to rebuild the indexes", type='e')
+        exit(f"Error: {e}")
+
+
+def visualize(filtered_df=None, args: argparse.Namespace = None, pool: Pool = None) -> None:
+    """
+    renders the charts in static/images
+    :param filtered_df: the visualization columns returned by ingest(), read from RAW_FILE when not given
+    :param args: parsed command line, for the chunk size when the CSV has to be read
+    :param pool: optional multiprocessing pool for filtering chunks
+    :return: None
+    """
+    import create_visualizations as cv
+
+    if filtered_df is None:
+        import csv_preprocess as csvp
+        filtered_df = csvp.load_visualization_data(RAW_FILE, args.chunksize, pool, args.workers)
+
     logger("Creating visualizations for updated data set")
     cv.render_genre_distribution_chart(filtered_df)
     cv.render_keyword_decade_distributions(filtered_df)
@@ -221,5 +221,76 @@ def main():
     logger("Visualizations created and saved to static/images")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Load the movie CSV into the database and build the vector data")
+    parser.add_argument("command", nargs='?', choices=COMMANDS, default='all',
+                        help="ingest the CSV, vectorize, visualize, or all three in order (default: all)")
+    parser.add_argument("--chunksize", type=int, default=CSV_CHUNK_SIZE,
+                        help="CSV rows per chunk when streaming the input, 0 reads the whole file at once")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for CSV filtering and vectorizing, the database is still written by one process")
+    parser.add_argument("--refresh-ids", type=int, nargs='+', default=None, metavar="ID",
+                        help="movie ids whose vectors are recomputed even if they look up to date")
+    parser.add_argument("--fast-load", action="store_true",
+                        help="bulk-ingest settings (WAL, synchronous=OFF, indexes built after the load) - for initial loads")
+    parser.add_argument("--skip-visualizations", action="store_true",
+                        help="don't render the charts in 'all' (matplotlib and seaborn are never imported)")
+    parser.add_argument("--import-budget", type=float, default=None, metavar="SECONDS",
+                        help="start-up import time allowed before the command runs, 0 disables the check "
+                             "(default: 1.0 for ingest, 0.5 for vectorize, none otherwise)")
+    parser.add_argument("--enforce-import-budget", action="store_true",
+                        help="exit with an error instead of logging an alert when the import budget is exceeded")
+    args = parser.parse_args()
+
+    run_ingest = args.command in ('ingest', 'all')
+    run_vectorize = args.command in ('vectorize', 'all')
+    run_visualize = args.command == 'visualize' or (args.command == 'all' and not args.skip_visualizations)
+
+    # everything the command needs is imported up front, so the budget check covers the whole start-up
+    preload = []
+    if run_ingest or args.command == 'visualize':
+        preload.append('csv_preprocess')
+    if run_vectorize:
+        preload.extend(['vector_preprocess', 'neighbor_preprocess', 'vector_store', 'ann_index', 'svd_index'])
+    if run_visualize:
+        preload.append('create_visualizations')
+    for module in preload:
+        importlib.import_module(module)
+    budget = args.import_budget if args.import_budget is not None else IMPORT_BUDGET_SECONDS[args.command]
+    check_import_budget(args.command, budget, args.enforce_import_budget)
+
+    # workers only transform data, every insert still goes through this process's connection, in input order
+    pool = Pool(args.workers) if args.workers > 1 else None
+    if pool is not None:
+        logger(f"Started a pool of {args.workers} worker processes")
+
+    filtered_df = None
+    if run_ingest or run_vectorize:
+        conn = connect()
+        journal_mode = db.begin_fast_load(conn.cursor()) if args.fast_load and run_ingest else None
+
+        new_vector_ids = []
+        if run_ingest:
+            filtered_df, new_vector_ids = ingest(conn, args, pool, vectorize=run_vectorize)
+        if run_vectorize:
+            new_vector_ids = update_vectors(conn, args, pool, new_vector_ids)
+        elif pool is not None:
+            pool.close()
+            pool.join()
+
+        end_fast_load(conn, journal_mode)
+
+        if run_vectorize:
+            export_vectors(conn, new_vector_ids)
+
+    if args.command == 'visualize':
+        visualize(args=args, pool=pool)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elif run_visualize:
+        visualize(filtered_df) # the frame ingest() already filtered, the CSV isn't read twice
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,122 @@
+import numpy as np
+from scipy import sparse
+
+from logger import logger
+from vector_codec import decode_vector_batch
+
+# offline item-to-item neighbour table: the top NUM_NEIGHBORS most similar movies for every movie, stored in
+# movie_neighbors so that one- and two-movie profiles can be answered with a lookup instead of a full scoring pass
+# neighbours follow the same rules as live recommendations (shares a genre AND a keyword, has more than one keyword)
+NUM_NEIGHBORS = 100
+BLOCK_SIZE = 1024 # rows per sparse matrix product, bounds peak memory
+INSERT_BATCH_SIZE = 50000
+
+
+def get_rows(movie_ids: np.ndarray, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # binary search of ids in the ascending movie_ids array: (row per id, whether that id has a row)
+    rows = np.minimum(np.searchsorted(movie_ids, ids), len(movie_ids) - 1)
+    return rows, movie_ids[rows] == ids
+
+
+def load_neighbor_inputs(cursor) -> tuple[np.ndarray, sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    reads everything the neighbour computation needs, aligned by matrix row (movies with a vector, ascending id)
+    :param cursor: SQL connection
+    :return: (movie ids, vector matrix, genre bitmasks (rows x words) as uint64, eligible-as-neighbour flags)
+    """
+    result = cursor.execute("SELECT id, vector FROM movies WHERE vector IS NOT NULL ORDER BY id").fetchall()
+    movie_ids = np.array([r["id"] for r in result], dtype=np.int64)
+    indptr, indices, data = decode_vector_batch([r["vector"] for r in result])
+    num_features = int(indices.max()) + 1 if len(indices) else 0
+    matrix = sparse.csr_matrix((data.astype(np.float64), indices, indptr), shape=(len(movie_ids), num_features))
+
+    # one bit per genre id, so "shares a genre" is a bitwise AND per candidate
+    pairs = np.array(cursor.execute("SELECT movie_id, genre_id FROM movies_genres").fetchall(), dtype=np.int64).reshape(-1, 2)
+    num_words = int(pairs[:, 1].max()) // 64 + 1 if len(pairs) else 1
+    genre_masks = np.zeros((len(movie_ids), num_words), dtype=np.uint64)
+    rows, found = get_rows(movie_ids, pairs[:, 0])
+    rows, genre_ids = rows[found], pairs[found, 1]
+    np.bitwise_or.at(genre_masks, (rows, genre_ids // 64), np.left_shift(np.uint64(1), (genre_ids % 64).astype(np.uint64)))
+
+    multi_keyword_ids = np.array(cursor.execute("SELECT id FROM movies WHERE keyword_count > 1").fetchall(), dtype=np.int64).ravel()
+    eligible = np.isin(movie_ids, multi_keyword_ids)
+
+    return movie_ids, matrix, genre_masks, eligible
+
+
+def compute_neighbors(matrix: sparse.csr_matrix, genre_masks: np.ndarray, eligible: np.ndarray, rows: np.ndarray,
+                      k: int = NUM_NEIGHBORS, block_size: int = BLOCK_SIZE):
+    """
+    computes the top k neighbours for the given rows, BLOCK_SIZE rows per sparse matrix product\n
+    scores are cosine similarities, with ties broken by ascending movie id like the live scoring path
+    :return: generator of (row, neighbour rows, scores)
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    normalized = sparse.diags(1.0 / np.where(norms == 0, 1.0, norms)) @ matrix
+    matrix_t = matrix.T.tocsr()
+
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = (normalized[block] @ matrix_t).tocsr()
+
+        for i, row in enumerate(block):
+            cols = scores.indices[scores.indptr[i]:scores.indptr[i + 1]]
+            values = scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+
+            keep = eligible[cols] & (cols != row) & (values > 0)
+            keep &= (genre_masks[cols] & genre_masks[row]).any(axis=1)
+            cols, values = cols[keep], values[keep]
+
+            order = np.lexsort((cols, -values))[:k]
+            yield row, cols[order], values[order]
+
+
+def store_neighbors(cursor, movie_ids: np.ndarray, results, replace: bool = True) -> int:
+    # writes the neighbour lists in 'results', replacing any existing list for the same movie if 'replace' is set
+    stored = 0
+    batch = []
+    for row, cols, values in results:
+        movie_id = int(movie_ids[row])
+        if replace:
+            cursor.execute("DELETE FROM movie_neighbors WHERE movie_id = ?", (movie_id,))
+        batch.extend([movie_id, int(movie_ids[c]), rank, float(v)] for rank, (c, v) in enumerate(zip(cols, values)))
+        stored += 1
+
+        if len(batch) >= INSERT_BATCH_SIZE:
+            cursor.executemany("INSERT INTO movie_neighbors (movie_id, neighbor_id, rank, score) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+
+    cursor.executemany("INSERT INTO movie_neighbors (movie_id, neighbor_id, rank, score) VALUES (?, ?, ?, ?)", batch)
+    return stored
+
+
+def update_neighbors(cursor, changed_ids: list[int] = None) -> None:
+    """
+    keeps movie_neighbors in step with the stored vectors\n
+    with no existing table (or changed_ids=None) every list is rebuilt. otherwise only the lists that can have changed
+    are recomputed: the changed movies themselves plus every movie that shares a keyword with one of them
+    :param cursor: SQL connection
+    :param changed_ids: ids of movies whose vectors were added or rewritten since the last run
+    :return: None
+    """
+    full_rebuild = changed_ids is None or cursor.execute("SELECT 1 FROM movie_neighbors LIMIT 1").fetchone() is None
+    if not full_rebuild and not changed_ids:
+        logger("Neighbour table is up to date, returning from update_neighbors()")
+        return
+
+    movie_ids, matrix, genre_masks, eligible = load_neighbor_inputs(cursor)
+    if not len(movie_ids):
+        return
+
+    if full_rebuild:
+        cursor.execute("DELETE FROM movie_neighbors")
+        rows = np.arange(len(movie_ids))
+    else:
+        changed_rows, found = get_rows(movie_ids, np.asarray(changed_ids, dtype=np.int64))
+        changed_rows = changed_rows[found]
+        touched = (matrix @ matrix[changed_rows].T).tocoo().row
+        rows = np.union1d(changed_rows, touched)
+
+    logger(f"Computing top {NUM_NEIGHBORS} neighbours for {len(rows)} movies ({'full rebuild' if full_rebuild else 'incremental'})")
+    stored = store_neighbors(cursor, movie_ids, compute_neighbors(matrix, genre_masks, eligible, rows), replace=not full_rebuild)
+    logger(f"Neighbour lists stored for {stored} movies. Pending commit.")
@@ -1,25 +1,44 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
+import numpy as np
+from scipy import sparse
 import pickle
 import os
 import json
+from typing import TYPE_CHECKING
 
 from logger import logger
+import vector_store as vs
+from vector_codec import decode_vector_batch
+from pool_helper import imap_bounded
+
+if TYPE_CHECKING: # annotations only, sklearn itself is imported lazily (see below)
+    from sklearn.feature_extraction.text import TfidfVectorizer
 
 DATABASE_FILE = 'movie_recommender.db'
 VECTORIZER_FILE = 'data/vectorizer.pkl'
 FEATURE_NAMES_CACHE = 'data/feature_names.json'
+MIGRATION_BATCH_SIZE = 10000
+VECTOR_WRITE_BATCH_SIZE = 10000 # rows packed and written per executemany (and per task in a process pool)
+# with a pool, each worker holds up to this many packed batches in flight ahead of the writer
+VECTOR_BATCHES_IN_FLIGHT_PER_WORKER = 2
 
-# checks the database for any movies missing a vector, computes it, writes it to DB based on keywords
-# TODO: modify function to run with optional parameter 'ids' which forces an update on the ids list
-# TODO: if no list passed, then only update records missing a vector
+# movie vectors are TF-IDF weights of their keywords, computed exactly like sklearn's TfidfVectorizer (smooth idf,
+# l2-normalized rows). the first run fits a vectorizer on the whole corpus; after that the vocabulary and document
+# frequencies live in the tfidf_features / tfidf_state tables and are maintained incrementally:
+#   - new keywords are appended to the vocabulary (existing feature indices, i.e. vector dimensions, never move)
+#   - document frequencies are updated from the movies whose keyword sets changed
+#   - every other stored vector is re-weighted with the new idf values, but only rewritten when a weight moved by more
+#     than TFIDF_TOLERANCE
+TFIDF_TOLERANCE = 1e-3
+# sklearn takes about a second to import, so it's imported only where a vectorizer is fit or (un)pickled - a run with
+# no new data never loads it
 
 def custom_tokenizer(x):
     return x.split('|')
 
 
 def get_movies_missing_vectors(cursor) -> list:
-    result = cursor.execute("SELECT id, vector FROM movies")
-    ids_missing_vectors = [m["id"] for m in result if m["vector"] is None]
+    result = cursor.execute("SELECT id FROM movies WHERE vector IS NULL")
+    ids_missing_vectors = [m["id"] for m in result]
     logger(f"import_vector_data() found {len(ids_missing_vectors)} movies in the database with missing vectors", type='a')
 
     return ids_missing_vectors
@@ -28,13 +47,13 @@ def get_movies_missing_vectors(cursor) -> list:
 def get_keywords_for_movies(cursor, missing_vectors) -> dict[int, list]:
     # sql query returns distinct (movie_id, keyword) pairs - keywords need to be built into a list
     # against 1 movie_id entry for vector processing
+    # ids are passed as one JSON array, a placeholder per id runs into SQLite's bound-variable limit on large loads
     ids_keywords = {}
-    placeholder = ','.join(['?'] * len(missing_vectors))
-    query = f"""SELECT mk.movie_id, k.keyword FROM movies_keywords AS mk
+    query = """SELECT mk.movie_id, k.keyword FROM movies_keywords AS mk
                     INNER JOIN keywords AS k ON mk.keyword_id = k.id
-                    WHERE mk.movie_id IN ({placeholder})
+                    WHERE mk.movie_id IN (SELECT value FROM json_each(?))
                 """
-    result = cursor.execute(query, missing_vectors)
+    result = cursor.execute(query, (json.dumps(list(missing_vectors)),))
 
     for row in result:
         if row["movie_id"] not in ids_keywords:  # can't append if a list doesn't exist
@@ -56,24 +75,28 @@ def build_keyword_corpus(ids_keywords) -> (list[int], list[str]):
     return movie_ids, keyword_corpus
 
 
-def vectorize_corpus(keyword_corpus):
-    if os.path.exists(VECTORIZER_FILE): # check for existing vectorizer on disk
-        with open(VECTORIZER_FILE, 'rb') as f:
-            vectorizer = pickle.load(f)
-        if not isinstance(vectorizer, TfidfVectorizer): # verify it was read in as a vectorizer
-            raise TypeError(f"Pickle file {VECTORIZER_FILE} is not a TfidfVectorizer")
-        vector_matrix = vectorizer.transform(keyword_corpus)
-        logger(f"keyword_corpus processed by existing vectorizer '{VECTORIZER_FILE}'")
+def get_row_slices(num_rows: int) -> list[tuple[int, int]]:
+    # (start, end) row ranges of VECTOR_WRITE_BATCH_SIZE rows, one pool task each
+    return [(start, min(start + VECTOR_WRITE_BATCH_SIZE, num_rows)) for start in range(0, num_rows, VECTOR_WRITE_BATCH_SIZE)]
+
+
+def vectorize_corpus(keyword_corpus) -> ('TfidfVectorizer', sparse.csr_matrix):
+    # fits a new vectorizer on the whole corpus - only used when the database has no TF-IDF state yet
+    # fitting needs every document, so this stays in one process even when a pool is available
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(token_pattern = None, tokenizer = custom_tokenizer)
+    vector_matrix = vectorizer.fit_transform(keyword_corpus)
+    logger("No TF-IDF state in the database, fitting a new vectorizer")
+
+    write_vectorizer(vectorizer)
+    return vectorizer, vector_matrix
 
-    else: # no vectorizer exists, create one
-        vectorizer = TfidfVectorizer(token_pattern = None, tokenizer = custom_tokenizer)
-        vector_matrix = vectorizer.fit_transform(keyword_corpus)
-        logger("No vectorizer present on disk, creating a new one")
 
-        # write the vectorizer to disk for potential future use
-        with open(VECTORIZER_FILE, 'wb') as f:
-            pickle.dump(vectorizer, f)
-            logger(f"New vectorizer has been written to disk: '{VECTORIZER_FILE}'", type='a')
+def write_vectorizer(vectorizer: 'TfidfVectorizer') -> None:
+    # write the vectorizer to disk for potential future use
+    with open(VECTORIZER_FILE, 'wb') as f:
+        pickle.dump(vectorizer, f)
+        logger(f"Vectorizer has been written to disk: '{VECTORIZER_FILE}'", type='a')
 
     # store vector names to disk as they may be useful either
     # can't directly serialize np.ndarray, converting to list first
@@ -82,35 +105,309 @@ def vectorize_corpus(keyword_corpus):
         json.dump(feature_names, f, indent=2)
         logger(f"List of {len(feature_names)} feature names has been written to disk")
 
-    return vector_matrix
 
+def has_tfidf_state(cursor) -> bool:
+    return cursor.execute("SELECT 1 FROM tfidf_state").fetchone() is not None
+
+
+def load_tfidf_state(cursor) -> (dict[str, int], np.ndarray, int):
+    """
+    :param cursor: SQL connection
+    :return: (vocabulary as token -> feature index, document frequency per feature, number of documents)
+    """
+    rows = cursor.execute("SELECT feature_index, token, document_frequency FROM tfidf_features ORDER BY feature_index").fetchall()
+    vocabulary = {row["token"]: row["feature_index"] for row in rows}
+    document_frequencies = np.array([row["document_frequency"] for row in rows], dtype=np.int64)
+    num_documents = cursor.execute("SELECT num_documents FROM tfidf_state").fetchone()["num_documents"]
+    return vocabulary, document_frequencies, num_documents
+
+
+def save_tfidf_state(cursor, vocabulary: dict[str, int], document_frequencies: np.ndarray, num_documents: int) -> None:
+    # feature indices are positions in document_frequencies, new tokens are inserted and existing counts updated
+    cursor.executemany("""
+        INSERT INTO tfidf_features (feature_index, token, document_frequency) VALUES (?, ?, ?)
+        ON CONFLICT (feature_index) DO UPDATE SET document_frequency = excluded.document_frequency
+    """, [(int(index), token, int(document_frequencies[index])) for token, index in vocabulary.items()])
+    cursor.execute("INSERT OR REPLACE INTO tfidf_state (id, num_documents) VALUES (1, ?)", (num_documents,))
+
+
+def seed_tfidf_state(cursor, vocabulary: dict[str, int]) -> None:
+    # recovers document frequencies from the stored vectors: a token's weight is non-zero exactly when it occurs
+    result = cursor.execute("SELECT vector FROM movies WHERE vector IS NOT NULL").fetchall()
+    _, indices, _ = decode_vector_batch([r["vector"] for r in result])
+    document_frequencies = np.bincount(indices, minlength=len(vocabulary)).astype(np.int64)
+    save_tfidf_state(cursor, vocabulary, document_frequencies, len(result))
+    logger(f"TF-IDF state stored: {len(vocabulary)} features over {len(result)} documents")
+
+
+def get_idf(document_frequencies: np.ndarray, num_documents: int) -> np.ndarray:
+    # TfidfVectorizer(smooth_idf=True): as if one extra document contained every token once
+    return np.log((1 + num_documents) / (1 + document_frequencies)) + 1
+
+
+def build_term_matrix(cursor, vocabulary: dict[str, int], movie_ids: list[int] = None) -> (np.ndarray, sparse.csr_matrix):
+    """
+    counts the vocabulary tokens of each movie's keywords, tokenized the same way as the vectorizer (lowercased, split
+    on the '|' separator). tokens missing from the vocabulary are appended to it, in sorted order
+    :param cursor: SQL connection
+    :param vocabulary: token -> feature index, extended in place
+    :param movie_ids: only count these movies (default: every movie with keywords)
+    :return: (ascending movie ids, movies x features term counts)
+    """
+    if movie_ids is None:
+        pairs = cursor.execute("SELECT movie_id, keyword_id FROM movies_keywords").fetchall()
+    else:
+        pairs = cursor.execute("SELECT movie_id, keyword_id FROM movies_keywords WHERE movie_id IN (SELECT value FROM json_each(?))",
+                               (json.dumps(list(movie_ids)),)).fetchall()
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    doc_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+
+    # tokens per keyword, computed once per distinct keyword rather than once per (movie, keyword)
+    keyword_ids = np.unique(pairs[:, 1])
+    keywords = dict(cursor.execute("SELECT id, keyword FROM keywords WHERE id IN (SELECT value FROM json_each(?))",
+                                   (json.dumps(keyword_ids.tolist()),)).fetchall())
+    tokens = {k: custom_tokenizer(keywords[k].lower()) for k in keyword_ids.tolist()}
+
+    new_tokens = sorted({t for ts in tokens.values() for t in ts if t not in vocabulary})
+    for token in new_tokens:
+        vocabulary[token] = len(vocabulary)
+    if new_tokens:
+        logger(f"{len(new_tokens)} new tokens appended to the TF-IDF vocabulary")
+
+    # flattened feature indices per keyword id, so every (movie, keyword) pair expands with array indexing
+    max_keyword_id = int(keyword_ids.max()) if len(keyword_ids) else 0
+    counts = np.zeros(max_keyword_id + 1, dtype=np.int64)
+    offsets = np.zeros(max_keyword_id + 2, dtype=np.int64)
+    for k, ts in tokens.items():
+        counts[k] = len(ts)
+    offsets[1:] = np.cumsum(counts)
+    flat = np.empty(offsets[-1], dtype=np.int64)
+    for k, ts in tokens.items():
+        flat[offsets[k]:offsets[k + 1]] = [vocabulary[t] for t in ts]
+
+    pair_counts = counts[pairs[:, 1]]
+    starts = np.repeat(offsets[pairs[:, 1]], pair_counts)
+    within = np.arange(pair_counts.sum()) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+    features = flat[starts + within]
+
+    # duplicate (movie, token) entries are summed into term counts
+    term_counts = sparse.csr_matrix((np.ones(len(features)), (np.repeat(rows, pair_counts), features)),
+                                    shape=(len(doc_ids), len(vocabulary)))
+    term_counts.sort_indices()
+    return doc_ids, term_counts
+
+
+def load_stored_vectors(cursor, movie_ids: np.ndarray, num_features: int) -> (np.ndarray, sparse.csr_matrix):
+    # stored vectors aligned with movie_ids (empty rows for movies without one), and which movies had one
+    result = cursor.execute("SELECT id, vector FROM movies WHERE vector IS NOT NULL AND id IN (SELECT value FROM json_each(?))",
+                            (json.dumps(movie_ids.tolist()),)).fetchall()
+    indptr, indices, data = decode_vector_batch([r["vector"] for r in result])
+    found = sparse.csr_matrix((data.astype(np.float64), indices, indptr), shape=(len(result), num_features))
+
+    rows = np.searchsorted(movie_ids, np.array([r["id"] for r in result], dtype=np.int64))
+    placement = sparse.csr_matrix((np.ones(len(rows)), (rows, np.arange(len(rows)))), shape=(len(movie_ids), len(rows)))
+    has_vector = np.zeros(len(movie_ids), dtype=bool)
+    has_vector[rows] = True
+    return has_vector, (placement @ found).tocsr()
+
+
+def update_vectors(cursor, ids: list[int] = None, reweight: bool = True, pool=None, workers: int = 1) -> list[int]:
+    """
+    incremental TF-IDF maintenance against the state in tfidf_features / tfidf_state\n
+    movies without a vector, movies whose keyword set no longer matches their stored vector and the movies in 'ids' are
+    always (re)written. with 'reweight', every other stored vector is recomputed under the updated idf values too and
+    rewritten only if a weight moved by more than TFIDF_TOLERANCE
+    :param cursor: SQL connection
+    :param ids: movie ids to rewrite regardless of tolerance
+    :param reweight: whether to check every stored vector against the new idf values (skipped while ingesting chunks)
+    :param pool: optional multiprocessing pool for packing vectors
+    :param workers: number of processes in the pool
+    :return: ids of the movies whose vectors were written
+    """
+    vocabulary, document_frequencies, num_documents = load_tfidf_state(cursor)
+
+    if reweight:
+        doc_ids, term_counts = build_term_matrix(cursor, vocabulary)
+    else:
+        target_ids = [row["id"] for row in cursor.execute("SELECT id FROM movies WHERE vector IS NULL").fetchall()]
+        doc_ids, term_counts = build_term_matrix(cursor, vocabulary, target_ids + list(ids or []))
+    if not len(doc_ids):
+        return []
+    has_vector, stored = load_stored_vectors(cursor, doc_ids, len(vocabulary))
+
+    # document frequencies count the token sets of the stored vectors, so they move with the rows whose set changes
+    new_terms = (term_counts > 0).astype(np.int64)
+    old_terms = (stored != 0).astype(np.int64)
+    terms_changed = np.asarray(abs(new_terms - old_terms).sum(axis=1)).ravel() > 0
+    document_frequencies = np.concatenate([document_frequencies, np.zeros(len(vocabulary) - len(document_frequencies), dtype=np.int64)])
+    document_frequencies += np.asarray(new_terms[terms_changed].sum(axis=0)).ravel()
+    document_frequencies -= np.asarray(old_terms[terms_changed].sum(axis=0)).ravel()
+    num_documents += int((~has_vector).sum())
+
+    weights = term_counts @ sparse.diags(get_idf(document_frequencies, num_documents))
+    norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+    weights = (sparse.diags(1.0 / np.where(norms == 0, 1.0, norms)) @ weights).tocsr()
+    weights.sort_indices()
 
-def store_vectors_to_db(cursor, movie_ids, vector_matrix):
-    # convert the scipy csr to a dict for loading and unloading from DB
-    #--TODO: instead of dumping as json, can we pickle the array as is and put that in the db?
-    #--TODO: would probably make later math easier to do
-    for i in range(vector_matrix.shape[0]):
-        row = vector_matrix.getrow(i)
-        coo = row.tocoo()
-        row_dict = {int(k): float(v) for k,v in zip(coo.col, coo.data)}
-        query = "UPDATE movies SET vector = ? WHERE id = ?"
-        values = [json.dumps(row_dict), movie_ids[i]]
-        cursor.execute(query, values)
+    write = terms_changed | np.isin(doc_ids, list(ids or []))
+    drift = abs(weights - stored).tocsr()
+    drift = np.asarray(drift.max(axis=1).todense()).ravel() if drift.shape[1] else np.zeros(len(doc_ids))
+    reweighted = ~write & (drift > TFIDF_TOLERANCE)
+    write |= reweighted
 
+    rows = np.flatnonzero(write)
+    store_vectors_to_db(cursor, doc_ids[rows].tolist(), weights[rows], pool, workers)
+    save_tfidf_state(cursor, vocabulary, document_frequencies, num_documents)
+    logger(f"TF-IDF update over {len(doc_ids)} documents: {int((~has_vector).sum())} new, "
+           f"{int((terms_changed & has_vector).sum())} with changed keywords, {int(reweighted.sum())} re-weighted "
+           f"beyond tolerance {TFIDF_TOLERANCE}, {len(vocabulary)} features")
 
-def import_vector_data(cursor, ids=None):
+    if reweight and (len(rows) or not os.path.exists(VECTORIZER_FILE)):
+        # keep the pickled vectorizer and feature names in step with the database state. the state only changes along
+        # with written vectors, so a run that wrote none leaves the pickle as it is
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectorizer = load_vectorizer() or TfidfVectorizer(token_pattern = None, tokenizer = custom_tokenizer)
+        vectorizer.vocabulary_ = dict(vocabulary)
+        vectorizer.idf_ = get_idf(document_frequencies, num_documents)
+        write_vectorizer(vectorizer)
+
+    return doc_ids[rows].tolist()
+
+
+def load_vectorizer() -> 'TfidfVectorizer | None':
+    if not os.path.exists(VECTORIZER_FILE):
+        return None
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    with open(VECTORIZER_FILE, 'rb') as f:
+        vectorizer = pickle.load(f)
+    if not isinstance(vectorizer, TfidfVectorizer): # verify it was read in as a vectorizer
+        raise TypeError(f"Pickle file {VECTORIZER_FILE} is not a TfidfVectorizer")
+    return vectorizer
+
+
+def pack_sparse_row(indices, values) -> bytes:
+    """
+    packs one sparse vector for the movies.vector BLOB column: int32 indices followed by float32 values, little-endian\n
+    decoded by vector_codec.py in the project root - keep the two in sync
+    :param indices: feature indices of the non-zero entries
+    :param values: matching non-zero values
+    :return: bytes of length 8 * number of non-zeros
+    """
+    return np.asarray(indices, dtype='<i4').tobytes() + np.asarray(values, dtype='<f4').tobytes()
+
+
+def pack_matrix_rows(vector_matrix) -> list[bytes]:
+    # packs every row of a csr matrix with pack_sparse_row(), in row order
+    indptr, indices, data = vector_matrix.indptr, vector_matrix.indices, vector_matrix.data
+    return [pack_sparse_row(indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]])
+            for i in range(vector_matrix.shape[0])]
+
+
+def store_vectors_to_db(cursor, movie_ids, vector_matrix, pool=None, workers: int = 1):
+    # pack each scipy csr row into a binary blob for loading and unloading from DB, one batch of rows per executemany
+    # with a pool, batches are packed by the workers (in order, a bounded number ahead) and this process only writes
+    slices = get_row_slices(vector_matrix.shape[0])
+    batches = (vector_matrix[start:end] for start, end in slices)
+    if pool is not None and len(slices) > 1:
+        packed_batches = imap_bounded(pool, pack_matrix_rows, batches, VECTOR_BATCHES_IN_FLIGHT_PER_WORKER * workers)
+    else:
+        packed_batches = map(pack_matrix_rows, batches)
+
+    for (start, end), blobs in zip(slices, packed_batches):
+        cursor.executemany("UPDATE movies SET vector = ? WHERE id = ?", zip(blobs, movie_ids[start:end]))
+
+
+def migrate_json_vectors(cursor) -> int:
+    """
+    converts vectors written by older versions (JSON text) into the packed binary format, in batches
+    :param cursor: SQL connection
+    :return: number of rows converted
+    """
+    converted = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT id, vector FROM movies WHERE typeof(vector) = 'text' LIMIT ?", (MIGRATION_BATCH_SIZE,)
+        ).fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for row in rows:
+            row_dict = {int(k): v for k, v in json.loads(row["vector"]).items()}
+            updates.append([pack_sparse_row(list(row_dict.keys()), list(row_dict.values())), row["id"]])
+        cursor.executemany("UPDATE movies SET vector = ? WHERE id = ?", updates)
+        converted += len(updates)
+
+    if converted:
+        logger(f"migrate_json_vectors() converted {converted} JSON vectors to the packed binary format", type='a')
+    return converted
+
+
+def import_vector_data(cursor, ids=None, pool=None, reweight=True, workers: int = 1) -> list[int]:
+    """
+    computes vectors for every movie missing one and keeps the stored vectors in step with the TF-IDF statistics\n
+    the first run fits a new vectorizer on every movie; later runs go through update_vectors()
+    :param cursor: SQL connection
+    :param ids: movie ids whose vectors are recomputed even if they look up to date
+    :param pool: optional multiprocessing pool for packing vectors
+    :param workers: number of processes in the pool
+    :param reweight: whether to re-weight existing vectors under the new idf values (see update_vectors())
+    :return: ids of the movies whose vectors were written
+    """
+    if not has_tfidf_state(cursor):
+        has_vectors = cursor.execute("SELECT 1 FROM movies WHERE vector IS NOT NULL LIMIT 1").fetchone() is not None
+        vectorizer = load_vectorizer() if has_vectors else None
+        if vectorizer is not None:
+            # vectors written before the state was kept in the database: the vectorizer holds the vocabulary they use
+            seed_tfidf_state(cursor, vectorizer.vocabulary_)
+        else:
+            if has_vectors:
+                logger(f"Stored vectors have no vocabulary ('{VECTORIZER_FILE}' is missing), recomputing every vector", type='a')
+                cursor.execute("UPDATE movies SET vector = NULL")
+            return fit_vector_data(cursor, pool, workers)
+
+    if not ids and not reweight and cursor.execute("SELECT 1 FROM movies WHERE vector IS NULL LIMIT 1").fetchone() is None:
+        logger("Vectors for all rows in table (movies) have already been calculated, returning from import_vector_data()")
+        return []
+
+    written = update_vectors(cursor, ids, reweight, pool, workers)
+    logger("import_vector_data() finished without error - returning")
+    return written
+
+
+def fit_vector_data(cursor, pool=None, workers: int = 1) -> list[int]:
+    # first run: fit a vectorizer on every movie missing a vector and record its state in the database
     movies_missing_vectors = get_movies_missing_vectors(cursor)
 
     if not movies_missing_vectors:
         logger(f"Vectors for all rows in table (movies) have already been calculated, returning from import_vector_data()")
-        return
+        return []
 
     ids_keywords = get_keywords_for_movies(cursor, movies_missing_vectors)
     movie_ids, keyword_corpus = build_keyword_corpus(ids_keywords)
-    vector_matrix = vectorize_corpus(keyword_corpus)
-    store_vectors_to_db(cursor, movie_ids, vector_matrix)
+    vectorizer, vector_matrix = vectorize_corpus(keyword_corpus)
+    store_vectors_to_db(cursor, movie_ids, vector_matrix, pool, workers)
+    seed_tfidf_state(cursor, vectorizer.vocabulary_)
 
     logger("import_vector_data() finished without error - returning")
+    return movie_ids
+
+
+def export_vector_store(cursor, store_dir: str = vs.STORE_DIR) -> int:
+    """
+    writes every stored movie vector to a new version of the memory-mapped vector store used by the webapp
+    :param cursor: SQL connection
+    :param store_dir: root directory of the store
+    :return: the new store version
+    """
+    result = cursor.execute("SELECT id, vector FROM movies WHERE vector IS NOT NULL ORDER BY id").fetchall()
+    movie_ids = np.array([r["id"] for r in result], dtype=np.int64)
+    indptr, indices, data = decode_vector_batch([r["vector"] for r in result])
+
+    num_features = int(indices.max()) + 1 if len(indices) else 0
+    vector_matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(movie_ids), num_features))
+    return vs.write_store(movie_ids, vector_matrix, store_dir)
+
 
 # potentially unnecessary as TfidfVectorizer() returns normalized vectors already?
 # keeping this as a need may arise with composite user vectors
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import sys
+import time
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+
+import database_helper as dbh
+import index_helper as ih
+import matrix_helper as mh
+import vector_helper as vh
+from logger import logger
+from pool_helper import imap_bounded
+
+# offline bulk recommendations, e.g. for newsletters: reads user profiles as JSON lines and writes one JSON line of
+# recommendations per profile, in input order. run from the project root after preprocess/main.py:
+#   python recommend_batch.py profiles.jsonl --output recommendations.jsonl --workers 8
+#   cat profiles.jsonl | python recommend_batch.py - --output recommendations.jsonl
+# an input line is either a list of movie ids, [603, 604], or an object {"id": "user-1", "movie_ids": [603, 604]} whose
+# "id" is copied to the output. output lines look like
+#   {"line": 1, "id": "user-1", "recommendations": [{"id": 605, "title": "...", "score": 0.71}, ...]}
+# or {"line": 1, "error": "..."} for a line that can't be scored
+# profiles are scored exactly like /api/recommendations ('matrix' scoring, no neighbour lists or cache), in batches,
+# by a pool of worker processes. each worker memory-maps the vector store, so they share one page-cache copy of it
+# every CHECKPOINT_EVERY profiles the output is synced and <output>.checkpoint records how far the run got - running the
+# same command again resumes from there (--restart starts over)
+
+BATCH_SIZE = 256 # profiles per scoring call, each batch is one sparse matrix-matrix product
+CHECKPOINT_EVERY = 10000 # profiles written between checkpoints
+BATCHES_IN_FLIGHT_PER_WORKER = 2 # input read ahead of the writer, bounds memory on huge inputs
+
+_db = None # worker's own read-only connection, there's no Flask request to borrow one from
+
+
+def init_worker() -> None:
+    # runs once in each worker process: maps the vector store, builds the inverted index, opens a connection
+    global _db
+    mh.load_vector_matrix()
+    ih.load_index()
+    _db = dbh.open_db()
+
+
+def parse_profile(line: str) -> tuple[object, list[int]]:
+    """
+    :param line: one input line
+    :return: (profile id or None, movie ids)
+    :raises ValueError: if the line isn't a list of movie ids or an object with one, ids as in /api/recommendations
+    """
+    profile = json.loads(line)
+    profile_id = None
+    if isinstance(profile, dict):
+        profile_id = profile.get("id")
+        profile = profile.get("movie_ids")
+    if not isinstance(profile, list) or not profile or not all(vh.is_movie_id(m) for m in profile):
+        raise ValueError("expected a non-empty list of movie ids")
+    return profile_id, profile
+
+
+def score_lines(batch: list[tuple[int, str]], n: int) -> str:
+    """
+    worker side: parses, scores and serializes one batch of input lines
+    :param batch: (line number, line) tuples
+    :param n: recommendations per profile
+    :return: the output lines for the batch, in input order, as one string
+    """
+    parsed = []
+    for line_number, line in batch:
+        try:
+            parsed.append((line_number, *parse_profile(line)))
+        except ValueError as e: # json.JSONDecodeError is a ValueError
+            parsed.append((line_number, None, str(e)))
+
+    valid = [(line_number, profile) for line_number, _, profile in parsed if isinstance(profile, list)]
+    top_scores = {}
+    errors = {}
+    try:
+        if valid:
+            top_scores = dict(zip((line_number for line_number, _ in valid), vh.score_batch([p for _, p in valid], n)))
+    except Exception as e:
+        # one profile the scorer can't handle mustn't end the run: score the batch one profile at a time so only the
+        # failing lines get an error record
+        logger(f"Scoring a batch of {len(valid)} profiles failed ({type(e).__name__}: {e}), retrying them one at a time", type='a')
+        for line_number, profile in valid:
+            try:
+                top_scores[line_number] = vh.score_batch([profile], n)[0]
+            except Exception as profile_error:
+                errors[line_number] = f"{type(profile_error).__name__}: {profile_error}"
+    recommended_ids = list({m for scores in top_scores.values() for m, _ in scores})
+    titles = dbh.get_titles_by_ids(recommended_ids, db=_db) if recommended_ids else {}
+
+    output = []
+    for line_number, profile_id, profile in parsed:
+        record = {"line": line_number}
+        if profile_id is not None:
+            record["id"] = profile_id
+        if line_number in top_scores:
+            record["recommendations"] = [{"id": m, "title": titles.get(m), "score": score} for m, score in top_scores[line_number]]
+        else:
+            record["error"] = errors.get(line_number, profile)
+        output.append(json.dumps(record) + "\n")
+    return ''.join(output)
+
+
+def read_batches(lines, start_line: int, batch_size: int):
+    # numbered, non-blank input lines grouped into batches, skipping the first 'start_line' lines
+    numbered = enumerate(lines, start=1)
+    numbered = ((i, line) for i, line in islice(numbered, start_line, None) if line.strip())
+    while batch := list(islice(numbered, batch_size)):
+        yield batch
+
+
+def read_checkpoint(checkpoint_file: str, settings: dict) -> tuple[int, int]:
+    """
+    :return: (input lines already processed, output bytes written at that point) - (0, 0) without a checkpoint
+    """
+    if not os.path.exists(checkpoint_file):
+        return 0, 0
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    if checkpoint["settings"] != settings:
+        exit(f"Error: {checkpoint_file} was written with different settings {checkpoint['settings']}, "
+             f"re-run with those or pass --restart")
+    return checkpoint["lines_done"], checkpoint["output_bytes"]
+
+
+def write_checkpoint(checkpoint_file: str, settings: dict, lines_done: int, output) -> None:
+    # the output is synced first, so the checkpoint never points past data that made it to disk
+    output.flush()
+    os.fsync(output.fileno())
+    tmp_file = f"{checkpoint_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({"settings": settings, "lines_done": lines_done, "output_bytes": output.tell()}, f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score user profiles in bulk, JSON lines in and out")
+    parser.add_argument("input", help="file of JSON lines, one profile per line, or - for stdin")
+    parser.add_argument("--output", required=True, help="file the recommendations are written to")
+    parser.add_argument("--n", type=int, default=5, help="recommendations per profile")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="scoring processes, 1 scores in this process")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="profiles per scoring batch")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="profiles between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and start over")
+    args = parser.parse_args()
+
+    if args.n < 1 or args.batch_size < 1 or args.workers < 1:
+        parser.error("--n, --batch-size and --workers must be positive")
+    if not os.path.exists(dbh.DB_FILE):
+        exit(f"Error: {dbh.DB_FILE} not found - run preprocess/main.py first (from the project root)")
+
+    # a checkpoint is only valid for the same input and scoring settings
+    settings = {"input": os.path.abspath(args.input) if args.input != '-' else '-', "n": args.n}
+    checkpoint_file = f"{args.output}.checkpoint"
+    if args.restart and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    start_line, output_bytes = read_checkpoint(checkpoint_file, settings)
+    if start_line:
+        logger(f"Resuming bulk recommendations from input line {start_line + 1}")
+        print(f"Resuming after {start_line} input lines", file=sys.stderr)
+
+    # anything written after the last checkpoint is rewritten, so the output never holds a line twice
+    output = open(args.output, 'r+b' if start_line else 'wb')
+    output.truncate(output_bytes)
+    output.seek(output_bytes)
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    pool = Pool(args.workers, initializer=init_worker) if args.workers > 1 else None
+    if pool is None:
+        init_worker()
+
+    batches = read_batches(source, start_line, args.batch_size)
+    score = partial(score_lines, n=args.n)
+    if pool is None:
+        results = map(score, batches)
+    else:
+        results = imap_bounded(pool, score, batches, BATCHES_IN_FLIGHT_PER_WORKER * args.workers)
+
+    start = time.perf_counter()
+    lines_done = start_line
+    written_bytes = output_bytes # end of the last complete batch in the output
+    profiles_written = 0
+    next_checkpoint = args.checkpoint_every
+    logger(f"Bulk recommendations from '{args.input}' to '{args.output}' with {args.workers} worker(s)")
+    try:
+        # each batch's last input line number is recovered from its output, blank lines included
+        for chunk in results:
+            output.write(chunk.encode('utf-8'))
+            last = chunk.rstrip("\n").rsplit("\n", 1)[-1]
+            lines_done = json.loads(last)["line"]
+            written_bytes = output.tell()
+            profiles_written += chunk.count("\n")
+            if profiles_written >= next_checkpoint:
+                write_checkpoint(checkpoint_file, settings, lines_done, output)
+                next_checkpoint += args.checkpoint_every
+                rate = profiles_written / (time.perf_counter() - start)
+                print(f"{lines_done} input lines done ({rate:.0f} profiles/s)", file=sys.stderr)
+    except KeyboardInterrupt:
+        # a batch interrupted halfway through being written is dropped, it is redone on resume
+        output.seek(written_bytes)
+        output.truncate()
+        write_checkpoint(checkpoint_file, settings, lines_done, output)
+        exit(f"Interrupted after {lines_done} input lines - run the same command again to resume")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    output.close()
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file) # finished, nothing to resume
+    elapsed = time.perf_counter() - start
+    logger(f"Bulk recommendations finished: {profiles_written} profiles in {elapsed:.1f}s")
+    print(f"{profiles_written} profiles written to {args.output} in {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
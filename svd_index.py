@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+from typing import NamedTuple
+import numpy as np
+from scipy import sparse
+
+import vector_store as vs
+from logger import logger
+
+# dense low-rank embeddings of the keyword vectors, fit with TruncatedSVD by the preprocess pipeline
+# the keyword space has tens of thousands of dimensions and a handful of non-zeros per movie, so exact keyword overlap
+# is brittle: two movies with related but different keywords score 0. projecting onto the top singular vectors puts
+# keywords that co-occur close together, and scoring becomes one dense matrix-vector product
+# written to data/vector_store/vN/svd/ so the embeddings always match the vectors they were fit on:
+#   embeddings.npy - (movies x components) float32, each row L2-normalized, same row order as the store
+#   norms.npy - the length of each row before normalization, needed to build composite vectors
+SVD_DIR = 'svd'
+SVD_MANIFEST = 'svd.json'
+NUM_COMPONENTS = 64
+SEED = 42
+
+
+class SvdIndex(NamedTuple):
+    version: int # vector store version the embeddings were fit on
+    embeddings: np.ndarray
+    norms: np.ndarray
+
+
+# loaded embeddings, replaced as a whole when another store version is mapped
+_loaded = None
+
+
+def build_svd_index(version: int, store_dir: str = vs.STORE_DIR, num_components: int = NUM_COMPONENTS) -> None:
+    """
+    fits a TruncatedSVD on one version of the vector store and writes the embeddings next to it
+    :param version: vector store version to fit
+    :param store_dir: root directory of the vector store
+    :param num_components: embedding dimensions (capped at features - 1)
+    :return: None
+    """
+    from sklearn.decomposition import TruncatedSVD # only the preprocess pipeline needs scikit-learn
+
+    version_dir = vs.get_version_dir(version, store_dir)
+    with open(os.path.join(version_dir, vs.MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)
+    data, indices, indptr = (np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode='r')
+                             for name in ('data', 'indices', 'indptr'))
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(manifest["rows"], manifest["features"]))
+
+    num_components = max(1, min(num_components, manifest["features"] - 1))
+    svd = TruncatedSVD(n_components=num_components, random_state=SEED)
+    embeddings = svd.fit_transform(matrix).astype(np.float32)
+
+    norms = np.linalg.norm(embeddings, axis=1)
+    embeddings /= np.where(norms == 0, 1.0, norms)[:, None]
+
+    svd_dir = os.path.join(version_dir, SVD_DIR)
+    tmp_dir = svd_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'embeddings.npy'), np.ascontiguousarray(embeddings))
+    np.save(os.path.join(tmp_dir, 'norms.npy'), norms.astype(np.float32))
+    with open(os.path.join(tmp_dir, SVD_MANIFEST), 'w') as f:
+        json.dump({
+            "store_version": version,
+            "components": num_components,
+            "explained_variance": float(svd.explained_variance_ratio_.sum()),
+        }, f, indent=2)
+    shutil.rmtree(svd_dir, ignore_errors=True)
+    os.rename(tmp_dir, svd_dir)
+    logger(f"SVD embeddings for vector store v{version} written: {num_components} components, "
+           f"{svd.explained_variance_ratio_.sum():.1%} of variance explained")
+
+
+def has_svd_index(version: int, store_dir: str = vs.STORE_DIR) -> bool:
+    return os.path.exists(os.path.join(vs.get_version_dir(version, store_dir), SVD_DIR, SVD_MANIFEST))
+
+
+def load_svd_index(version: int, store_dir: str = vs.STORE_DIR) -> bool:
+    """
+    memory-maps the embeddings for a vector store version
+    :return: whether embeddings were found for that version
+    """
+    return get_index(version, store_dir, reload=True) is not None
+
+
+def get_index(version: int, store_dir: str = vs.STORE_DIR, reload: bool = False) -> SvdIndex | None:
+    """
+    the loaded embeddings if they were fit on this vector store version, otherwise maps that version's embeddings and
+    publishes them as the loaded ones. callers keep the returned index for the whole request
+    :param reload: map the embeddings even if this version is already loaded
+    :return: the embeddings, None if that version has none
+    """
+    global _loaded
+
+    index = _loaded
+    if index is not None and index.version == version and not reload:
+        return index
+    if not has_svd_index(version, store_dir):
+        return None
+
+    svd_dir = os.path.join(vs.get_version_dir(version, store_dir), SVD_DIR)
+    index = SvdIndex(
+        version,
+        np.load(os.path.join(svd_dir, 'embeddings.npy'), mmap_mode='r'),
+        np.load(os.path.join(svd_dir, 'norms.npy'), mmap_mode='r')
+    )
+    _loaded = index
+    logger(f"Mapped SVD embeddings for vector store v{version}: {index.embeddings.shape[1]} components")
+    return index
+
+
+def get_version() -> int | None:
+    # vector store version of the loaded embeddings, None if nothing is loaded
+    index = _loaded
+    return index.version if index is not None else None
+
+
+def get_composite_by_rows(rows: np.ndarray, index: SvdIndex = None) -> np.ndarray:
+    """
+    projection of the (sparse) composite vector: the SVD is linear, so summing the un-normalized embeddings of the
+    user's movies equals embedding the sum of their keyword vectors
+    :param rows: matrix rows of the user's movies
+    :param index: embeddings from get_index() (default: the loaded ones)
+    :return: normalized dense composite embedding
+    """
+    if index is None:
+        index = _loaded
+    composite = (index.embeddings[rows] * index.norms[rows][:, None]).sum(axis=0, dtype=np.float64)
+    norm = np.linalg.norm(composite)
+    return composite / norm if norm else composite
+
+
+def score_rows(composite: np.ndarray, rows: np.ndarray, index: SvdIndex = None) -> np.ndarray:
+    # cosine similarity of each candidate row with the composite embedding
+    if index is None:
+        index = _loaded
+    return index.embeddings[rows] @ composite.astype(np.float32)
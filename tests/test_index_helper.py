@@ -0,0 +1,20 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import index_helper as ih
+
+
+def test_union_postings_all_lists_empty():
+    # profiles whose movies have no genres: every posting list is empty
+    result = ih.union_postings(np.array([0, 0, 0]), np.array([], dtype=np.int64), [0, 1])
+    assert result.size == 0
+
+
+def test_union_postings_merges_and_dedupes():
+    offsets, flat = np.array([0, 3, 5, 5]), np.array([1, 4, 7, 4, 9])
+    assert ih.union_postings(offsets, flat, [0, 1, 2, 5]).tolist() == [1, 4, 7, 9]
+    assert ih.union_postings(offsets, flat, [2, 2]).tolist() == []
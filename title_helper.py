@@ -0,0 +1,24 @@
+import re
+import unicodedata
+
+_APOSTROPHES = re.compile(r"['‘’`]")
+_NON_ALNUM = re.compile(r"[\W_]+") # anything but a letter or digit, in any script
+
+
+def normalize_title(title: str) -> str:
+    """
+    reduces a movie title to the form stored in movies.title_normalized, so that user queries and stored titles can be
+    compared with a plain equality or prefix lookup\n
+    lowercases, strips accents, drops apostrophes ("Schindler's" -> "schindlers"), turns any other punctuation into a
+    space and collapses whitespace: "Spider-Man: No Way Home" -> "spider man no way home". letters and digits of every
+    script are kept, so "Сталкер" -> "сталкер"
+    :param title: raw movie title
+    :return: normalized title (empty string for None)
+    """
+    if not title:
+        return ''
+
+    title = unicodedata.normalize('NFKD', str(title))
+    title = ''.join(c for c in title if not unicodedata.combining(c)).lower()
+    title = _APOSTROPHES.sub('', title)
+    return _NON_ALNUM.sub(' ', title).strip()
@@ -0,0 +1,129 @@
+import sqlite3
+from typing import NamedTuple
+import numpy as np
+from scipy import sparse
+
+import database_helper as dbh
+import matrix_helper as mh
+import metrics_helper as metrics
+from logger import logger
+from title_helper import normalize_title
+
+
+
+class TitleIndex(NamedTuple):
+    # trigram_matrix is (trigrams x movies) with a 1 wherever a trigram appears in a movie's title, so the trigram
+    # overlap between a batch of queries and every title is one sparse product
+    trigram_ids: dict # trigram string -> row of trigram_matrix
+    trigram_matrix: sparse.csr_matrix
+    movie_ids: np.ndarray
+    title_sizes: np.ndarray # number of distinct trigrams per title
+    vote_weights: np.ndarray # log-scaled vote count per movie, 0..1
+
+
+# in-memory character-trigram index over normalized titles, used to suggest titles when the user makes a typo
+# a reload publishes a new TitleIndex with one assignment, and match_titles() reads it once per call
+_loaded = None
+
+MIN_SIMILARITY = 0.3 # below this a suggestion is more likely to confuse than help
+VOTE_WEIGHT = 0.1 # how much a popular title can be boosted over an equally similar obscure one
+
+
+def get_trigrams(normalized_title: str) -> set[str]:
+    # titles are padded so that the first and last characters of each word form their own trigrams ("  s", " sp", ...)
+    padded = f"  {normalized_title.replace(' ', '  ')} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def load_title_index(db_file: str = dbh.DB_FILE) -> None:
+    """
+    reads every normalized title from the database and builds the trigram matrix
+    :param db_file: location of the sqlite database
+    :return: None
+    """
+    global _loaded
+
+    conn = sqlite3.connect(db_file)
+    try:
+        result = conn.execute("SELECT id, title_normalized, vote_count FROM movies ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+    trigram_ids = {}
+    rows = []
+    indptr = [0]
+    for _, normalized, _ in result:
+        # titles that normalize to '' (only punctuation or symbols) get no trigrams, they'd all match each other
+        if normalized:
+            rows.extend(trigram_ids.setdefault(t, len(trigram_ids)) for t in get_trigrams(normalized))
+        indptr.append(len(rows))
+
+    indptr = np.array(indptr, dtype=np.int64)
+    movies_by_trigram = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), np.array(rows, dtype=np.int32), indptr),
+        shape=(len(result), len(trigram_ids))
+    )
+
+    votes = np.array([vote_count or 0 for _, _, vote_count in result], dtype=np.float64)
+    max_votes = np.log1p(votes.max()) if len(votes) and votes.max() > 0 else 1.0
+
+    _loaded = TitleIndex(
+        trigram_ids,
+        movies_by_trigram.T.tocsr(),
+        np.array([movie_id for movie_id, _, _ in result], dtype=np.int64),
+        np.diff(indptr),
+        np.log1p(votes) / max_votes
+    )
+    logger(f"Loaded title trigram index from '{db_file}': {len(result)} titles, {len(trigram_ids)} trigrams")
+
+
+def is_loaded() -> bool:
+    return _loaded is not None
+
+
+@metrics.timed("title_fuzzy")
+def match_titles(titles: list[str], n: int = 5, weight_by_votes: bool = True) -> list[list[tuple[int, float]]]:
+    """
+    finds the closest titles for every user-entered title in one batched pass\n
+    similarity is the Jaccard index of the two trigram sets, so it tolerates typos, missing letters and swapped words
+    without comparing against every title
+    :param titles: list of user-entered titles
+    :param n: number of suggestions per title (default 5)
+    :param weight_by_votes: whether to nudge well-known movies up the list (default True)
+    :return: one list of (movie id, similarity) tuples per title, best first
+    """
+    if _loaded is None:
+        load_title_index()
+    index = _loaded
+
+    query_rows = []
+    query_sizes = []
+    indptr = [0]
+    for title in titles:
+        normalized = normalize_title(title)
+        trigrams = get_trigrams(normalized) if normalized else set() # nothing to compare, no suggestions
+        query_rows.extend(index.trigram_ids[t] for t in trigrams if t in index.trigram_ids)
+        query_sizes.append(len(trigrams))
+        indptr.append(len(query_rows))
+
+    queries = sparse.csr_matrix(
+        (np.ones(len(query_rows), dtype=np.float32), np.array(query_rows, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(titles), index.trigram_matrix.shape[0])
+    )
+    shared = (queries @ index.trigram_matrix).tocsr() # (titles x movies) count of shared trigrams
+
+    results = []
+    for i in range(len(titles)):
+        start, end = shared.indptr[i], shared.indptr[i + 1]
+        movie_rows = shared.indices[start:end]
+        overlap = shared.data[start:end].astype(np.float64)
+        similarity = overlap / (query_sizes[i] + index.title_sizes[movie_rows] - overlap)
+
+        keep = similarity >= MIN_SIMILARITY
+        movie_rows, similarity = movie_rows[keep], similarity[keep]
+        ranking = similarity * (1 + VOTE_WEIGHT * index.vote_weights[movie_rows]) if weight_by_votes else similarity
+
+        order = [j for j, _ in mh.top_n(np.arange(len(ranking)), ranking, n)]
+        results.append([(int(index.movie_ids[movie_rows[j]]), float(similarity[j])) for j in order])
+
+    return results
@@ -0,0 +1,64 @@
+import json
+import numpy as np
+
+# movies.vector is stored as a BLOB: an int32 array of feature indices followed by a float32 array of the matching
+# values, both little-endian, so a vector with k non-zeros takes exactly 8*k bytes
+# the writer lives in preprocess/vector_preprocess.py (pack_sparse_row) - keep the two in sync
+INDEX_DTYPE = np.dtype('<i4')
+VALUE_DTYPE = np.dtype('<f4')
+
+
+def decode_vector_arrays(vector) -> tuple[np.ndarray, np.ndarray]:
+    """
+    decodes a single stored vector into (indices, values) numpy arrays\n
+    BLOBs are read in place with np.frombuffer, legacy JSON text is still accepted for databases that haven't been
+    migrated yet
+    :param vector: bytes (packed) or str (legacy JSON) from movies.vector
+    :return: (int32 indices, float32 values)
+    """
+    if isinstance(vector, str):
+        tmp = json.loads(vector)
+        return (np.array([int(k) for k in tmp], dtype=INDEX_DTYPE),
+                np.array(list(tmp.values()), dtype=VALUE_DTYPE))
+
+    k = len(vector) // 8
+    indices = np.frombuffer(vector, dtype=INDEX_DTYPE, count=k)
+    values = np.frombuffer(vector, dtype=VALUE_DTYPE, count=k, offset=4 * k)
+    return indices, values
+
+
+def decode_vector_dict(vector) -> dict[int, float]:
+    # dictionary form used by Movie and the 'dict' scoring path
+    if isinstance(vector, str):
+        return {int(k): v for k, v in json.loads(vector).items()}
+
+    indices, values = decode_vector_arrays(vector)
+    return dict(zip(indices.tolist(), values.tolist()))
+
+
+def decode_vector_batch(vectors: list) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    decodes many stored vectors straight into CSR arrays\n
+    packed BLOBs are joined into one buffer and split into indices/values with a single mask, so no per-row Python
+    objects are created; any legacy JSON rows fall back to decode_vector_arrays()
+    :param vectors: list of movies.vector values, in row order
+    :return: (indptr, indices, data) suitable for scipy.sparse.csr_matrix
+    """
+    if any(isinstance(v, str) for v in vectors):
+        rows = [decode_vector_arrays(v) for v in vectors]
+        lengths = np.array([len(i) for i, _ in rows], dtype=np.int64)
+        indices = np.concatenate([i for i, _ in rows]) if rows else np.empty(0, dtype=INDEX_DTYPE)
+        data = np.concatenate([v for _, v in rows]) if rows else np.empty(0, dtype=VALUE_DTYPE)
+    else:
+        lengths = np.array([len(v) // 8 for v in vectors], dtype=np.int64)
+        words = np.frombuffer(b''.join(vectors), dtype=INDEX_DTYPE)
+
+        # each row is 2*k words: the first k are indices, the next k are float32 bit patterns
+        row_starts = np.repeat(np.cumsum(2 * lengths) - 2 * lengths, 2 * lengths)
+        is_index = (np.arange(len(words)) - row_starts) < np.repeat(lengths, 2 * lengths)
+        indices = words[is_index]
+        data = words[~is_index].view(VALUE_DTYPE)
+
+    indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    return indptr, indices, data
@@ -1,7 +1,97 @@
+import threading
+import numpy as np
+
+import ann_index as ann
+import cache_helper as ch
+from CustomExceptions import InvalidListLength
 import database_helper as dbh
+import index_helper as ih
+import matrix_helper as mh
+import metrics_helper as metrics
+import svd_index as svd
+import title_index as ti
 from Movie import Movie
 from logger import logger
 
+# 'matrix' scores candidates with one sparse matrix-vector product against the in-memory CSR matrix (matrix_helper)
+# 'dict' is the original path: SQL candidate filter, decode each candidate vector and loop over cosine_similarity()
+# 'ann' only scores candidates that the LSH index (ann_index) puts near the composite vector - approximate, but the
+# work no longer grows with the size of the genre+keyword candidate set: the genre+keyword rules are checked for each
+# ANN hit through the forward index, the candidate set itself is never built
+# 'dense' scores candidates against low-rank SVD embeddings (svd_index) with one dense matrix-vector product, which
+# also rewards related keywords rather than only exact keyword overlap
+# SCORING_MODE is the default, callers can pick another mode per request
+SCORING_MODE = 'matrix'
+SCORING_MODES = ('matrix', 'dict', 'ann', 'dense')
+# 'matrix' mode first tries the precomputed movie_neighbors table (preprocess/neighbor_preprocess.py): one-movie
+# profiles are a lookup, larger profiles only score the union of their movies' neighbour lists. full scoring only runs
+# when the lists can't supply enough candidates
+USE_NEIGHBORS = True
+NEIGHBOR_LIST_SIZE = 100 # matches NUM_NEIGHBORS in preprocess/neighbor_preprocess.py
+NEIGHBOR_MIN_CANDIDATES = 4 # merged lists need at least n * this many candidates, otherwise they're "too thin"
+NEIGHBOR_MAX_PROFILE = 2 # merging is approximate, larger profiles drift further from the exact top n
+# upper bound on profiles per get_batch_recommendations() call, keeps one request from monopolizing a worker
+MAX_BATCH_PROFILES = 1000
+MAX_BATCH_N = NEIGHBOR_LIST_SIZE # upper bound on recommendations per profile in a batch call
+MAX_MOVIE_ID = int(np.iinfo(np.int64).max) # the in-memory indexes hold movie ids as int64
+
+# data version (cache_helper.get_data_version()) that the in-memory matrix and indexes reflect
+_loaded_version = None
+_reload_lock = threading.Lock()
+# data version the current request is pinned to, see pin_loaded_data()
+_pinned = threading.local()
+
+
+def is_movie_id(value) -> bool:
+    # a non-negative int the in-memory indexes can hold - bool is an int subclass, so it's ruled out explicitly
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_MOVIE_ID
+
+
+def sync_loaded_data() -> str:
+    """
+    reloads the in-memory vector matrix, inverted index and title index once a preprocess run has published new data,
+    so results - and the cache entries stored under the new version - never come from the previous run's data\n
+    the first call only records the version, app startup has just loaded everything. modules that haven't been loaded
+    yet are left to load lazily
+    :return: the data version the in-memory state reflects
+    """
+    global _loaded_version
+
+    version = ch.get_data_version()
+    if version == _loaded_version:
+        return version
+
+    with _reload_lock:
+        if _loaded_version is not None and version != _loaded_version:
+            logger(f"Data version changed from {_loaded_version} to {version}, reloading in-memory indexes", type='a')
+            if mh.is_loaded():
+                mh.load_vector_matrix()
+            if ih.is_loaded():
+                ih.load_index()
+            if ti.is_loaded():
+                ti.load_title_index()
+        _loaded_version = version
+    return version
+
+
+def pin_loaded_data() -> None:
+    """
+    pins the calling thread - a Flask request - to the data loaded right now, until unpin_loaded_data(): every lookup in
+    the request reads the same vector matrix and inverted index, even if sync_loaded_data() publishes a reload meanwhile
+    """
+    # the version is read first - it's only published once the loads it describes are in place, so cache entries are
+    # never stored under a version newer than the data they were computed from
+    _pinned.version = _loaded_version
+    mh.pin()
+    ih.pin()
+
+
+def unpin_loaded_data() -> None:
+    _pinned.version = None
+    mh.unpin()
+    ih.unpin()
+
+
 def get_composite_by_vectors(vectors: list[dict], normalize=True) -> dict[int, float]:
     """
     :param vectors: a list of sparse vectors represented as dictionaries
@@ -85,7 +175,8 @@ def cosine_similarity(vector1: dict[int, float], vector2: dict[int, float], norm
     return similarity_score / (compute_norm(vector1)*compute_norm(vector2))
 
 
-def get_recommendations_by_ids(user_movie_ids: list[int], n=5):
+@metrics.timed("recommendation")
+def get_recommendations_by_ids(user_movie_ids: list[int], n=5, mode: str = None):
     """
     this method takes in a list of movie IDs and an int n for number of results requested, takes a composite of the
     vectors for those movies, and then compares that composite vector to the vector representation of every potential
@@ -94,30 +185,222 @@ def get_recommendations_by_ids(user_movie_ids: list[int], n=5):
     movie, AND that have more than one keyword logged in the database.
     :param user_movie_ids: a list of IDs for the movies titles submitted by the user
     :param n: the number of results to return (default 5)
+    :param mode: scoring path, one of SCORING_MODES (defaults to SCORING_MODE)
     :return: a list of tuples (Movie object, similarity score as float)
     """
-    logger(f"Processing recommendation for IDs: {user_movie_ids}")
-    user_movies = dbh.get_movies_by_ids(user_movie_ids)
-    user_vectors = [m.vector for m in user_movies]
-    genre_id_set = set() # defined as a set to avoid duplicates
-    keyword_id_set = set()
-    for m in user_movies:
-        genre_id_set.update(m.genre_ids)
-        keyword_id_set.update(m.keyword_ids)
+    mode = mode or SCORING_MODE
+    if mode not in SCORING_MODES:
+        raise ValueError(f"Unknown scoring mode '{mode}', expected one of {SCORING_MODES}")
+
+    # a movie entered twice still counts once, and the order of entry doesn't matter - so equivalent submissions share
+    # one cache entry
+    user_movie_ids = sorted(set(user_movie_ids))
+    cache = ch.get_cache()
+    if cache is not None:
+        cache_key = ch.make_key(user_movie_ids, n, mode)
+        data_version = getattr(_pinned, 'version', None) or sync_loaded_data()
+        cached = cache.get(cache_key, data_version)
+        if cached is not None:
+            logger(f"Recommendation cache hit for IDs: {user_movie_ids} ({mode} scoring)")
+            return cached
+
+    logger(f"Processing recommendation for IDs: {user_movie_ids} ({mode} scoring)")
+    if mode == 'dict':
+        user_movies = dbh.get_movies_by_ids(user_movie_ids)
+        genre_id_set = set() # defined as a set to avoid duplicates
+        keyword_id_set = set()
+        for m in user_movies:
+            genre_id_set.update(m.genre_ids)
+            keyword_id_set.update(m.keyword_ids)
+        top_scores = score_by_dicts(user_movies, list(genre_id_set), list(keyword_id_set), n)
+    else:
+        top_scores = score_by_neighbors(user_movie_ids, n) if mode == 'matrix' and USE_NEIGHBORS else None
+
+        if top_scores is None:
+            # the in-memory index already knows each movie's genres and keywords, no need to hydrate the user's movies
+            genre_ids, keyword_ids = ih.get_profile_terms(user_movie_ids)
+            if mode == 'ann':
+                top_scores = score_by_ann(user_movie_ids, genre_ids, keyword_ids, n)
+            elif mode == 'dense':
+                top_scores = score_by_dense(user_movie_ids, genre_ids, keyword_ids, n)
+            else:
+                top_scores = score_by_matrix(user_movie_ids, genre_ids, keyword_ids, n)
+
+    top_movies = [movie_id for movie_id, _ in top_scores]
+    logger(f"Recommending movie IDs {top_movies}")
+    rec_scores = [score for _, score in top_scores]
+    top_movies = dbh.get_movies_by_ids(top_movies, load_vectors=False, load_keywords=False) # display fields only
+    recommendations = list(zip(top_movies, rec_scores)) # a list, not the zip iterator, so a cached result can be reused
+
+    if cache is not None:
+        cache.put(cache_key, data_version, recommendations)
+    return recommendations
+
+
+def score_by_matrix(user_movie_ids: list[int], genre_ids: list[int], keyword_ids: list[int], n: int) -> list[tuple[int, float]]:
+    """
+    finds the potential matches with the in-memory inverted index and scores them against the in-memory vector matrix
+    :return: list of (movie id, similarity score) tuples, best first
+    """
+    user_composite_vector = mh.get_composite_by_ids(user_movie_ids)
+
+    user_id_set = set(user_movie_ids)
+    candidate_ids = [m for m in ih.get_potential_match_ids(genre_ids, keyword_ids) if m not in user_id_set]
+    logger(f"Keyword+genre filter: {len(candidate_ids)} potential matches found")
+    metrics.observe_candidates('matrix', len(candidate_ids))
+
+    return mh.score_candidates(user_composite_vector, candidate_ids, n)
+
+
+def score_by_neighbors(user_movie_ids: list[int], n: int) -> list[tuple[int, float]] | None:
+    """
+    answers from the precomputed neighbour lists: a single movie's list is already its top n, several movies' lists are
+    merged and only that union is scored against the composite vector
+    :return: list of (movie id, similarity score) tuples, best first, or None if the lists are missing or too thin to use
+    """
+    unique_ids = list(dict.fromkeys(user_movie_ids))
+    if n > NEIGHBOR_LIST_SIZE or len(unique_ids) > NEIGHBOR_MAX_PROFILE:
+        return None
+    neighbors = dbh.get_neighbors_by_ids(unique_ids, NEIGHBOR_LIST_SIZE)
+    # no table, or a movie whose list hasn't been computed yet - its neighbours would be missing from the union
+    if neighbors is None or not all(neighbors.values()):
+        return None
 
-    user_composite_vector = get_composite_by_vectors(user_vectors)
+    if len(unique_ids) == 1:
+        # a list shorter than n means the movie has fewer than n scoring candidates - let full scoring decide
+        found = neighbors[unique_ids[0]]
+        return found[:n] if len(found) >= n else None
 
-    potential_matches = dbh.get_potential_matches(list(genre_id_set), list(keyword_id_set))
+    user_id_set = set(unique_ids)
+    candidate_ids = sorted({m for found in neighbors.values() for m, _ in found} - user_id_set)
+    if len(candidate_ids) < n * NEIGHBOR_MIN_CANDIDATES:
+        return None
+
+    logger(f"Neighbour lists: {len(candidate_ids)} merged candidates")
+    metrics.observe_candidates('neighbors', len(candidate_ids))
+    return mh.score_candidates(mh.get_composite_by_ids(unique_ids), candidate_ids, n)
+
+
+def score_by_ann(user_movie_ids: list[int], genre_ids: list[int], keyword_ids: list[int], n: int,
+                 tables: int = None, radius: int = None) -> list[tuple[int, float]]:
+    """
+    approximate version of score_by_matrix(): only the movies the LSH index returns for the composite vector are
+    considered, then the usual genre+keyword rules apply and the survivors are scored exactly\n
+    falls back to score_by_matrix() when there is no index for the mapped vector store
+    :param tables: number of LSH tables to probe (default ann.DEFAULT_TABLES)
+    :param radius: Hamming radius to probe within each table (default ann.DEFAULT_PROBE_RADIUS)
+    :return: list of (movie id, similarity score) tuples, best first
+    """
+    store_version = mh.get_store_version()
+    index = ann.get_index(store_version) if store_version is not None else None
+    if index is None:
+        logger("No ANN index for the current vector store, falling back to exact scoring", type='a')
+        return score_by_matrix(user_movie_ids, genre_ids, keyword_ids, n)
+
+    user_composite_vector = mh.get_composite_by_ids(user_movie_ids)
+    ann_rows = ann.query(user_composite_vector,
+                         tables=ann.DEFAULT_TABLES if tables is None else tables,
+                         radius=ann.DEFAULT_PROBE_RADIUS if radius is None else radius,
+                         index=index)
+
+    ann_ids = mh.get_ids_by_rows(ann_rows)
+    candidate_ids = ih.filter_potential_matches(ann_ids, genre_ids, keyword_ids)
+    candidate_ids = np.setdiff1d(candidate_ids, user_movie_ids)
+    logger(f"ANN retrieval: {len(ann_ids)} movies, {len(candidate_ids)} after keyword+genre filter")
+    metrics.observe_candidates('ann', len(candidate_ids))
+
+    return mh.score_candidates(user_composite_vector, candidate_ids, n)
+
+
+def score_by_dense(user_movie_ids: list[int], genre_ids: list[int], keyword_ids: list[int], n: int) -> list[tuple[int, float]]:
+    """
+    scores the usual genre+keyword candidates by cosine similarity of their SVD embeddings\n
+    falls back to score_by_matrix() when there are no embeddings for the mapped vector store
+    :return: list of (movie id, similarity score) tuples, best first
+    """
+    store_version = mh.get_store_version()
+    index = svd.get_index(store_version) if store_version is not None else None
+    if index is None:
+        logger("No SVD embeddings for the current vector store, falling back to sparse scoring", type='a')
+        return score_by_matrix(user_movie_ids, genre_ids, keyword_ids, n)
+
+    user_composite_vector = svd.get_composite_by_rows(mh.get_rows_by_ids(user_movie_ids), index)
+
+    user_id_set = set(user_movie_ids)
+    candidate_ids = [m for m in ih.get_potential_match_ids(genre_ids, keyword_ids) if m not in user_id_set]
+    logger(f"Keyword+genre filter: {len(candidate_ids)} potential matches found")
+    metrics.observe_candidates('dense', len(candidate_ids))
+
+    with metrics.timer("vector_decode"):
+        candidate_ids, rows = mh.get_candidate_rows(candidate_ids)
+    with metrics.timer("scoring"):
+        scores = svd.score_rows(user_composite_vector, rows, index)
+    with metrics.timer("top_k"):
+        return mh.top_n(candidate_ids, scores, n)
+
+
+def score_by_dicts(user_movies: list[Movie], genre_ids: list[int], keyword_ids: list[int], n: int) -> list[tuple[int, float]]:
+    """
+    original scoring path, kept so results can be compared against score_by_matrix()
+    :return: list of (movie id, similarity score) tuples, best first
+    """
+    user_composite_vector = get_composite_by_movies(user_movies)
+
+    potential_matches = dbh.get_potential_matches(genre_ids, keyword_ids)
     logger(f"Keyword+genre filter: {len(potential_matches)} potential matches found")
-    [potential_matches.pop(m) for m in user_movie_ids] # make sure that we exclude movies the user entered
+    [potential_matches.pop(m.id, None) for m in user_movies] # make sure that we exclude movies the user entered
+    metrics.observe_candidates('dict', len(potential_matches))
     recommendation_scores = {}
 
-    for k,v in potential_matches.items():
-        recommendation_scores[k] = cosine_similarity(user_composite_vector, v)
+    with metrics.timer("scoring"):
+        for k,v in potential_matches.items():
+            recommendation_scores[k] = cosine_similarity(user_composite_vector, v)
 
     # sort the movie IDs and scores by score and return them together as a list
-    top_movies = sorted(recommendation_scores, key=lambda x: recommendation_scores[x], reverse=True)[:n]
-    logger(f"Recommending movie IDs {top_movies}")
-    rec_scores = sorted(recommendation_scores.values(), reverse=True)[:n]
-    top_movies = dbh.get_movies_by_ids(top_movies)
-    return zip(top_movies, rec_scores)
+    with metrics.timer("top_k"):
+        top_movies = sorted(recommendation_scores, key=lambda x: recommendation_scores[x], reverse=True)[:n]
+    return [(movie_id, recommendation_scores[movie_id]) for movie_id in top_movies]
+
+
+def get_batch_recommendations(profiles: list[list[int]], n=5) -> list[list[dict]]:
+    """
+    batch version of get_recommendations_by_ids(): every profile's composite vector is built as one sparse matrix and
+    scored against the catalog with a single matrix-matrix product\n
+    candidates follow the same genre+keyword rules as the single-profile path
+    :param profiles: a list of movie ID lists, one per user profile
+    :param n: the number of results to return per profile (default 5)
+    :return: one list per profile of dicts with keys 'id', 'title' and 'score', best first
+    """
+    if not profiles:
+        raise InvalidListLength("At least one profile is required")
+    if len(profiles) > MAX_BATCH_PROFILES:
+        raise InvalidListLength(f"At most {MAX_BATCH_PROFILES} profiles can be scored per batch, got {len(profiles)}")
+
+    logger(f"Processing batch recommendation for {len(profiles)} profiles")
+    top_scores = score_batch(profiles, n)
+
+    # one query for every title in the batch
+    with metrics.timer("hydration"):
+        titles = dbh.get_titles_by_ids(list({movie_id for scores in top_scores for movie_id, _ in scores}))
+    return [[{"id": movie_id, "title": titles.get(movie_id), "score": score} for movie_id, score in scores]
+            for scores in top_scores]
+
+
+def score_batch(profiles: list[list[int]], n=5) -> list[list[tuple[int, float]]]:
+    """
+    scoring half of get_batch_recommendations(), without titles - it only reads the in-memory indexes, so it also works
+    outside a Flask request (see recommend_batch.py)
+    :param profiles: a list of movie ID lists, one per user profile
+    :param n: the number of results to return per profile (default 5)
+    :return: one list per profile of (movie id, similarity score) tuples, best first
+    """
+    candidate_lists = []
+    for profile in profiles:
+        genre_ids, keyword_ids = ih.get_profile_terms(profile)
+        user_id_set = set(profile)
+        candidate_lists.append([m for m in ih.get_potential_match_ids(genre_ids, keyword_ids) if m not in user_id_set])
+
+    metrics.observe_candidates('batch', sum(len(c) for c in candidate_lists))
+
+    with metrics.timer("batch_scoring"):
+        return mh.score_profiles(profiles, candidate_lists, n)
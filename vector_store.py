@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+import numpy as np
+from scipy import sparse
+
+from logger import logger
+
+# on-disk copy of the movie vector matrix, written by the preprocess pipeline and memory-mapped by the webapp so every
+# worker process shares one page-cache copy instead of building its own
+# layout: data/vector_store/CURRENT names the live version directory, e.g. data/vector_store/v3/, which holds
+# indptr.npy, indices.npy, data.npy (the CSR arrays), ids.npy (row -> movie id, ascending) and manifest.json
+STORE_DIR = 'data/vector_store'
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+KEEP_VERSIONS = 2 # the previous version stays on disk for workers that still have it mapped
+# older versions are only deleted once they've been out of service this long: a webapp worker re-maps the new version
+# on its next request, but one that has been idle since still holds the old files
+RETIRE_SECONDS = 60 * 60
+
+
+def get_current_version(store_dir: str = STORE_DIR) -> int | None:
+    # returns the live version number, or None if no store has been written yet
+    try:
+        with open(os.path.join(store_dir, CURRENT_FILE), 'r') as f:
+            return int(f.read().strip().lstrip('v'))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def get_version_dir(version: int, store_dir: str = STORE_DIR) -> str:
+    return os.path.join(store_dir, f"v{version}")
+
+
+def write_store(movie_ids: np.ndarray, matrix: sparse.csr_matrix, store_dir: str = STORE_DIR) -> int:
+    """
+    writes a new version of the vector store and then atomically points CURRENT at it
+    :param movie_ids: movie id for each matrix row, ascending
+    :param matrix: CSR matrix of movie vectors
+    :param store_dir: root directory of the store
+    :return: the new version number
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    existing = [int(d[1:]) for d in os.listdir(store_dir) if d.startswith('v') and d[1:].isdigit()]
+    version = max(existing, default=0) + 1
+
+    # indptr and indices share a dtype so scipy can wrap the mapped arrays without copying them
+    index_dtype = np.int32 if matrix.nnz < np.iinfo(np.int32).max else np.int64
+    matrix = matrix.tocsr()
+    matrix.sort_indices()
+
+    tmp_dir = os.path.join(store_dir, f".tmp_v{version}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'indptr.npy'), matrix.indptr.astype(index_dtype))
+    np.save(os.path.join(tmp_dir, 'indices.npy'), matrix.indices.astype(index_dtype))
+    np.save(os.path.join(tmp_dir, 'data.npy'), matrix.data.astype(np.float32))
+    np.save(os.path.join(tmp_dir, 'ids.npy'), np.asarray(movie_ids, dtype=np.int64))
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+        json.dump({
+            "format": FORMAT_VERSION,
+            "version": version,
+            "rows": matrix.shape[0],
+            "features": matrix.shape[1],
+            "nnz": int(matrix.nnz),
+            "created": datetime.now().isoformat(timespec='seconds'),
+        }, f, indent=2)
+    os.rename(tmp_dir, get_version_dir(version, store_dir))
+
+    tmp_current = os.path.join(store_dir, f".{CURRENT_FILE}.tmp")
+    with open(tmp_current, 'w') as f:
+        f.write(f"v{version}\n")
+    os.replace(tmp_current, os.path.join(store_dir, CURRENT_FILE))
+    logger(f"Vector store v{version} written to '{store_dir}': {matrix.shape[0]} movies, {matrix.nnz} non-zeros")
+
+    prune_versions(store_dir)
+    return version
+
+
+def prune_versions(store_dir: str = STORE_DIR) -> list[int]:
+    """
+    deletes versions older than the newest KEEP_VERSIONS that were superseded at least RETIRE_SECONDS ago. a version
+    that can't be deleted (Windows refuses while a worker still has its files mapped) is logged and left for the next
+    write to retry
+    :param store_dir: root directory of the store
+    :return: the versions deleted
+    """
+    versions = sorted(int(d[1:]) for d in os.listdir(store_dir) if d.startswith('v') and d[1:].isdigit())
+    deleted = []
+    for old, successor in zip(versions[:max(0, len(versions) - KEEP_VERSIONS)], versions[1:]):
+        # a version went out of service when its successor was written
+        retired_at = os.path.getmtime(os.path.join(get_version_dir(successor, store_dir), MANIFEST_FILE))
+        if time.time() - retired_at < RETIRE_SECONDS:
+            continue
+        try:
+            shutil.rmtree(get_version_dir(old, store_dir))
+            deleted.append(old)
+        except OSError as e:
+            logger(f"Unable to delete vector store v{old}, retrying after the next write:\n{e}", type='a')
+
+    if deleted:
+        logger(f"Deleted retired vector store versions {deleted} from '{store_dir}'")
+    return deleted
+
+
+def open_store(store_dir: str = STORE_DIR) -> tuple[int, sparse.csr_matrix, np.ndarray]:
+    """
+    memory-maps the live version of the store - nothing is read until the pages are touched, so this takes the same
+    time regardless of catalog size
+    :param store_dir: root directory of the store
+    :return: (version, read-only CSR matrix backed by the mapped files, movie id per row)
+    """
+    version = get_current_version(store_dir)
+    if version is None:
+        raise FileNotFoundError(f"No vector store found in '{store_dir}'")
+
+    version_dir = get_version_dir(version, store_dir)
+    with open(os.path.join(version_dir, MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)
+    if manifest["format"] != FORMAT_VERSION:
+        raise ValueError(f"Vector store format {manifest['format']} is not supported (expected {FORMAT_VERSION})")
+
+    arrays = {name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode='r')
+              for name in ('indptr', 'indices', 'data', 'ids')}
+    matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                               shape=(manifest["rows"], manifest["features"]), copy=False)
+    return version, matrix, arrays['ids']